@@ -0,0 +1,43 @@
+from sqlalchemy import Column, BigInteger, Integer, Float, Date, DateTime, ForeignKey
+from app.models.user import Base
+
+
+# Rollup data_hourly yang dirawat mqtt_worker (lihat example/mqtt_worker_schema.sql).
+# Kolom *_sum dibagi `hours` untuk rata-rata, sehingga agregat mingguan/bulanan
+# tetap sama dengan AVG langsung atas data_hourly.
+class DataDaily(Base):
+    __tablename__ = "data_daily"
+
+    device_id = Column(BigInteger, ForeignKey("devices.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+
+    first_id = Column(BigInteger)
+    first_datetime = Column(DateTime, nullable=False)
+    hours = Column(Integer, nullable=False)
+
+    voltage_sum = Column(Float)
+    current_sum = Column(Float)
+    power_sum = Column(Float)
+    frequency_sum = Column(Float)
+    pf_sum = Column(Float)
+    energy_max = Column(Float)
+    energy_hour_sum = Column(Float)
+
+
+class DataMonthly(Base):
+    __tablename__ = "data_monthly"
+
+    device_id = Column(BigInteger, ForeignKey("devices.id"), primary_key=True)
+    month = Column(Date, primary_key=True)
+
+    first_id = Column(BigInteger)
+    first_datetime = Column(DateTime, nullable=False)
+    hours = Column(Integer, nullable=False)
+
+    voltage_sum = Column(Float)
+    current_sum = Column(Float)
+    power_sum = Column(Float)
+    frequency_sum = Column(Float)
+    pf_sum = Column(Float)
+    energy_max = Column(Float)
+    energy_hour_sum = Column(Float)
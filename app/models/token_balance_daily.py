@@ -0,0 +1,10 @@
+from sqlalchemy import Column, BigInteger, Date, Numeric, ForeignKey
+from app.models.user import Base
+
+
+class TokenBalanceDaily(Base):
+    __tablename__ = "token_balance_daily"
+
+    device_id = Column(BigInteger, ForeignKey("devices.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    closing_balance = Column(Numeric(12, 4), nullable=False)
@@ -1,14 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from datetime import date, datetime, time
+from datetime import date, datetime, time, timedelta
 from typing import Optional, List
 
 from app.core.database import get_db
 from app.core.deps import get_current_user
 from app.models.data_hourly import DataHourly
+from app.models.data_rollup import DataDaily, DataMonthly
 from app.models.device import Device
 from app.schemas.data_hourly import DataHourlyResponse, DataHourlyListResponse
 from app.schemas.data_hourly_average import AverageDataResponse
+from app.utils.pagination import keyset_page
 from sqlalchemy import func
 
 router = APIRouter(
@@ -16,6 +18,64 @@ router = APIRouter(
     tags=["Data Hourly"]
 )
 
+
+def _rollup_columns(model, grouped: bool):
+    """Kolom rollup dengan label yang sama seperti agregasi lama atas data_hourly."""
+    if not grouped:
+        return (
+            model.first_id.label("id"),
+            model.first_datetime.label("datetime"),
+            (model.voltage_sum / model.hours).label("voltage"),
+            (model.current_sum / model.hours).label("current"),
+            (model.power_sum / model.hours).label("power"),
+            model.energy_max.label("energy"),
+            (model.frequency_sum / model.hours).label("frequency"),
+            (model.pf_sum / model.hours).label("pf"),
+            model.energy_hour_sum.label("energy_hour"),
+            model.device_id.label("device_id"),
+        )
+    hours = func.sum(model.hours)
+    return (
+        func.min(model.first_id).label("id"),
+        func.min(model.first_datetime).label("datetime"),
+        (func.sum(model.voltage_sum) / hours).label("voltage"),
+        (func.sum(model.current_sum) / hours).label("current"),
+        (func.sum(model.power_sum) / hours).label("power"),
+        func.max(model.energy_max).label("energy"),
+        (func.sum(model.frequency_sum) / hours).label("frequency"),
+        (func.sum(model.pf_sum) / hours).label("pf"),
+        func.sum(model.energy_hour_sum).label("energy_hour"),
+        func.min(model.device_id).label("device_id"),
+    )
+
+
+def _rollup_query(db: Session, device_id: int, frequency: str, start_date: date, end_date: date):
+    """Query day/week/month dari tabel rollup (data_daily/data_monthly) alih-alih GROUP BY data_hourly."""
+    daily_filters = [
+        DataDaily.device_id == device_id,
+        DataDaily.date >= start_date,
+        DataDaily.date <= end_date,
+    ]
+    if frequency == 'day':
+        return db.query(*_rollup_columns(DataDaily, False)).filter(*daily_filters).order_by(DataDaily.date.asc())
+
+    if frequency == 'month':
+        month_end = (end_date.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        if start_date.day == 1 and end_date == month_end:
+            # Rentang tepat per bulan penuh: langsung dari data_monthly
+            return db.query(*_rollup_columns(DataMonthly, False)).filter(
+                DataMonthly.device_id == device_id,
+                DataMonthly.month >= start_date,
+                DataMonthly.month <= end_date,
+            ).order_by(DataMonthly.month.asc())
+        group_expr = func.date_format(DataDaily.date, '%Y-%m')
+    else:
+        group_expr = func.yearweek(DataDaily.date, 1)
+
+    return db.query(*_rollup_columns(DataDaily, True)).filter(*daily_filters).group_by(group_expr).order_by(
+        func.min(DataDaily.date).asc()
+    )
+
 @router.get("/average", response_model=AverageDataResponse)
 def get_average_data(
     start_date: Optional[date] = None,
@@ -93,6 +153,8 @@ def get_hourly_data(
     device_id: Optional[int] = None,
     frequency: str = Query("hour", regex="^(hour|day|week|month)$"),
     get_average: bool = False,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
     user_id: int = Depends(get_current_user)
 ):
@@ -134,45 +196,40 @@ def get_hourly_data(
         DataHourly.datetime <= end_dt
     ]
 
-    if frequency == 'hour':
-        # Query DataHourly Normal
-        query = db.query(DataHourly).filter(*filters).order_by(DataHourly.datetime.asc())
-    else:
-        # Aggregation Logic
-        if frequency == 'day':
-            group_expr = func.date(DataHourly.datetime)
-            # MySQL specific for safe sorting/selecting, or generic
-        elif frequency == 'week':
-            # Group by year and week
-            group_expr = func.yearweek(DataHourly.datetime, 1)
-        elif frequency == 'month':
-            # Group by year and month
-            group_expr = func.date_format(DataHourly.datetime, '%Y-%m')
-        
-        query = db.query(
-            func.min(DataHourly.id).label("id"),
-            func.min(DataHourly.datetime).label("datetime"),
-            func.avg(DataHourly.voltage).label("voltage"),
-            func.avg(DataHourly.current).label("current"),
-            func.avg(DataHourly.power).label("power"),
-            func.max(DataHourly.energy).label("energy"),
-            func.avg(DataHourly.frequency).label("frequency"),
-            func.avg(DataHourly.pf).label("pf"),
-            func.sum(DataHourly.energy_hour).label("energy_hour"),
-            func.min(DataHourly.device_id).label("device_id") # constant
-        ).filter(*filters).group_by(group_expr).order_by(func.min(DataHourly.datetime).asc())
-
-    # Pagination
-    total = query.count()
-    
-    if limit == -1:
-        data = query.all()
-        limit = total
-        total_pages = 1
+    next_cursor = None
+    if cursor is not None:
+        # Mode cursor (opt-in): seek pada (datetime, id), COUNT hanya jika diminta
+        if frequency != 'hour':
+            raise HTTPException(status_code=400, detail="cursor is only supported for frequency=hour")
+        data, next_cursor = keyset_page(
+            db.query(DataHourly).filter(*filters),
+            [(DataHourly.datetime, False), (DataHourly.id, False)],
+            limit,
+            cursor,
+            f"hourly:{device.id}",
+        )
+        total = db.query(func.count(DataHourly.id)).filter(*filters).scalar() if include_total else None
+        total_pages = None
+        page = None
     else:
-        offset = (page - 1) * limit
-        data = query.offset(offset).limit(limit).all()
-        total_pages = (total + limit - 1) // limit if limit > 0 else 0
+        if frequency == 'hour':
+            # Query DataHourly Normal
+            query = db.query(DataHourly).filter(*filters).order_by(DataHourly.datetime.asc())
+        else:
+            # Agregasi day/week/month dari rollup yang dirawat mqtt_worker
+            query = _rollup_query(db, device.id, frequency, start_date, end_date)
+
+        # Pagination
+        total = query.count()
+
+        if limit == -1:
+            data = query.all()
+            limit = total
+            total_pages = 1
+        else:
+            offset = (page - 1) * limit
+            data = query.offset(offset).limit(limit).all()
+            total_pages = (total + limit - 1) // limit if limit > 0 else 0
 
     avg_data = {}
     if get_average:
@@ -200,6 +257,7 @@ def get_hourly_data(
         "total_pages": total_pages,
         "current_page": page,
         "data_per_page": limit,
+        "next_cursor": next_cursor,
         **avg_data,
         "data": data
     }
@@ -16,6 +16,8 @@ from app.models.token_price import TokenPrice
 from app.models.user import User
 from app.schemas.device import DeviceCreate, DeviceListResponse, DeviceUpdate, DeviceResponse, DeviceDeleteRequest
 from app.schemas.response import ApiResponse
+from app.utils.device_registry import bump_device_registry_version
+from app.utils.pagination import keyset_page
 
 router = APIRouter(
     prefix="/api/devices",
@@ -90,6 +92,7 @@ def create_device(
         price_tax=data.price_tax
     )
     db.add(device)
+    bump_device_registry_version(db)
     db.commit()
     db.refresh(device)
 
@@ -134,21 +137,31 @@ def update_device(
 def list_devices(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=-1),
+    cursor: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
     user_id: int = Depends(get_current_user)
 ):
     query = db.query(Device).filter(Device.user_id == user_id)
-    
-    total = query.count()
-    
-    if limit == -1:
-        devices = query.all()
-        limit = total
-        total_pages = 1
+
+    next_cursor = None
+    if cursor is not None:
+        # Mode cursor (opt-in): id naik sesuai urutan pembuatan device
+        devices, next_cursor = keyset_page(query, [(Device.id, False)], limit, cursor, "devices")
+        total = query.count() if include_total else None
+        total_pages = None
+        page = None
     else:
-        offset = (page - 1) * limit
-        devices = query.offset(offset).limit(limit).all()
-        total_pages = (total + limit - 1) // limit if limit > 0 else 0
+        total = query.count()
+
+        if limit == -1:
+            devices = query.all()
+            limit = total
+            total_pages = 1
+        else:
+            offset = (page - 1) * limit
+            devices = query.offset(offset).limit(limit).all()
+            total_pages = (total + limit - 1) // limit if limit > 0 else 0
 
     price_ids = {device.price_id for device in devices if device.price_id is not None}
     price_map = {}
@@ -169,6 +182,7 @@ def list_devices(
         "total_pages": total_pages,
         "current_page": page,
         "data_per_page": limit,
+        "next_cursor": next_cursor,
         "data": device_data
     }
 
@@ -226,6 +240,7 @@ def delete_device(
         raise HTTPException(status_code=405, detail="Invalid password")
 
     db.delete(device)
+    bump_device_registry_version(db)
     db.commit()
 
     return {
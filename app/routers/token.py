@@ -1,6 +1,8 @@
+import os
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import and_, case, func
 from datetime import date, datetime, time, timedelta
 from typing import Optional, List
 from app.core.database import get_db
@@ -9,6 +11,7 @@ from app.models.device import Device
 from app.models.data_hourly import DataHourly
 from app.models.token_price import TokenPrice
 from app.models.token_transaction import TokenTransaction
+from app.models.token_balance_daily import TokenBalanceDaily
 from app.schemas.token import (
     TokenTopUp,
     TokenTransactionListResponse,
@@ -18,6 +21,16 @@ from app.schemas.token import (
     TokenPriceResponse
 )
 from app.schemas.response import ApiResponse
+from app.utils.pagination import keyset_page
+from app.utils.token_balance import (
+    balance_points,
+    hourly_balance_series,
+    record_balance_checkpoint,
+    stream_balance_graph
+)
+
+# Grafik saldo frequency=hour lebih dari sekian jam dikirim sebagai streaming JSON (0 = nonaktif)
+TOKEN_GRAPH_STREAM_HOURS = max(0, int(os.getenv("TOKEN_GRAPH_STREAM_HOURS", "744")))
 
 router = APIRouter(
     prefix="/api/tokens",
@@ -60,6 +73,7 @@ def topup_token(
 
     # 2️⃣ update saldo
     device.token_balance = final_balance
+    record_balance_checkpoint(db, device.id, final_balance)
 
     db.commit()
     db.refresh(trx)
@@ -104,6 +118,7 @@ def create_correction(
 
     # 2️⃣ update saldo
     device.token_balance = data.final_balance
+    record_balance_checkpoint(db, device.id, data.final_balance)
 
     db.commit()
     db.refresh(trx)
@@ -122,20 +137,29 @@ def create_correction(
 def list_token_prices(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=-1),
+    cursor: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
     user_id: int = Depends(get_current_user)
 ):
-    query = db.query(TokenPrice).order_by(TokenPrice.id.asc())
-    total = query.count()
-
-    if limit == -1:
-        prices = query.all()
-        limit = total
-        total_pages = 1
+    next_cursor = None
+    if cursor is not None:
+        prices, next_cursor = keyset_page(db.query(TokenPrice), [(TokenPrice.id, False)], limit, cursor, "prices")
+        total = db.query(func.count(TokenPrice.id)).scalar() if include_total else None
+        total_pages = None
+        page = None
     else:
-        offset = (page - 1) * limit
-        prices = query.offset(offset).limit(limit).all()
-        total_pages = (total + limit - 1) // limit if limit > 0 else 0
+        query = db.query(TokenPrice).order_by(TokenPrice.id.asc())
+        total = query.count()
+
+        if limit == -1:
+            prices = query.all()
+            limit = total
+            total_pages = 1
+        else:
+            offset = (page - 1) * limit
+            prices = query.offset(offset).limit(limit).all()
+            total_pages = (total + limit - 1) // limit if limit > 0 else 0
 
     return {
         "code": 200,
@@ -145,6 +169,7 @@ def list_token_prices(
         "total_pages": total_pages,
         "current_page": page,
         "data_per_page": limit,
+        "next_cursor": next_cursor,
         "data": prices
     }
 
@@ -171,6 +196,7 @@ def list_token_transactions(
     end_date: Optional[date] = None,
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=-1),
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     user_id: int = Depends(get_current_user)
 ):  
@@ -184,31 +210,47 @@ def list_token_transactions(
     if end_date:
         query = query.filter(TokenTransaction.created_at <= datetime.combine(end_date, time.max))
 
-    query = query.order_by(TokenTransaction.created_at.desc())
-
-    # Fetch all data to calculate totals in memory
-    all_transactions = query.all()
-    total = len(all_transactions)
-    
-    # Calculate totals from fetched data
-    total_bought = sum((t.amount_kwh for t in all_transactions if t.amount_kwh is not None and t.type == 'topup'))
-    total_price = sum((t.price for t in all_transactions if t.price is not None and t.type == 'topup'))
-    
-    # Calculate 30-day totals
+    # Total + total 30 hari dalam satu pass SQL (conditional aggregate),
+    # hanya halaman yang diminta yang diambil dari DB
     thirty_days_ago = datetime.combine(date.today() - timedelta(days=30), time.min)
-    total_bought_30days = sum((t.amount_kwh for t in all_transactions if t.amount_kwh is not None and t.type == 'topup' and t.created_at >= thirty_days_ago))
-    total_price_30days = sum((t.price for t in all_transactions if t.price is not None and t.type == 'topup' and t.created_at >= thirty_days_ago))
+    is_topup = TokenTransaction.type == 'topup'
+    is_recent_topup = and_(is_topup, TokenTransaction.created_at >= thirty_days_ago)
+    totals = query.with_entities(
+        func.count(TokenTransaction.id).label("total"),
+        func.sum(case((is_topup, TokenTransaction.amount_kwh), else_=None)).label("bought"),
+        func.sum(case((is_topup, TokenTransaction.price), else_=None)).label("price"),
+        func.sum(case((is_recent_topup, TokenTransaction.amount_kwh), else_=None)).label("bought_30days"),
+        func.sum(case((is_recent_topup, TokenTransaction.price), else_=None)).label("price_30days"),
+    ).one()
+    total = totals.total or 0
+    total_bought = totals.bought or 0
+    total_price = totals.price or 0
+    total_bought_30days = totals.bought_30days or 0
+    total_price_30days = totals.price_30days or 0
 
     # Pagination
-    if limit == -1:
-        transactions = all_transactions
-        limit = total
-        total_pages = 1
+    next_cursor = None
+    if cursor is not None:
+        # Mode cursor (opt-in): terbaru dulu, seek pada (created_at, id)
+        transactions, next_cursor = keyset_page(
+            query,
+            [(TokenTransaction.created_at, True), (TokenTransaction.id, True)],
+            limit,
+            cursor,
+            f"transactions:{device_id}",
+        )
+        total_pages = None
+        page = None
     else:
-        start = (page - 1) * limit
-        end = start + limit
-        transactions = all_transactions[start:end]
-        total_pages = (total + limit - 1) // limit if limit > 0 else 0
+        query = query.order_by(TokenTransaction.created_at.desc())
+        if limit == -1:
+            transactions = query.all()
+            limit = total
+            total_pages = 1
+        else:
+            offset = (page - 1) * limit
+            transactions = query.offset(offset).limit(limit).all()
+            total_pages = (total + limit - 1) // limit if limit > 0 else 0
 
     return {
         "code": 200,
@@ -218,6 +260,7 @@ def list_token_transactions(
         "total_pages": total_pages,
         "current_page": page,
         "data_per_page": limit,
+        "next_cursor": next_cursor,
         "total_token_bought": total_bought,
         "total_price": total_price,
         "total_token_bought_30days": total_bought_30days,
@@ -256,14 +299,41 @@ def get_token_balance_data(
     
     # Calculate Initial Balance
     initial_balance = 0.0
-    
-    # 1. Try to find the last transaction BEFORE start_dt
-    last_txn = db.query(TokenTransaction).filter(
-        TokenTransaction.device_id == device_id,
-        TokenTransaction.created_at < start_dt
-    ).order_by(TokenTransaction.created_at.desc()).first()
 
-    if last_txn:
+    # 0. Checkpoint saldo harian terakhir sebelum start_date (satu lookup index);
+    # hanya sisa hari setelah checkpoint (biasanya kosong) yang perlu dijumlah
+    checkpoint = db.query(TokenBalanceDaily).filter(
+        TokenBalanceDaily.device_id == device_id,
+        TokenBalanceDaily.date < start_date
+    ).order_by(TokenBalanceDaily.date.desc()).first()
+
+    last_txn = None
+    if not checkpoint:
+        # 1. Try to find the last transaction BEFORE start_dt
+        last_txn = db.query(TokenTransaction).filter(
+            TokenTransaction.device_id == device_id,
+            TokenTransaction.created_at < start_dt
+        ).order_by(TokenTransaction.created_at.desc()).first()
+
+    if checkpoint:
+        # Checkpoint tanggal D mencakup pemakaian berlabel s/d D 23:00 dan top-up
+        # sebelum D 23:00 (jam terakhir ikut label D+1 00:00, lihat balance_label_date)
+        gap_start = datetime.combine(checkpoint.date + timedelta(days=1), time.min)
+        gap_usage = 0.0
+        if gap_start < start_dt:
+            gap_usage = db.query(func.sum(DataHourly.energy_hour)).filter(
+                DataHourly.device_id == device_id,
+                DataHourly.datetime >= gap_start,
+                DataHourly.datetime < start_dt
+            ).scalar() or 0.0
+        gap_topup = db.query(func.sum(TokenTransaction.amount_kwh)).filter(
+            TokenTransaction.device_id == device_id,
+            TokenTransaction.created_at >= gap_start - timedelta(hours=1),
+            TokenTransaction.created_at < start_dt
+        ).scalar() or 0.0
+
+        initial_balance = float(checkpoint.closing_balance) + float(gap_topup) - float(gap_usage)
+    elif last_txn:
         # Calculate usage between last_txn and start_dt
         gap_usage = db.query(func.sum(DataHourly.energy_hour)).filter(
             DataHourly.device_id == device_id,
@@ -371,71 +441,36 @@ def get_token_balance_data(
             })
 
     else: # hour
-        # Fetch all raw data for range
-        raw_usage = db.query(DataHourly).filter(
+        # Dua result set sempit (tanpa objek ORM), dibucket per jam dengan NumPy
+        usage_rows = db.query(DataHourly.datetime, DataHourly.energy_hour).filter(
             DataHourly.device_id == device_id,
             DataHourly.datetime >= start_dt,
             DataHourly.datetime <= end_dt
-        ).order_by(DataHourly.datetime).all()
-        
-        raw_topup = db.query(TokenTransaction).filter(
+        ).all()
+
+        txn_rows = db.query(
+            TokenTransaction.created_at,
+            TokenTransaction.amount_kwh,
+            TokenTransaction.type
+        ).filter(
             TokenTransaction.device_id == device_id,
             TokenTransaction.created_at >= start_dt,
             TokenTransaction.created_at <= end_dt
-        ).order_by(TokenTransaction.created_at).all()
-        
-        # Create buckets
-        buckets = {}
-        curr = start_dt
-        while curr <= end_dt:
-             # bucket key: start of hour
-             key = curr.replace(minute=0, second=0, microsecond=0)
-             buckets[key] = {"usage": 0.0, "topup": 0.0, "types": set()}
-             curr += timedelta(hours=1)
-             
-        # Fill buckets
-        for r in raw_usage:
-            k = r.datetime.replace(minute=0, second=0, microsecond=0)
-            if k in buckets:
-                buckets[k]["usage"] += float(r.energy_hour or 0)
-                
-        for r in raw_topup:
-            k = r.created_at.replace(minute=0, second=0, microsecond=0)
-            if k in buckets:
-                buckets[k]["topup"] += float(r.amount_kwh or 0)
-                if r.type:
-                    buckets[k]["types"].add(str(r.type))
-        
-        sorted_keys = sorted(buckets.keys())
-        for k in sorted_keys:
-            u = buckets[k]["usage"]
-            t = buckets[k]["topup"]
-            types = buckets[k]["types"]
-            
-            current_balance += t
-            current_balance -= u
-            
-            if current_balance < 0:
-                current_balance = 0.0
-            
-            if t != 0 or len(types) > 0:
-                if 'topup' in types:
-                    pt = 'topup'
-                elif 'correction' in types:
-                    pt = 'correction'
-                else:
-                    pt = 'topup'
-            else:
-                pt = 'usage'
-            
-            data_points.append({
-                "datetime": k,
-                "usage": u,
-                "topup": t,
-                "balance": current_balance,
-                "type": pt,
-                # "final_balance": current_balance
-            })
+        ).all()
+
+        hours = max(0, (end_dt - start_dt) // timedelta(hours=1) + 1)
+        series = hourly_balance_series(start_dt, hours, usage_rows, txn_rows, current_balance)
+
+        if TOKEN_GRAPH_STREAM_HOURS > 0 and hours > TOKEN_GRAPH_STREAM_HOURS:
+            # Rentang panjang: JSON dikirim bertahap tanpa validasi pydantic per titik
+            header = {
+                "code": 200,
+                "message": "Token balance graph data retrieved",
+                "token_balance": float(device.token_balance or 0),
+            }
+            return StreamingResponse(stream_balance_graph(header, series), media_type="application/json")
+
+        data_points = balance_points(series)
 
     return {
         "code": 200,
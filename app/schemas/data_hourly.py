@@ -28,6 +28,7 @@ class DataHourlyListResponse(BaseModel):
     total_pages: Optional[int] = None
     current_page: Optional[int] = None
     data_per_page: Optional[int] = None
+    next_cursor: Optional[str] = None
     avg_voltage: Optional[float] = None
     avg_current: Optional[float] = None
     avg_power: Optional[float] = None
@@ -45,4 +45,5 @@ class DeviceListResponse(BaseModel):
     total_pages: Optional[int] = None
     current_page: Optional[int] = None
     data_per_page: Optional[int] = None
+    next_cursor: Optional[str] = None
     data: Optional[List[DeviceResponse]] = None
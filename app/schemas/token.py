@@ -31,6 +31,7 @@ class TokenTransactionListResponse(BaseModel):
     total_pages: Optional[int] = None
     current_page: Optional[int] = None
     data_per_page: Optional[int] = None
+    next_cursor: Optional[str] = None
     total_token_bought: Optional[float] = None
     total_price: Optional[float] = None
     total_token_bought_30days: Optional[float] = None
@@ -69,4 +70,5 @@ class TokenPriceListResponse(BaseModel):
     total_pages: Optional[int] = None
     current_page: Optional[int] = None
     data_per_page: Optional[int] = None
+    next_cursor: Optional[str] = None
     data: Optional[List[TokenPriceResponse]] = None
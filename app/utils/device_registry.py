@@ -0,0 +1,28 @@
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.orm import Session
+
+
+logger = logging.getLogger(__name__)
+
+# MySQL ER_NO_SUCH_TABLE
+_NO_SUCH_TABLE = 1146
+
+
+def bump_device_registry_version(db: Session) -> None:
+    # mqtt_worker polling versi ini untuk membuang cache device-nya. Tabel dibuat
+    # lewat example/mqtt_worker_schema.sql; jika belum ada, create/delete device
+    # tetap jalan (worker juga menoleransi tabel yang hilang, cache habis via TTL)
+    db.flush()
+    try:
+        with db.begin_nested():
+            db.execute(text(
+                "INSERT INTO device_registry_version (id, version) VALUES (1, 1) "
+                "ON DUPLICATE KEY UPDATE version = version + 1"
+            ))
+    except ProgrammingError as exc:
+        if getattr(exc.orig, "args", (None,))[0] != _NO_SUCH_TABLE:
+            raise
+        logger.warning("device_registry_version table missing; apply example/mqtt_worker_schema.sql")
@@ -0,0 +1,69 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+
+# Pagination keyset (cursor) opt-in: klien mengirim `?cursor=` (kosong) untuk
+# halaman pertama lalu `?cursor=<next_cursor>` untuk halaman berikutnya.
+# Query mencari langsung posisi setelah baris terakhir (WHERE (a, id) > (x, y))
+# sehingga biaya per halaman konstan, tanpa OFFSET dan tanpa COUNT.
+
+
+def encode_cursor(scope: str, values: list) -> str:
+    payload = {
+        "s": scope,
+        "v": [value.isoformat() if isinstance(value, datetime) else value for value in values],
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, scope: str, keys: list) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if payload.get("s") != scope or len(payload["v"]) != len(keys):
+            raise ValueError("cursor scope mismatch")
+        values = []
+        for (column, _), value in zip(keys, payload["v"]):
+            if column.type.python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif not isinstance(value, int):
+                raise ValueError("invalid cursor value")
+            values.append(value)
+        return values
+    except (ValueError, KeyError, TypeError, AttributeError, NotImplementedError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _after(keys: list, values: list):
+    """(a, b) > (x, y) diurai menjadi a > x OR (a = x AND b > y) agar bisa range scan index."""
+    clauses = []
+    for index, (column, descending) in enumerate(keys):
+        equal_prefix = [prev == value for (prev, _), value in zip(keys[:index], values[:index])]
+        clauses.append(and_(*equal_prefix, column < values[index] if descending else column > values[index]))
+    return or_(*clauses)
+
+
+def keyset_page(query, keys: list, limit: int, cursor: str, scope: str) -> tuple[list, str | None]:
+    """Ambil satu halaman `query` (belum di-order) setelah `cursor`.
+
+    `keys`: [(kolom, descending)], kolom terakhir harus unik (biasanya id).
+    Return (rows, next_cursor); next_cursor None jika sudah halaman terakhir.
+    """
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive when using cursor")
+    if cursor:
+        query = query.filter(_after(keys, decode_cursor(cursor, scope, keys)))
+
+    order = [column.desc() if descending else column.asc() for column, descending in keys]
+    rows = query.order_by(*order).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(scope, [getattr(last, column.key) for column, _ in keys])
@@ -0,0 +1,122 @@
+import json
+import logging
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+
+logger = logging.getLogger(__name__)
+
+_HOUR = np.timedelta64(1, "h")
+_STREAM_CHUNK_POINTS = 500
+
+
+def balance_label_date(moment: datetime) -> date:
+    """Tanggal checkpoint untuk `moment`: tanggal label data_hourly (akhir jam) yang memuatnya."""
+    return (moment.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)).date()
+
+
+def record_balance_checkpoint(db: Session, device_id: int, balance, day: date | None = None) -> None:
+    # Saldo penutup hari ini ikut berubah saat top-up/koreksi; dipakai grafik saldo
+    # sebagai titik awal (lihat token_balance_daily di example/mqtt_worker_schema.sql).
+    # Best-effort di savepoint sendiri: gagal tidak boleh membatalkan top-up/koreksi
+    db.flush()
+    try:
+        with db.begin_nested():
+            db.execute(
+                text(
+                    "INSERT INTO token_balance_daily (device_id, date, closing_balance) "
+                    "VALUES (:device_id, :day, :balance) "
+                    "ON DUPLICATE KEY UPDATE closing_balance = VALUES(closing_balance)"
+                ),
+                {"device_id": device_id, "day": day or balance_label_date(datetime.now()), "balance": balance},
+            )
+    except SQLAlchemyError:
+        logger.exception("token_balance_checkpoint_failed device_id=%s", device_id)
+
+
+def _hour_index(values: list, start: np.datetime64) -> np.ndarray:
+    return (np.array(values, dtype="datetime64[s]") - start) // _HOUR
+
+
+def hourly_balance_series(start_dt: datetime, hours: int, usage_rows: list, txn_rows: list, initial_balance: float) -> dict:
+    """Grafik saldo per jam dalam bentuk array kolom.
+
+    `usage_rows`: [(datetime, energy_hour)], `txn_rows`: [(created_at, amount_kwh, type)].
+    Return dict array: datetime, usage, topup, balance, type (panjang `hours`).
+    """
+    start = np.datetime64(start_dt, "s")
+    labels = start + np.arange(hours) * _HOUR
+
+    usage = np.zeros(hours)
+    if usage_rows:
+        moments, amounts = zip(*usage_rows)
+        index = _hour_index(moments, start)
+        values = np.array([float(a or 0) for a in amounts])
+        keep = (index >= 0) & (index < hours)
+        usage = np.bincount(index[keep], weights=values[keep], minlength=hours)
+
+    topup = np.zeros(hours)
+    topup_count = np.zeros(hours, dtype=np.int64)
+    correction_count = np.zeros(hours, dtype=np.int64)
+    typed_count = np.zeros(hours, dtype=np.int64)
+    if txn_rows:
+        moments, amounts, types = zip(*txn_rows)
+        index = _hour_index(moments, start)
+        values = np.array([float(a or 0) for a in amounts])
+        kinds = np.array([str(t) if t else "" for t in types])
+        keep = (index >= 0) & (index < hours)
+        index, values, kinds = index[keep], values[keep], kinds[keep]
+        topup = np.bincount(index, weights=values, minlength=hours)
+        topup_count = np.bincount(index[kinds == "topup"], minlength=hours)
+        correction_count = np.bincount(index[kinds == "correction"], minlength=hours)
+        typed_count = np.bincount(index[kinds != ""], minlength=hours)
+
+    # Saldo dijepit di 0 tiap jam: b_k = max(0, b_{k-1} + d_k). Bentuk tertutupnya
+    # S_k - min(0, min_{j<=k} S_j) dengan S = saldo awal + cumsum(d), satu pass tanpa loop Python.
+    running = max(0.0, initial_balance) + np.cumsum(topup - usage)
+    balance = running - np.minimum(np.minimum.accumulate(running), 0.0)
+
+    has_txn = (topup != 0) | (typed_count > 0)
+    point_type = np.where(
+        has_txn & (correction_count > 0) & (topup_count == 0),
+        "correction",
+        np.where(has_txn, "topup", "usage"),
+    )
+    return {"datetime": labels, "usage": usage, "topup": topup, "balance": balance, "type": point_type}
+
+
+def balance_points(series: dict) -> list:
+    return [
+        {"datetime": moment, "usage": u, "topup": t, "balance": b, "type": pt, "final_balance": b}
+        for moment, u, t, b, pt in zip(
+            series["datetime"].astype(datetime).tolist(),
+            series["usage"].tolist(),
+            series["topup"].tolist(),
+            series["balance"].tolist(),
+            series["type"].tolist(),
+        )
+    ]
+
+
+def stream_balance_graph(header: dict, series: dict):
+    """Generator JSON berbentuk sama dengan TokenBalanceGraphResponse, titik dikirim per potongan."""
+    prefix = json.dumps(header, separators=(",", ":"))
+    yield prefix[:-1] + ',"data":['
+
+    labels = np.datetime_as_string(series["datetime"], unit="s").tolist()
+    usage = series["usage"].tolist()
+    topup = series["topup"].tolist()
+    balance = series["balance"].tolist()
+    point_type = series["type"].tolist()
+    for offset in range(0, len(labels), _STREAM_CHUNK_POINTS):
+        chunk = [
+            {"datetime": labels[i], "usage": usage[i], "topup": topup[i], "balance": balance[i], "type": point_type[i], "final_balance": balance[i]}
+            for i in range(offset, min(offset + _STREAM_CHUNK_POINTS, len(labels)))
+        ]
+        body = json.dumps(chunk, separators=(",", ":"))[1:-1]
+        yield ("," if offset else "") + body
+    yield "]}"
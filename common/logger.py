@@ -0,0 +1,295 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import traceback
+from datetime import datetime
+from threading import Lock, Thread
+from time import monotonic
+
+
+# Atribut bawaan LogRecord; sisanya dianggap field tambahan dari ContextLogger
+_RESERVED_ATTRS = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName"}
+_RESERVED_KWARGS = frozenset({"exc_info", "stack_info", "stacklevel", "extra"})
+_FLUSH_INTERVAL_SECONDS = 0.5
+
+# Output JSON tidak memakai pathname/lineno/proses, jadi lewati pencarian
+# caller (stack walk) dan info proses saat membuat record (lihat bagian
+# "Optimization" di dokumentasi logging)
+logging._srcfile = None
+logging.logMultiprocessing = False
+logging.logProcesses = False
+
+
+def _field_keys(record: logging.LogRecord):
+    """Nama field tambahan; ContextLogger mencatatnya di `_fields` agar tidak perlu scan __dict__."""
+    keys = record.__dict__.get("_fields")
+    if keys is None:
+        keys = [key for key in record.__dict__.keys() - _RESERVED_ATTRS if not key.startswith("_")]
+    return keys
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            # Waktu dari record, bukan waktu saat ditulis oleh thread writer
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exception"] = record.exc_text
+
+        record_fields = record.__dict__
+        for key in _field_keys(record):
+            payload[key] = record_fields[key]
+        if "sample_rate" in record_fields:
+            payload["sample_rate"] = record_fields["sample_rate"]
+
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class ContextLogger(logging.LoggerAdapter):
+    def process(self, msg, kwargs):
+        extra = dict(kwargs.get("extra", {}))
+        clean_kwargs = {}
+        for key, value in kwargs.items():
+            if key in _RESERVED_KWARGS:
+                clean_kwargs[key] = value
+            else:
+                extra[key] = value
+
+        extra["_fields"] = tuple(key for key in extra if key != "_fields")
+        clean_kwargs["extra"] = extra
+        return msg, clean_kwargs
+
+
+def _parse_event_settings(value: str | None) -> dict[str, float]:
+    """`event=nilai,event2=nilai` -> dict; entri yang tidak valid diabaikan."""
+    settings: dict[str, float] = {}
+    for item in (value or "").split(","):
+        event, _, number = item.partition("=")
+        try:
+            parsed = float(number)
+        except ValueError:
+            continue
+        if event.strip() and parsed > 0:
+            settings[event.strip()] = parsed
+    return settings
+
+
+class _SummaryWindow:
+    __slots__ = ("logger_name", "started", "count", "totals", "distinct")
+
+    def __init__(self, logger_name: str, started: float):
+        self.logger_name = logger_name
+        self.started = started
+        self.count = 0
+        self.totals: dict[str, float] = {}
+        self.distinct: dict[str, set] = {}
+
+
+class EventSampler(logging.Filter):
+    """Sampling dan agregasi event log di thread pemanggil (sebelum masuk antrean).
+
+    - `summaries`: event -> interval detik. Record event ini tidak ditulis;
+      sebagai gantinya `<event>_summary` berisi jumlah record, total field
+      numerik (`<field>_total`) dan jumlah nilai unik field teks
+      (`<field>_distinct`) ditulis sekali per interval.
+    - `sample_rates`: event -> N. Hanya 1 dari setiap N record yang ditulis
+      (diberi field `sample_rate`).
+
+    WARNING ke atas tidak pernah di-sampling/diagregasi.
+    """
+
+    def __init__(self, summaries: dict[str, float], sample_rates: dict[str, float]):
+        super().__init__()
+        self._summaries = summaries
+        self._sample_rates = {event: int(rate) for event, rate in sample_rates.items() if int(rate) > 1}
+        self._lock = Lock()
+        self._windows: dict[str, _SummaryWindow] = {}
+        self._sample_counters: dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        event = record.msg
+        if event in self._summaries:
+            record_fields = record.__dict__
+            with self._lock:
+                window = self._windows.get(event)
+                if window is None:
+                    window = self._windows[event] = _SummaryWindow(record.name, monotonic())
+                window.count += 1
+                for key in _field_keys(record):
+                    value = record_fields[key]
+                    if isinstance(value, bool):
+                        continue
+                    if isinstance(value, (int, float)):
+                        window.totals[key] = window.totals.get(key, 0) + value
+                    elif isinstance(value, str):
+                        window.distinct.setdefault(key, set()).add(value)
+            return False
+
+        rate = self._sample_rates.get(event)
+        if rate:
+            with self._lock:
+                counter = self._sample_counters.get(event, 0)
+                self._sample_counters[event] = counter + 1
+            if counter % rate:
+                return False
+            record.sample_rate = rate
+        return True
+
+    def collect_due(self, force: bool = False) -> list[logging.LogRecord]:
+        now = monotonic()
+        due: list[tuple[str, _SummaryWindow]] = []
+        with self._lock:
+            for event, window in list(self._windows.items()):
+                if force or now - window.started >= self._summaries[event]:
+                    due.append((event, self._windows.pop(event)))
+
+        records = []
+        for event, window in due:
+            fields = {
+                "name": window.logger_name,
+                "levelno": logging.INFO,
+                "levelname": "INFO",
+                "msg": f"{event}_summary",
+                "count": window.count,
+                "interval_seconds": round(now - window.started, 3),
+            }
+            for key, total in window.totals.items():
+                fields[f"{key}_total"] = round(total, 6)
+            for key, values in window.distinct.items():
+                fields[f"{key}_distinct"] = len(values)
+            records.append(logging.makeLogRecord(fields))
+        return records
+
+
+class NonBlockingQueueHandler(logging.Handler):
+    """Masukkan record ke antrean terbatas tanpa pernah menunggu.
+
+    Pesan dan traceback dirender di thread pemanggil (murah, tanpa JSON);
+    format JSON + tulis ke stdout dilakukan `AsyncLogWriter`. Jika antrean
+    penuh, record dibuang dan dihitung di `dropped`.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__()
+        self._queue = log_queue
+        self._dropped_lock = Lock()
+        self.dropped = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+                record.exc_info = None
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def take_dropped(self) -> int:
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class AsyncLogWriter:
+    """Thread tunggal yang mem-format dan menulis record dari antrean."""
+
+    def __init__(self, log_queue: queue.Queue, target: logging.Handler, sampler: EventSampler, source: NonBlockingQueueHandler):
+        self._queue = log_queue
+        self._target = target
+        self._sampler = sampler
+        self._source = source
+        self._thread = Thread(target=self._run, name="log-writer", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        try:
+            self._queue.put(None, timeout=5)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=5)
+        self._flush_summaries(force=True)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                record = self._queue.get(timeout=_FLUSH_INTERVAL_SECONDS)
+            except queue.Empty:
+                record = False
+            if record is None:
+                return
+            if record:
+                self._target.handle(record)
+            self._flush_summaries()
+
+    def _flush_summaries(self, force: bool = False) -> None:
+        for summary in self._sampler.collect_due(force):
+            self._target.handle(summary)
+        dropped = self._source.take_dropped()
+        if dropped:
+            self._target.handle(
+                logging.makeLogRecord(
+                    {"name": __name__, "levelno": logging.WARNING, "levelname": "WARNING", "msg": "log_records_dropped", "dropped": dropped}
+                )
+            )
+
+
+_handler_lock = Lock()
+_shared_handler: logging.Handler | None = None
+
+
+def _get_shared_handler() -> logging.Handler:
+    """Satu antrean + writer per proses, dipakai semua logger."""
+    global _shared_handler
+    with _handler_lock:
+        if _shared_handler is not None:
+            return _shared_handler
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JsonFormatter())
+        sampler = EventSampler(
+            summaries=_parse_event_settings(os.getenv("LOG_SUMMARY_EVENTS", "buffer_processed=10")),
+            sample_rates=_parse_event_settings(os.getenv("LOG_SAMPLE_EVENTS", "")),
+        )
+
+        try:
+            queue_size = max(100, int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        except ValueError:
+            queue_size = 10000
+
+        log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        handler = NonBlockingQueueHandler(log_queue)
+        handler.addFilter(sampler)
+        writer = AsyncLogWriter(log_queue, stream_handler, sampler, handler)
+        writer.start()
+        atexit.register(writer.stop)
+        _shared_handler = handler
+        return _shared_handler
+
+
+def get_logger(name: str) -> ContextLogger:
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        level = os.getenv("LOG_LEVEL", "INFO").upper()
+        logger.setLevel(level)
+        logger.addHandler(_get_shared_handler())
+        logger.propagate = False
+    return ContextLogger(logger, {})
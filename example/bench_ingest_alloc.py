@@ -0,0 +1,155 @@
+"""Microbenchmark alokasi per pesan: jalur ingest lama (dict) vs Reading + array.
+
+Jalankan dari root project:
+
+    PYTHONPATH=. python example/bench_ingest_alloc.py [jumlah_pesan]
+
+Yang diukur per pesan, mulai dari byte MQTT sampai masuk agregator menit
+(tanpa DB dan I/O file):
+- `peak_bytes`: rata-rata puncak memori sementara (tracemalloc) per pesan.
+- `us`: rata-rata waktu per pesan (tanpa tracemalloc).
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from mqtt_worker.processors.minute import MinuteAggregator
+from mqtt_worker.processors.reading import Reading
+from mqtt_worker.storage.reading_codec import decode_reading_line, encode_reading_line
+from mqtt_worker.utils.datetime import DATETIME_FORMAT, floor_minute, parse_datetime
+
+
+_LEGACY_FIELDS = ("voltage", "current", "power", "frequency", "pf")
+
+
+class LegacyMinuteAggregator:
+    """Salinan MinuteAggregator versi dict (sebelum Reading) untuk pembanding."""
+
+    def __init__(self):
+        self._minute_start = None
+        self._count = 0
+        self._sums = {field: 0.0 for field in _LEGACY_FIELDS}
+        self._energy_first = None
+        self._energy_last = None
+
+    def add(self, payload: dict, dt: datetime):
+        minute_start = floor_minute(dt)
+        if self._minute_start is None or minute_start != self._minute_start:
+            result = None
+            if self._minute_start is not None:
+                result = {
+                    "minute_mark": minute_start,
+                    "averages": {field: self._sums[field] / self._count for field in _LEGACY_FIELDS},
+                    "energy_first": self._energy_first,
+                    "energy_last": self._energy_last,
+                }
+            self._minute_start = minute_start
+            self._count = 0
+            self._sums = {field: 0.0 for field in _LEGACY_FIELDS}
+            self._energy_first = None
+            self._accumulate(payload)
+            return result
+        self._accumulate(payload)
+        return None
+
+    def _accumulate(self, payload: dict) -> None:
+        self._count += 1
+        for field in _LEGACY_FIELDS:
+            self._sums[field] += float(payload[field])
+        energy_value = float(payload["energy"])
+        if self._energy_first is None:
+            self._energy_first = energy_value
+        self._energy_last = energy_value
+
+
+def legacy_path(raw: bytes, aggregator: LegacyMinuteAggregator) -> None:
+    payload = json.loads(raw.decode("utf-8"))
+    parse_datetime(payload["datetime"])  # validasi datetime di worker
+    record = {"username": "bench", "device_code": "dev-1", "device_id": 1, "payload": payload}
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")  # FileBuffer.append
+    record = json.loads(line.strip())  # FileBuffer.process
+    payload = record["payload"]
+    dt = parse_datetime(payload["datetime"])
+    normalized_payload = dict(payload)
+    normalized_payload["energy"] = float(payload["energy"])
+    aggregator.add(normalized_payload, dt)
+
+
+def reading_path(raw: bytes, aggregator: MinuteAggregator) -> None:
+    payload = json.loads(raw)
+    reading = Reading.from_payload(1, "bench", "dev-1", payload, received_at=0.0)
+    encode_reading_line(reading, raw, payload)  # WAL append, diproses langsung (jalur cepat)
+    aggregator.add(reading, reading.energy)
+
+
+def replay_path(line: bytes, aggregator: MinuteAggregator) -> None:
+    reading = decode_reading_line(line)
+    aggregator.add(reading, reading.energy)
+
+
+def build_messages(count: int) -> list[bytes]:
+    start = datetime(2026, 1, 1, 0, 0, 0)
+    messages = []
+    for index in range(count):
+        payload = {
+            "datetime": (start + timedelta(seconds=index)).strftime(DATETIME_FORMAT),
+            "voltage": 220.1 + index % 3,
+            "current": 1.25,
+            "power": 275.1,
+            "energy": round(12.5 + index * 0.0001, 4),
+            "frequency": 50.0,
+            "pf": 0.98,
+            "uptime": index,
+        }
+        messages.append(json.dumps(payload).encode("utf-8"))
+    return messages
+
+
+def measure(name: str, run, inputs: list, factory) -> None:
+    aggregator = factory()
+    started = time.perf_counter()
+    for item in inputs:
+        run(item, aggregator)
+    elapsed = time.perf_counter() - started
+
+    aggregator = factory()
+    tracemalloc.start()
+    peak_total = 0
+    for item in inputs:
+        tracemalloc.reset_peak()
+        before_size, _ = tracemalloc.get_traced_memory()
+        run(item, aggregator)
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - before_size
+    tracemalloc.stop()
+
+    count = len(inputs)
+    print(
+        f"{name:<18} peak_bytes={peak_total / count:8.1f}  us={elapsed / count * 1e6:7.2f}"
+    )
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    messages = build_messages(count)
+    lines = [
+        encode_reading_line(Reading.from_payload(1, "bench", "dev-1", json.loads(raw)), raw, json.loads(raw))
+        for raw in messages
+    ]
+
+    print(f"messages={count}")
+    measure("legacy (dict)", legacy_path, messages, LegacyMinuteAggregator)
+    measure("reading (live)", reading_path, messages, MinuteAggregator)
+    measure("reading (replay)", replay_path, lines, MinuteAggregator)
+    print(
+        "state per aggregator: "
+        f"legacy_sums_dict={sys.getsizeof(LegacyMinuteAggregator()._sums)}B "
+        f"array_sums={sys.getsizeof(MinuteAggregator()._sums)}B"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+-- Tabel pendukung mqtt_worker
+
+-- Versi registry device. Di-bump oleh API setiap device dibuat/dihapus,
+-- di-poll oleh mqtt_worker untuk invalidasi cache device.
+CREATE TABLE IF NOT EXISTS device_registry_version (
+    id TINYINT UNSIGNED NOT NULL PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO device_registry_version (id, version) VALUES (1, 0);
+
+-- Jurnal potongan saldo token dari mqtt_worker. Primary key menjadi kunci
+-- idempotensi sehingga replay buffer tidak memotong saldo dua kali.
+-- minute_mark = label menit (mode minute) atau label jam (mode hour).
+-- Baris lama dihapus otomatis sesuai TOKEN_LEDGER_RETENTION_DAYS.
+CREATE TABLE IF NOT EXISTS token_ledger (
+    device_id BIGINT NOT NULL,
+    minute_mark DATETIME NOT NULL,
+    amount DECIMAL(12, 3) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (device_id, minute_mark),
+    KEY idx_token_ledger_minute_mark (minute_mark)
+);
+
+-- Dedupe job prediksi terjadwal dari mqtt_worker (PredictionScheduler).
+-- history_end_key diambil dari params.history_end; job manual tanpa
+-- history_end bernilai NULL sehingga tidak ikut dibatasi unique key.
+-- Sesuaikan nama tabel jika ML_PREDICTIONS_TABLE diubah.
+ALTER TABLE predictions
+    ADD COLUMN history_end_key VARCHAR(32)
+        GENERATED ALWAYS AS (
+            IF(JSON_VALID(params), JSON_UNQUOTE(JSON_EXTRACT(params, '$.history_end')), NULL)
+        ) STORED,
+    ADD UNIQUE KEY uq_predictions_schedule (device_id, type, history_end_key);
+
+-- Rollup harian/bulanan data_hourly untuk GET /api/data-hourly frequency
+-- day/week/month. Dihitung ulang per tanggal oleh mqtt_worker setiap jam
+-- ditulis; isi awal/perbaikan: python -m mqtt_worker.backfill_rollups
+-- date = DATE(label jam), sama dengan pengelompokan lama func.date(datetime).
+CREATE TABLE IF NOT EXISTS data_daily (
+    device_id BIGINT NOT NULL,
+    date DATE NOT NULL,
+    first_id BIGINT NULL,
+    first_datetime DATETIME NOT NULL,
+    hours INT NOT NULL,
+    voltage_sum DOUBLE NULL,
+    current_sum DOUBLE NULL,
+    power_sum DOUBLE NULL,
+    frequency_sum DOUBLE NULL,
+    pf_sum DOUBLE NULL,
+    energy_max DOUBLE NULL,
+    energy_hour_sum DOUBLE NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (device_id, date),
+    CONSTRAINT fk_data_daily_device FOREIGN KEY (device_id) REFERENCES devices (id) ON DELETE CASCADE
+);
+
+-- month = tanggal 1 bulan tersebut
+CREATE TABLE IF NOT EXISTS data_monthly (
+    device_id BIGINT NOT NULL,
+    month DATE NOT NULL,
+    first_id BIGINT NULL,
+    first_datetime DATETIME NOT NULL,
+    hours INT NOT NULL,
+    voltage_sum DOUBLE NULL,
+    current_sum DOUBLE NULL,
+    power_sum DOUBLE NULL,
+    frequency_sum DOUBLE NULL,
+    pf_sum DOUBLE NULL,
+    energy_max DOUBLE NULL,
+    energy_hour_sum DOUBLE NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (device_id, month),
+    CONSTRAINT fk_data_monthly_device FOREIGN KEY (device_id) REFERENCES devices (id) ON DELETE CASCADE
+);
+
+-- Checkpoint saldo token harian untuk grafik saldo (GET
+-- /api/tokens/transactions/{device_id}/data). closing_balance = saldo
+-- setelah semua pemakaian berlabel tanggal tsb (tanggal label jam data_hourly,
+-- jadi menit 23:00-23:59 ikut tanggal berikutnya). Diisi mqtt_worker saat
+-- memotong saldo dan oleh API saat top-up/koreksi. Tanggal tanpa baris
+-- memakai perhitungan lama.
+CREATE TABLE IF NOT EXISTS token_balance_daily (
+    device_id BIGINT NOT NULL,
+    date DATE NOT NULL,
+    closing_balance DECIMAL(12, 4) NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (device_id, date),
+    CONSTRAINT fk_token_balance_daily_device FOREIGN KEY (device_id) REFERENCES devices (id) ON DELETE CASCADE
+);
@@ -0,0 +1,72 @@
+import argparse
+import time
+from datetime import date, datetime, timedelta
+
+from mqtt_worker.db.connection import get_pool
+from mqtt_worker.db.repository import Repository
+from mqtt_worker.utils.logger import get_logger
+
+
+def _month_ranges(first: datetime, last: datetime):
+    """Potong [first, last] per bulan kalender agar tiap transaksi tetap kecil."""
+    current = first
+    while current <= last:
+        next_month = (current.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        yield current, min(next_month - timedelta(seconds=1), last)
+        current = next_month
+
+
+def rebuild(repo: Repository, device_ids: list[int], since: date | None = None) -> int:
+    """Bangun ulang data_daily/data_monthly dari data_hourly; return jumlah device yang diproses."""
+    logger = get_logger(__name__)
+    processed = 0
+    for device_id in device_ids:
+        bounds = repo.get_hourly_bounds(device_id)
+        if bounds is None:
+            continue
+        first, last = bounds
+        if since is not None:
+            first = max(first, datetime.combine(since, datetime.min.time()))
+        if first > last:
+            continue
+
+        started = time.perf_counter()
+        months = 0
+        for range_start, range_end in _month_ranges(first, last):
+            repo.refresh_rollups(device_id, range_start, range_end)
+            months += 1
+        processed += 1
+        logger.info(
+            "rollup_backfill_device",
+            device_id=device_id,
+            first=first.isoformat(),
+            last=last.isoformat(),
+            months=months,
+            duration_ms=round((time.perf_counter() - started) * 1000, 2),
+        )
+    return processed
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Bangun ulang tabel rollup data_daily/data_monthly dari data_hourly.")
+    parser.add_argument("--device-id", type=int, action="append", help="Batasi ke device tertentu (boleh diulang)")
+    parser.add_argument("--since", type=date.fromisoformat, help="Mulai dari tanggal ini (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    logger = get_logger(__name__)
+    repo = Repository()
+    device_ids = args.device_id or repo.get_device_ids()
+    started = time.perf_counter()
+    try:
+        processed = rebuild(repo, device_ids, args.since)
+    finally:
+        get_pool().close_all()
+    logger.info(
+        "rollup_backfill_completed",
+        devices=processed,
+        duration_seconds=round(time.perf_counter() - started, 3),
+    )
+
+
+if __name__ == "__main__":
+    main()
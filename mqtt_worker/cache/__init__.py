@@ -0,0 +1 @@
+"""Cache utilities for MQTT worker."""
\ No newline at end of file
@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from mqtt_worker.db.repository import Repository
+from mqtt_worker.utils.logger import get_logger
+
+
+class DeviceRegistry:
+    """Cache LRU+TTL untuk mapping (username, device_code) -> device.
+
+    Device yang tidak ditemukan juga di-cache (negative cache) dengan TTL
+    lebih pendek. Seluruh cache dibuang ketika versi registry di tabel
+    `device_registry_version` berubah (di-bump oleh API saat device
+    dibuat/dihapus).
+    """
+
+    def __init__(
+        self,
+        repository: Repository,
+        max_size: int = 10000,
+        ttl_seconds: float = 600.0,
+        negative_ttl_seconds: float = 60.0,
+    ):
+        self._repo = repository
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._negative_ttl_seconds = negative_ttl_seconds
+        self._logger = get_logger(__name__)
+        self._lock = Lock()
+        self._entries: OrderedDict[tuple[str, str], tuple[dict | None, float]] = OrderedDict()
+        self._version: int | None = None
+        self._version_available = True
+
+        self._hits = 0
+        self._misses = 0
+        self._negative_hits = 0
+        self._invalidations = 0
+
+    def get(self, username: str, device_code: str) -> dict | None:
+        key = (username, device_code)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                if entry[0] is None:
+                    self._negative_hits += 1
+                else:
+                    self._hits += 1
+                return entry[0]
+            self._misses += 1
+
+        device = self._repo.get_device(username, device_code)
+        ttl = self._ttl_seconds if device else self._negative_ttl_seconds
+        with self._lock:
+            self._entries[key] = (device, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+        return device
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._invalidations += 1
+
+    def poll_version(self) -> None:
+        """Cek versi registry di DB; kosongkan cache jika berubah."""
+        try:
+            version = self._repo.get_device_registry_version()
+        except Exception:
+            if self._version_available:
+                self._logger.exception("device_registry_version_unavailable")
+                self._version_available = False
+            return
+
+        self._version_available = True
+        if self._version is not None and version != self._version:
+            self.clear()
+            self._logger.info(
+                "device_registry_invalidated",
+                previous_version=self._version,
+                version=version,
+            )
+        self._version = version
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "negative_hits": self._negative_hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations,
+                "version": self._version,
+            }
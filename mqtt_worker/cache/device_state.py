@@ -0,0 +1,95 @@
+import sys
+import time
+from datetime import datetime
+from threading import Lock
+from typing import Any, Callable
+
+
+class DeviceState:
+    """Semua state in-memory worker untuk satu device_code."""
+
+    __slots__ = ("device_code", "pipeline", "last_valid_dt", "last_sync_cmd", "last_pzem_reset_cmd", "last_active")
+
+    def __init__(self, device_code: str, now: float):
+        self.device_code = device_code
+        self.pipeline: Any = None
+        self.last_valid_dt: datetime | None = None
+        self.last_sync_cmd = 0.0
+        self.last_pzem_reset_cmd = 0.0
+        self.last_active = now
+
+    def memory_bytes(self) -> int:
+        size = sys.getsizeof(self) + sys.getsizeof(self.device_code)
+        if self.last_valid_dt is not None:
+            size += sys.getsizeof(self.last_valid_dt)
+        if self.pipeline is not None:
+            size += self.pipeline.memory_bytes()
+        return size
+
+
+class DeviceStateStore:
+    """Penyimpan DeviceState per device dengan eviction device idle.
+
+    Device yang tidak mengirim pesan lebih lama dari `idle_seconds` menjadi
+    kandidat eviction (lihat `idle`). Pemanggil bertanggung jawab mem-flush
+    pipeline-nya lebih dulu, lalu memanggil `remove`. Pipeline dibuat malas
+    lewat `pipeline_factory` hanya untuk device yang benar-benar diproses.
+    """
+
+    def __init__(self, pipeline_factory: Callable[[str], Any], idle_seconds: float):
+        self._pipeline_factory = pipeline_factory
+        self._idle_seconds = idle_seconds
+        self._lock = Lock()
+        self._states: dict[str, DeviceState] = {}
+        self._evicted = 0
+
+    def get(self, device_code: str) -> DeviceState:
+        """Ambil (atau buat) state device dan tandai aktif."""
+        now = time.monotonic()
+        state = self._states.get(device_code)
+        if state is None:
+            with self._lock:
+                state = self._states.get(device_code)
+                if state is None:
+                    state = self._states[device_code] = DeviceState(device_code, now)
+        state.last_active = now
+        return state
+
+    def peek(self, device_code: str) -> DeviceState | None:
+        return self._states.get(device_code)
+
+    def pipeline(self, device_code: str) -> Any:
+        state = self.get(device_code)
+        if state.pipeline is None:
+            with self._lock:
+                if state.pipeline is None:
+                    state.pipeline = self._pipeline_factory(device_code)
+        return state.pipeline
+
+    def items(self) -> list[tuple[str, DeviceState]]:
+        with self._lock:
+            return list(self._states.items())
+
+    def idle(self, now: float | None = None) -> list[tuple[str, DeviceState]]:
+        cutoff = (time.monotonic() if now is None else now) - self._idle_seconds
+        with self._lock:
+            return [(device_code, state) for device_code, state in self._states.items() if state.last_active <= cutoff]
+
+    def remove(self, device_code: str, state: DeviceState, now: float | None = None) -> bool:
+        """Hapus state jika masih objek yang sama dan masih idle (tidak tersentuh sejak dicek)."""
+        cutoff = (time.monotonic() if now is None else now) - self._idle_seconds
+        with self._lock:
+            if self._states.get(device_code) is not state or state.last_active > cutoff:
+                return False
+            del self._states[device_code]
+            self._evicted += 1
+            return True
+
+    def stats(self) -> dict:
+        states = self.items()
+        return {
+            "devices": len(states),
+            "pipelines": sum(1 for _, state in states if state.pipeline is not None),
+            "evicted": self._evicted,
+            "memory_bytes": sys.getsizeof(self._states) + sum(state.memory_bytes() for _, state in states),
+        }
@@ -1,32 +1,275 @@
 import os
+import threading
+import time
 from contextlib import contextmanager
 
 import pymysql
 from dotenv import load_dotenv
 
+from mqtt_worker.utils.metrics import DB_STATEMENTS
+
 
 load_dotenv()
 
 
+class _CountingCursor(pymysql.cursors.DictCursor):
+    """DictCursor yang menghitung round-trip statement untuk metrik."""
+
+    def execute(self, query, args=None):
+        DB_STATEMENTS.inc()
+        return super().execute(query, args)
+
+
 def _get_config() -> dict:
     return {
         "host": os.getenv("DB_HOST"),
         "user": os.getenv("DB_USER"),
         "password": os.getenv("DB_PASS"),
         "database": os.getenv("DB_NAME"),
-        "cursorclass": pymysql.cursors.DictCursor,
+        "cursorclass": _CountingCursor,
         "autocommit": False,
     }
 
 
+def _env_int(name: str, default: int, min_value: int) -> int:
+    raw_value = os.getenv(name)
+    if raw_value is None or raw_value.strip() == "":
+        return default
+    try:
+        return max(min_value, int(raw_value))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float, min_value: float) -> float:
+    raw_value = os.getenv(name)
+    if raw_value is None or raw_value.strip() == "":
+        return default
+    try:
+        return max(min_value, float(raw_value))
+    except ValueError:
+        return default
+
+
+class PoolTimeoutError(RuntimeError):
+    pass
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used_at")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used_at = now
+
+
+class ConnectionPool:
+    """Pool koneksi MySQL terbatas (maks `max_size`) dengan health check dan recycle.
+
+    Setiap `connection()` meminjam koneksi sendiri dan commit/rollback sendiri,
+    sama seperti `get_connection()` sebelum ada pool: pemanggilan bertingkat
+    tidak ikut transaksi luarnya.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        acquire_timeout: float,
+        max_lifetime: float,
+        idle_timeout: float,
+        ping_interval: float,
+    ):
+        self._max_size = max_size
+        self._acquire_timeout = acquire_timeout
+        self._max_lifetime = max_lifetime
+        self._idle_timeout = idle_timeout
+        self._ping_interval = ping_interval
+        self._cond = threading.Condition()
+        self._idle: list[_PooledConnection] = []
+        self._size = 0
+        self._in_use = 0
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+
+    @classmethod
+    def from_env(cls) -> "ConnectionPool":
+        return cls(
+            max_size=_env_int("DB_POOL_SIZE", 8, 1),
+            acquire_timeout=_env_float("DB_POOL_TIMEOUT_SECONDS", 10.0, 0.1),
+            max_lifetime=_env_float("DB_POOL_RECYCLE_SECONDS", 3600.0, 1.0),
+            idle_timeout=_env_float("DB_POOL_IDLE_SECONDS", 300.0, 1.0),
+            ping_interval=_env_float("DB_POOL_PING_INTERVAL_SECONDS", 30.0, 0.0),
+        )
+
+    def _is_expired(self, pooled: _PooledConnection, now: float) -> bool:
+        if now - pooled.created_at > self._max_lifetime:
+            return True
+        return now - pooled.last_used_at > self._idle_timeout
+
+    def _is_healthy(self, pooled: _PooledConnection, now: float) -> bool:
+        if now - pooled.last_used_at < self._ping_interval:
+            return True
+        try:
+            pooled.conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(pooled: _PooledConnection) -> None:
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _acquire(self) -> _PooledConnection:
+        started = time.monotonic()
+        deadline = started + self._acquire_timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    pooled = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._size < self._max_size:
+                    self._size += 1
+                    self._in_use += 1
+                    pooled = None
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"no database connection available within {self._acquire_timeout:.1f}s"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+            wait_seconds = time.monotonic() - started
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_seconds_total += wait_seconds
+                if wait_seconds > self._wait_seconds_max:
+                    self._wait_seconds_max = wait_seconds
+
+        # Buka / validasi koneksi di luar lock agar thread lain tidak ikut menunggu
+        try:
+            now = time.monotonic()
+            if pooled is not None and (self._is_expired(pooled, now) or not self._is_healthy(pooled, now)):
+                self._close_quietly(pooled)
+                with self._cond:
+                    self._discarded += 1
+                pooled = None
+            if pooled is None:
+                pooled = _PooledConnection(pymysql.connect(**_get_config()))
+                with self._cond:
+                    self._created += 1
+            return pooled
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, pooled: _PooledConnection, discard: bool) -> None:
+        pooled.last_used_at = time.monotonic()
+        if discard:
+            self._close_quietly(pooled)
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+                self._discarded += 1
+            else:
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        pooled = self._acquire()
+        discard = False
+        try:
+            yield pooled.conn
+            pooled.conn.commit()
+        except Exception:
+            try:
+                pooled.conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self._release(pooled, discard or not pooled.conn.open)
+
+    def prune_idle(self) -> int:
+        """Tutup koneksi idle yang sudah melewati batas idle/lifetime."""
+        now = time.monotonic()
+        with self._cond:
+            keep = []
+            expired = []
+            for pooled in self._idle:
+                (expired if self._is_expired(pooled, now) else keep).append(pooled)
+            self._idle = keep
+            self._size -= len(expired)
+            self._discarded += len(expired)
+            if expired:
+                self._cond.notify_all()
+
+        for pooled in expired:
+            self._close_quietly(pooled)
+        return len(expired)
+
+    def close_all(self) -> None:
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+        for pooled in idle:
+            self._close_quietly(pooled)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max_size": self._max_size,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_seconds_total": round(self._wait_seconds_total, 6),
+                "wait_seconds_max": round(self._wait_seconds_max, 6),
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "discarded": self._discarded,
+            }
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool.from_env()
+    return _pool
+
+
 @contextmanager
 def get_connection():
-    conn = pymysql.connect(**_get_config())
-    try:
+    with get_pool().connection() as conn:
         yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
\ No newline at end of file
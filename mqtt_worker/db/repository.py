@@ -4,13 +4,18 @@ import re
 from datetime import datetime, timedelta
 
 from mqtt_worker.db.connection import get_connection
+from mqtt_worker.processors.reading import Averages
+from mqtt_worker.utils.datetime import floor_hour
+from mqtt_worker.utils.logger import get_logger
 
 
 _TABLE_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_BATCH_CHUNK_SIZE = 500
 
 
 class Repository:
     def __init__(self):
+        self._logger = get_logger(__name__)
         table_name = os.getenv("ML_PREDICTIONS_TABLE", "predictions").strip()
         if not table_name or not _TABLE_NAME_RE.fullmatch(table_name):
             table_name = "predictions"
@@ -28,19 +33,16 @@ class Repository:
                 cursor.execute(query, (username, device_code))
                 return cursor.fetchone()
 
-    def update_device_online(self, device_id: int, dt: datetime, uptime: int = 0) -> None:
-        query = """
-            UPDATE devices
-            SET last_online = %s,
-                up_time = %s,
-                is_active = 1
-            WHERE id = %s
-        """
+    def get_device_registry_version(self) -> int:
+        query = "SELECT version FROM device_registry_version WHERE id = 1"
         with get_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query, (dt, uptime, device_id))
+                cursor.execute(query)
+                row = cursor.fetchone()
+                return int(row["version"]) if row else 0
 
-    def update_devices_offline_status(self, device_ids: list[int]) -> None:
+    def update_devices_offline_status(self, device_ids: list[int], stale_before: datetime | None = None) -> None:
+        """Tandai offline; jika `stale_before` diisi, hanya device dengan last_online lebih lama dari itu."""
         if not device_ids:
             return
         format_strings = ",".join(["%s"] * len(device_ids))
@@ -49,47 +51,71 @@ class Repository:
             SET is_active = 0
             WHERE id IN ({format_strings}) AND is_active = 1
         """
+        values: list = list(device_ids)
+        if stale_before is not None:
+            query += " AND (last_online IS NULL OR last_online < %s)"
+            values.append(stale_before)
         with get_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query, tuple(device_ids))
+                cursor.execute(query, tuple(values))
 
-    def get_active_device_ids(self) -> list[int]:
-        query = "SELECT id FROM devices WHERE is_active = 1"
+    def get_active_devices(self) -> list[dict]:
+        query = "SELECT id, device_code, last_online FROM devices WHERE is_active = 1"
         with get_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(query)
-                return [row["id"] for row in cursor.fetchall()]
+                return cursor.fetchall()
 
-    def upsert_realtime(self, device_id: int, payload: dict, dt: datetime) -> None:
-        query = """
-            INSERT INTO data_realtime
-                (device_id, voltage, current, power, energy, frequency, pf, updated_at)
-            VALUES
-                (%s, %s, %s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                voltage = VALUES(voltage),
-                current = VALUES(current),
-                power = VALUES(power),
-                energy = VALUES(energy),
-                frequency = VALUES(frequency),
-                pf = VALUES(pf),
-                updated_at = VALUES(updated_at)
+    def write_realtime_batch(self, rows: dict[int, tuple]) -> None:
+        """Tulis banyak data realtime + status online dalam satu transaksi.
+
+        `rows`: device_id -> (voltage, current, power, energy, frequency, pf, dt, uptime)
         """
-        values = (
-            device_id,
-            payload["voltage"],
-            payload["current"],
-            payload["power"],
-            payload["energy"],
-            payload["frequency"],
-            payload["pf"],
-            dt,
-        )
+        if not rows:
+            return
+
+        items = list(rows.items())
         with get_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query, values)
+                for start in range(0, len(items), _BATCH_CHUNK_SIZE):
+                    chunk = items[start:start + _BATCH_CHUNK_SIZE]
 
-    def upsert_minutely(self, device_id: int, dt: datetime, averages: dict, energy_last: float, energy_delta: float) -> None:
+                    realtime_values = []
+                    for device_id, row in chunk:
+                        realtime_values.extend((device_id, *row[:7]))
+                    realtime_query = f"""
+                        INSERT INTO data_realtime
+                            (device_id, voltage, current, power, energy, frequency, pf, updated_at)
+                        VALUES
+                            {",".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))}
+                        ON DUPLICATE KEY UPDATE
+                            voltage = VALUES(voltage),
+                            current = VALUES(current),
+                            power = VALUES(power),
+                            energy = VALUES(energy),
+                            frequency = VALUES(frequency),
+                            pf = VALUES(pf),
+                            updated_at = VALUES(updated_at)
+                    """
+                    cursor.execute(realtime_query, tuple(realtime_values))
+
+                    case_when = " ".join(["WHEN %s THEN %s"] * len(chunk))
+                    online_query = f"""
+                        UPDATE devices
+                        SET last_online = CASE id {case_when} END,
+                            up_time = CASE id {case_when} END,
+                            is_active = 1
+                        WHERE id IN ({",".join(["%s"] * len(chunk))})
+                    """
+                    online_values = []
+                    for device_id, row in chunk:
+                        online_values.extend((device_id, row[6]))
+                    for device_id, row in chunk:
+                        online_values.extend((device_id, row[7]))
+                    online_values.extend(device_id for device_id, _ in chunk)
+                    cursor.execute(online_query, tuple(online_values))
+
+    def upsert_minutely(self, device_id: int, dt: datetime, averages: Averages, energy_last: float, energy_delta: float) -> None:
         select_query = """
             SELECT id FROM data_minutely
             WHERE device_id = %s AND datetime = %s
@@ -119,12 +145,12 @@ class Repository:
                     cursor.execute(
                         update_query,
                         (
-                            averages["voltage"],
-                            averages["current"],
-                            averages["power"],
+                            averages.voltage,
+                            averages.current,
+                            averages.power,
                             energy_last,
-                            averages["frequency"],
-                            averages["pf"],
+                            averages.frequency,
+                            averages.pf,
                             energy_delta,
                             device_id,
                             dt,
@@ -136,12 +162,12 @@ class Repository:
                         (
                             device_id,
                             dt,
-                            averages["voltage"],
-                            averages["current"],
-                            averages["power"],
+                            averages.voltage,
+                            averages.current,
+                            averages.power,
                             energy_last,
-                            averages["frequency"],
-                            averages["pf"],
+                            averages.frequency,
+                            averages.pf,
                             energy_delta,
                         ),
                     )
@@ -159,6 +185,82 @@ class Repository:
                 cursor.execute(query, (device_id,))
                 return cursor.fetchone()
 
+    def get_minutely_range(self, device_id: int, start: datetime, end: datetime) -> list[dict]:
+        query = """
+            SELECT datetime, voltage, current, power, energy, frequency, pf
+            FROM data_minutely
+            WHERE device_id = %s AND datetime >= %s AND datetime <= %s
+            ORDER BY datetime ASC
+        """
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (device_id, start, end))
+                return cursor.fetchall()
+
+    def get_hourly_datetimes(self, device_id: int, start: datetime, end: datetime) -> set[datetime]:
+        query = """
+            SELECT datetime
+            FROM data_hourly
+            WHERE device_id = %s AND datetime >= %s AND datetime <= %s
+        """
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (device_id, start, end))
+                return {row["datetime"] for row in cursor.fetchall()}
+
+    def get_last_hourly_datetime(self, device_id: int) -> datetime | None:
+        query = "SELECT MAX(datetime) AS datetime FROM data_hourly WHERE device_id = %s"
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (device_id,))
+                row = cursor.fetchone()
+                return row["datetime"] if row else None
+
+    def write_backfill(
+        self,
+        device_id: int,
+        minute_rows: list[tuple],
+        minute_delta_fixes: list[tuple[datetime, float]],
+        hour_rows: list[tuple],
+    ) -> None:
+        """Insert multi-row data_minutely/data_hourly hasil batch dalam satu transaksi.
+
+        Baris: (datetime, voltage, current, power, frequency, pf, energy, energy_delta).
+        `minute_delta_fixes`: (datetime, energy_minute) untuk baris yang sudah ada.
+        """
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                for table, delta_column, rows in (
+                    ("data_minutely", "energy_minute", minute_rows),
+                    ("data_hourly", "energy_hour", hour_rows),
+                ):
+                    for start in range(0, len(rows), _BATCH_CHUNK_SIZE):
+                        chunk = rows[start:start + _BATCH_CHUNK_SIZE]
+                        query = f"""
+                            INSERT INTO {table}
+                                (device_id, datetime, voltage, current, power, frequency, pf, energy, {delta_column})
+                            VALUES
+                                {",".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))}
+                        """
+                        values = []
+                        for row in chunk:
+                            values.extend((device_id, *row))
+                        cursor.execute(query, tuple(values))
+
+                for start in range(0, len(minute_delta_fixes), _BATCH_CHUNK_SIZE):
+                    chunk = minute_delta_fixes[start:start + _BATCH_CHUNK_SIZE]
+                    query = f"""
+                        UPDATE data_minutely
+                        SET energy_minute = CASE datetime {" ".join(["WHEN %s THEN %s"] * len(chunk))} END
+                        WHERE device_id = %s AND datetime IN ({",".join(["%s"] * len(chunk))})
+                    """
+                    values = []
+                    for dt, delta in chunk:
+                        values.extend((dt, delta))
+                    values.append(device_id)
+                    values.extend(dt for dt, _ in chunk)
+                    cursor.execute(query, tuple(values))
+
     def get_hourly_from_minutely(self, device_id: int, hour_start: datetime) -> dict | None:
         hour_end = hour_start.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
         avg_query = """
@@ -204,13 +306,13 @@ class Repository:
         energy_first = float(first_row["energy"])
         energy_last = float(last_row["energy"])
         energy_delta = energy_last - energy_first
-        averages = {
-            "voltage": float(avg_row["voltage"]),
-            "current": float(avg_row["current"]),
-            "power": float(avg_row["power"]),
-            "frequency": float(avg_row["frequency"]),
-            "pf": float(avg_row["pf"]),
-        }
+        averages = Averages(
+            voltage=float(avg_row["voltage"]),
+            current=float(avg_row["current"]),
+            power=float(avg_row["power"]),
+            frequency=float(avg_row["frequency"]),
+            pf=float(avg_row["pf"]),
+        )
         return {
             "averages": averages,
             "energy_last": energy_last,
@@ -274,20 +376,20 @@ class Repository:
         energy_before = float(prev_row["energy"])
         energy_after = float(curr_first["energy"])
         energy_delta = round((energy_after - energy_before) * 1000) / 1000
-        averages = {
-            "voltage": float(avg_row["voltage"]),
-            "current": float(avg_row["current"]),
-            "power": float(avg_row["power"]),
-            "frequency": float(avg_row["frequency"]),
-            "pf": float(avg_row["pf"]),
-        }
+        averages = Averages(
+            voltage=float(avg_row["voltage"]),
+            current=float(avg_row["current"]),
+            power=float(avg_row["power"]),
+            frequency=float(avg_row["frequency"]),
+            pf=float(avg_row["pf"]),
+        )
         return {
             "averages": averages,
             "energy_delta": energy_delta,
             "energy_after": energy_after,
         }
 
-    def upsert_hourly(self, device_id: int, dt: datetime, averages: dict, energy_last: float, energy_delta: float) -> None:
+    def upsert_hourly(self, device_id: int, dt: datetime, averages: Averages, energy_last: float, energy_delta: float) -> None:
         select_query = """
             SELECT id FROM data_hourly
             WHERE device_id = %s AND datetime = %s
@@ -317,12 +419,12 @@ class Repository:
                     cursor.execute(
                         update_query,
                         (
-                            averages["voltage"],
-                            averages["current"],
-                            averages["power"],
+                            averages.voltage,
+                            averages.current,
+                            averages.power,
                             energy_last,
-                            averages["frequency"],
-                            averages["pf"],
+                            averages.frequency,
+                            averages.pf,
                             energy_delta,
                             device_id,
                             dt,
@@ -334,60 +436,284 @@ class Repository:
                         (
                             device_id,
                             dt,
-                            averages["voltage"],
-                            averages["current"],
-                            averages["power"],
+                            averages.voltage,
+                            averages.current,
+                            averages.power,
                             energy_last,
-                            averages["frequency"],
-                            averages["pf"],
+                            averages.frequency,
+                            averages.pf,
                             energy_delta,
                         ),
                     )
 
-    def decrement_token_balance(self, device_id: int, amount: float) -> None:
-        query = """
-            UPDATE devices
-            SET token_balance = GREATEST(token_balance - %s, 0)
-            WHERE id = %s
+    def refresh_rollups(self, device_id: int, first_label: datetime, last_label: datetime) -> None:
+        """Hitung ulang data_daily (dari data_hourly) lalu data_monthly (dari data_daily).
+
+        Mencakup tanggal `first_label`..`last_label` (label jam data_hourly,
+        inklusif) beserta bulan penuhnya. Dihitung ulang dari sumber (bukan
+        ditambah) sehingga aman dipanggil berulang untuk jam yang sama.
         """
+        day_start = datetime.combine(first_label.date(), datetime.min.time())
+        day_end = datetime.combine(last_label.date(), datetime.min.time()) + timedelta(days=1)
+        month_start = day_start.replace(day=1)
+        month_end = (last_label.replace(day=1) + timedelta(days=32)).replace(day=1)
+        month_end = datetime.combine(month_end.date(), datetime.min.time())
+
+        daily_query = """
+            INSERT INTO data_daily
+                (device_id, date, first_id, first_datetime, hours,
+                 voltage_sum, current_sum, power_sum, frequency_sum, pf_sum, energy_max, energy_hour_sum)
+            SELECT device_id, DATE(datetime), MIN(id), MIN(datetime), COUNT(*),
+                   SUM(voltage), SUM(current), SUM(power), SUM(frequency), SUM(pf), MAX(energy), SUM(energy_hour)
+            FROM data_hourly
+            WHERE device_id = %s AND datetime >= %s AND datetime < %s
+            GROUP BY device_id, DATE(datetime)
+            ON DUPLICATE KEY UPDATE
+                first_id = VALUES(first_id),
+                first_datetime = VALUES(first_datetime),
+                hours = VALUES(hours),
+                voltage_sum = VALUES(voltage_sum),
+                current_sum = VALUES(current_sum),
+                power_sum = VALUES(power_sum),
+                frequency_sum = VALUES(frequency_sum),
+                pf_sum = VALUES(pf_sum),
+                energy_max = VALUES(energy_max),
+                energy_hour_sum = VALUES(energy_hour_sum)
+        """
+        monthly_query = """
+            INSERT INTO data_monthly
+                (device_id, month, first_id, first_datetime, hours,
+                 voltage_sum, current_sum, power_sum, frequency_sum, pf_sum, energy_max, energy_hour_sum)
+            SELECT device_id, DATE_SUB(date, INTERVAL DAYOFMONTH(date) - 1 DAY), MIN(first_id), MIN(first_datetime), SUM(hours),
+                   SUM(voltage_sum), SUM(current_sum), SUM(power_sum), SUM(frequency_sum), SUM(pf_sum),
+                   MAX(energy_max), SUM(energy_hour_sum)
+            FROM data_daily
+            WHERE device_id = %s AND date >= %s AND date < %s
+            GROUP BY device_id, DATE_SUB(date, INTERVAL DAYOFMONTH(date) - 1 DAY)
+            ON DUPLICATE KEY UPDATE
+                first_id = VALUES(first_id),
+                first_datetime = VALUES(first_datetime),
+                hours = VALUES(hours),
+                voltage_sum = VALUES(voltage_sum),
+                current_sum = VALUES(current_sum),
+                power_sum = VALUES(power_sum),
+                frequency_sum = VALUES(frequency_sum),
+                pf_sum = VALUES(pf_sum),
+                energy_max = VALUES(energy_max),
+                energy_hour_sum = VALUES(energy_hour_sum)
+        """
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(daily_query, (device_id, day_start, day_end))
+                cursor.execute(monthly_query, (device_id, month_start.date(), month_end.date()))
+
+    def get_hourly_bounds(self, device_id: int) -> tuple[datetime, datetime] | None:
+        query = "SELECT MIN(datetime) AS first, MAX(datetime) AS last FROM data_hourly WHERE device_id = %s"
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (device_id,))
+                row = cursor.fetchone()
+                if not row or row["first"] is None:
+                    return None
+                return row["first"], row["last"]
+
+    def get_device_ids(self) -> list[int]:
         with get_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query, (amount, device_id))
+                cursor.execute("SELECT id FROM devices ORDER BY id")
+                return [row["id"] for row in cursor.fetchall()]
 
-    def enqueue_prediction_job(self, device_id: int, prediction_type: str, history_end: datetime) -> bool:
-        if prediction_type not in ("hourly", "daily"):
-            raise ValueError("prediction_type must be 'hourly' or 'daily'")
+    def apply_token_charges(self, charges: list[tuple[int, datetime, float]]) -> int:
+        """Kurangi saldo token secara batch, idempotent per (device_id, minute_mark).
 
-        history_end_value = history_end.replace(minute=0, second=0, microsecond=0).strftime("%Y-%m-%dT%H:%M:%S")
-        params_payload = json.dumps({"history_end": history_end_value}, ensure_ascii=False, separators=(",", ":"))
+        Charge yang key-nya sudah ada di `token_ledger` dilewati sehingga replay
+        tidak memotong saldo dua kali. Return jumlah charge yang benar-benar
+        diterapkan.
+        """
+        if not charges:
+            return 0
 
-        insert_query = f"""
-            INSERT INTO {self._predictions_table}
-                (user_id, device_id, type, status, params, created_at)
-            SELECT d.user_id, d.id, %s, %s, %s, NOW()
-            FROM devices d
-            WHERE d.id = %s
-              AND NOT EXISTS (
-                SELECT 1
-                FROM {self._predictions_table}
-                WHERE user_id = d.user_id
-                  AND device_id = d.id
-                  AND type = %s
-                  AND params = %s
+        applied = 0
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                for start in range(0, len(charges), _BATCH_CHUNK_SIZE):
+                    chunk = charges[start:start + _BATCH_CHUNK_SIZE]
+
+                    existing_query = f"""
+                        SELECT device_id, minute_mark
+                        FROM token_ledger
+                        WHERE (device_id, minute_mark) IN ({",".join(["(%s, %s)"] * len(chunk))})
+                        FOR UPDATE
+                    """
+                    key_values = []
+                    for device_id, minute_mark, _ in chunk:
+                        key_values.extend((device_id, minute_mark))
+                    cursor.execute(existing_query, tuple(key_values))
+                    existing = {(row["device_id"], row["minute_mark"]) for row in cursor.fetchall()}
+
+                    new_charges = [charge for charge in chunk if (charge[0], charge[1]) not in existing]
+                    if not new_charges:
+                        continue
+
+                    insert_query = f"""
+                        INSERT INTO token_ledger (device_id, minute_mark, amount)
+                        VALUES {",".join(["(%s, %s, %s)"] * len(new_charges))}
+                    """
+                    insert_values = []
+                    totals: dict[int, float] = {}
+                    for device_id, minute_mark, amount in new_charges:
+                        insert_values.extend((device_id, minute_mark, amount))
+                        totals[device_id] = totals.get(device_id, 0.0) + amount
+                    cursor.execute(insert_query, tuple(insert_values))
+
+                    # GREATEST atas total sama dengan GREATEST per menit berurutan
+                    # karena semua amount >= 0
+                    update_query = f"""
+                        UPDATE devices
+                        SET token_balance = GREATEST(
+                            token_balance - CASE id {" ".join(["WHEN %s THEN %s"] * len(totals))} END,
+                            0
+                        )
+                        WHERE id IN ({",".join(["%s"] * len(totals))})
+                    """
+                    update_values = []
+                    for device_id, total in totals.items():
+                        update_values.extend((device_id, round(total, 3)))
+                    update_values.extend(totals.keys())
+                    cursor.execute(update_query, tuple(update_values))
+                    self._write_balance_checkpoints_safely(cursor, new_charges)
+                    applied += len(new_charges)
+        return applied
+
+    def _write_balance_checkpoints_safely(self, cursor, charges: list[tuple[int, datetime, float]]) -> None:
+        """Checkpoint grafik hanya pelengkap: gagal (misal tabel belum dibuat) cukup
+        di-rollback ke savepoint tanpa membatalkan potongan saldo."""
+        cursor.execute("SAVEPOINT balance_checkpoint")
+        try:
+            self._write_balance_checkpoints(cursor, charges)
+        except Exception:
+            self._logger.exception("token_balance_checkpoint_failed", charges=len(charges))
+            cursor.execute("ROLLBACK TO SAVEPOINT balance_checkpoint")
+        else:
+            cursor.execute("RELEASE SAVEPOINT balance_checkpoint")
+
+    @staticmethod
+    def _write_balance_checkpoints(cursor, charges: list[tuple[int, datetime, float]]) -> None:
+        """Upsert token_balance_daily per tanggal label jam charge (di transaksi yang sama).
+
+        Tanggal = DATE(label data_hourly yang memuat charge), jadi menit 23:xx
+        ikut tanggal berikutnya, sama dengan pengelompokan grafik. closing_balance
+        tanggal D = saldo setelah update + charge batch ini yang berlabel setelah
+        D, sehingga batch yang melewati tengah malam tetap mengisi D dan D+1.
+        Tanggal lampau dilewati jika lebih lama dari kemarin atau ada transaksi
+        top-up/koreksi yang lebih baru dari charge-nya: saldo sekarang sudah
+        tidak mewakili tanggal itu.
+        """
+        today = (floor_hour(datetime.now()) + timedelta(hours=1)).date()
+        oldest = today - timedelta(days=1)
+        per_device: dict[int, dict] = {}
+        for device_id, minute_mark, amount in charges:
+            day = (floor_hour(minute_mark - timedelta(minutes=1)) + timedelta(hours=1)).date()
+            if day < oldest:
+                continue
+            days = per_device.setdefault(device_id, {})
+            total, latest = days.get(day, (0.0, minute_mark))
+            days[day] = (total + amount, max(latest, minute_mark))
+        if not per_device:
+            return
+
+        placeholders = ",".join(["%s"] * len(per_device))
+        last_txn: dict[int, datetime] = {}
+        if any(day < today for days in per_device.values() for day in days):
+            cursor.execute(
+                f"""
+                SELECT device_id, MAX(created_at) AS created_at
+                FROM token_transactions
+                WHERE device_id IN ({placeholders})
+                GROUP BY device_id
+                """,
+                tuple(per_device.keys()),
             )
+            last_txn = {row["device_id"]: row["created_at"] for row in cursor.fetchall() if row["created_at"]}
+
+        cursor.execute(
+            f"SELECT id, token_balance FROM devices WHERE id IN ({placeholders})",
+            tuple(per_device.keys()),
+        )
+        rows = []
+        for row in cursor.fetchall():
+            balance = float(row["token_balance"] or 0)
+            later = 0.0
+            days = per_device[row["id"]]
+            txn_at = last_txn.get(row["id"])
+            for day in sorted(days, reverse=True):
+                total, latest = days[day]
+                if day == today or txn_at is None or txn_at <= latest:
+                    rows.append((row["id"], day, round(balance + later, 4)))
+                later += total
+        if not rows:
+            return
+
+        query = f"""
+            INSERT INTO token_balance_daily (device_id, date, closing_balance)
+            VALUES {",".join(["(%s, %s, %s)"] * len(rows))}
+            ON DUPLICATE KEY UPDATE closing_balance = VALUES(closing_balance)
         """
+        values = []
+        for row in rows:
+            values.extend(row)
+        cursor.execute(query, tuple(values))
 
+    def prune_token_ledger(self, before: datetime, limit: int = 10000) -> int:
+        query = "DELETE FROM token_ledger WHERE minute_mark < %s LIMIT %s"
         with get_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(
-                    insert_query,
-                    (
-                        prediction_type,
-                        "pending",
-                        params_payload,
-                        device_id,
-                        prediction_type,
-                        params_payload,
-                    ),
-                )
-                return int(cursor.rowcount or 0) > 0
\ No newline at end of file
+                cursor.execute(query, (before, limit))
+                return cursor.rowcount
+
+    def has_prediction_schedule_key(self) -> bool:
+        """True jika unique key dedupe job terjadwal (uq_predictions_schedule) sudah ada."""
+        query = """
+            SELECT 1
+            FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = 'uq_predictions_schedule'
+            LIMIT 1
+        """
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (self._predictions_table,))
+                return cursor.fetchone() is not None
+
+    def enqueue_prediction_jobs(self, jobs: list[tuple[int, str, datetime]]) -> int:
+        """Enqueue banyak job prediksi (device_id, type, history_end) sekaligus.
+
+        Dedupe lewat unique key (device_id, type, history_end_key), kolom
+        generated dari params.history_end (lihat example/mqtt_worker_schema.sql).
+        Return jumlah job yang benar-benar baru.
+        """
+        inserted = 0
+        for index in range(0, len(jobs), _BATCH_CHUNK_SIZE):
+            chunk = jobs[index:index + _BATCH_CHUNK_SIZE]
+            rows_sql = " UNION ALL ".join(["SELECT %s AS device_id, %s AS type, %s AS params"] * len(chunk))
+            values: list = []
+            for device_id, prediction_type, history_end in chunk:
+                if prediction_type not in ("hourly", "daily"):
+                    raise ValueError("prediction_type must be 'hourly' or 'daily'")
+                history_end_value = history_end.replace(minute=0, second=0, microsecond=0).strftime("%Y-%m-%dT%H:%M:%S")
+                params_payload = json.dumps({"history_end": history_end_value}, ensure_ascii=False, separators=(",", ":"))
+                values.extend((device_id, prediction_type, params_payload))
+
+            insert_query = f"""
+                INSERT INTO {self._predictions_table}
+                    (user_id, device_id, type, status, params, created_at)
+                SELECT d.user_id, d.id, j.type, 'pending', j.params, NOW()
+                FROM ({rows_sql}) j
+                JOIN devices d ON d.id = j.device_id
+                ON DUPLICATE KEY UPDATE
+                    {self._predictions_table}.status = {self._predictions_table}.status
+            """
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(insert_query, values)
+                    inserted += int(cursor.rowcount or 0)
+        return inserted
\ No newline at end of file
@@ -1,28 +1,51 @@
+import dataclasses
 import json
 import os
+import sys
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Callable, Optional, Tuple
 
+import numpy as np
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 
+from mqtt_worker.cache.device_registry import DeviceRegistry
+from mqtt_worker.cache.device_state import DeviceStateStore
+from mqtt_worker.db.connection import get_pool
 from mqtt_worker.db.repository import Repository
 from mqtt_worker.mqtt.client import create_client
+from mqtt_worker.mqtt.dispatcher import OVERFLOW_POLICIES, IngestDispatcher
+from mqtt_worker.mqtt.sharding import ShardConfig
 from mqtt_worker.mqtt.subscriber import Subscriber
-from mqtt_worker.processors.hourly import HourlyProcessor
-from mqtt_worker.processors.minute import MinuteAggregator
+from mqtt_worker.processors.batch import BatchProcessor
+from mqtt_worker.processors.hourly import HourlyAccumulator, HourlyProcessor
+from mqtt_worker.processors.minute import MinuteAggregate, MinuteAggregator
+from mqtt_worker.processors.prediction_scheduler import PredictionScheduler
+from mqtt_worker.processors.reading import Reading
+from mqtt_worker.processors.reading_batch import ReadingBatch, parse_batch
 from mqtt_worker.processors.realtime import RealtimeProcessor
-from mqtt_worker.storage.file_buffer import FileBuffer, ProcessDecision
+from mqtt_worker.processors.token_ledger import TokenLedger
+from mqtt_worker.storage.drain import BufferDrainer
+from mqtt_worker.storage.file_buffer import BufferResult, FileBuffer, ProcessDecision
+from mqtt_worker.storage.reading_codec import decode_reading_line, encode_reading_line
 from mqtt_worker.storage.recovery import RecoveryManager
+from mqtt_worker.storage.snapshot import SnapshotStore
 from mqtt_worker.utils.datetime import floor_hour, parse_datetime
+from mqtt_worker.utils.expiry import ExpiryScheduler
 from mqtt_worker.utils.logger import get_logger
+from mqtt_worker.utils.metrics import DEVICE_COMMANDS, INGEST_MESSAGES, REGISTRY, STAGE_SECONDS
 
 
 load_dotenv()
 
 TOPIC_WILDCARD = os.getenv("MQTT_TOPIC_WILDCARD", "/siwatt-mqtt/+/swm-raw/+")
 TOPIC_MODE = os.getenv("MQTT_TOPIC_MODE", "prefixed").lower()
+BATCH_TOPIC_WILDCARD = os.getenv(
+	"MQTT_BATCH_TOPIC_WILDCARD",
+	"+/swm-batch/+" if TOPIC_MODE == "simple" else "/siwatt-mqtt/+/swm-batch/+",
+).strip()
+TOPIC_KINDS = ("swm-raw", "swm-batch")
 
 
 def _is_enabled(value: str | None, default: bool = False) -> bool:
@@ -88,11 +111,40 @@ def _parse_min_int(value: str | None, default: int, minimum: int) -> int:
 
 
 class AggregationPipeline:
+	__slots__ = (
+		"_repo",
+		"_realtime",
+		"_hourly",
+		"_ledger",
+		"_batch",
+		"_predictions",
+		"_logger",
+		"_minute_agg",
+		"_hourly_acc",
+		"_device_id",
+		"_last_processed_dt",
+		"_balance_mode",
+		"_prediction_hourly_enabled",
+		"_prediction_hourly_trigger",
+		"_prediction_daily_enabled",
+		"_prediction_daily_trigger",
+		"_pzem_overflow_after_hourly_handler",
+		"_ignore_previous_energy_reference",
+		"_energy_reset_reference",
+		"_energy_reset_active",
+		"_datetime_reset_requested",
+		"_last_minutely",
+		"_last_minutely_loaded",
+	)
+
 	def __init__(
 		self,
 		repo: Repository,
 		realtime: RealtimeProcessor,
 		hourly: HourlyProcessor,
+		ledger: TokenLedger,
+		batch: BatchProcessor,
+		predictions: PredictionScheduler,
 		logger,
 		balance_mode: str,
 		prediction_hourly_enabled: bool,
@@ -104,8 +156,13 @@ class AggregationPipeline:
 		self._repo = repo
 		self._realtime = realtime
 		self._hourly = hourly
+		self._ledger = ledger
+		self._batch = batch
+		self._predictions = predictions
 		self._logger = logger
 		self._minute_agg = MinuteAggregator()
+		self._hourly_acc = HourlyAccumulator()
+		self._device_id: int | None = None
 		self._last_processed_dt = None
 		self._balance_mode = balance_mode
 		self._prediction_hourly_enabled = prediction_hourly_enabled
@@ -116,24 +173,22 @@ class AggregationPipeline:
 		self._ignore_previous_energy_reference = False
 		self._energy_reset_reference: float | None = None
 		self._energy_reset_active = False
+		self._datetime_reset_requested = False
+		# Baris minutely terakhir yang ditulis pipeline ini: (minute_mark, energy)
+		self._last_minutely: tuple[datetime, float] | None = None
+		self._last_minutely_loaded = False
 
 	@staticmethod
 	def _is_trigger_match(hour_mark: datetime, trigger: tuple[int, int]) -> bool:
 		return hour_mark.hour == trigger[0] and hour_mark.minute == trigger[1]
 
 	def _enqueue_prediction_job(self, device_id: int, prediction_type: str, history_end: datetime) -> None:
+		# Hanya dicatat; PredictionScheduler meng-insert semua device dalam satu batch
 		try:
-			inserted = self._repo.enqueue_prediction_job(device_id, prediction_type, history_end)
-			if inserted:
-				self._logger.info(
-					"prediction_job_enqueued",
-					device_id=device_id,
-					prediction_type=prediction_type,
-					history_end=history_end.strftime("%Y-%m-%dT%H:%M:%S"),
-				)
+			self._predictions.schedule(device_id, prediction_type, history_end)
 		except Exception:
 			self._logger.exception(
-				"prediction_job_enqueue_failed",
+				"prediction_job_schedule_failed",
 				device_id=device_id,
 				prediction_type=prediction_type,
 				history_end=history_end.strftime("%Y-%m-%dT%H:%M:%S"),
@@ -146,6 +201,14 @@ class AggregationPipeline:
 		"""
 		self._last_processed_dt = None
 		self._minute_agg = MinuteAggregator()
+		self._hourly_acc.reset()
+		self._last_minutely_loaded = False
+
+	def request_datetime_reset(self):
+		"""Minta reset_datetime_state dari thread lain.
+		Reset dijalankan di awal handle berikutnya, di thread yang memproses device ini.
+		"""
+		self._datetime_reset_requested = True
 
 	def mark_energy_reset_event(self):
 		"""Reset state agregasi setelah device reset energi ke 0 kWh.
@@ -153,9 +216,46 @@ class AggregationPipeline:
 		"""
 		self._last_processed_dt = None
 		self._minute_agg = MinuteAggregator()
+		self._hourly_acc.reset()
 		self._ignore_previous_energy_reference = True
 		self._energy_reset_reference = None
 		self._energy_reset_active = True
+		self._last_minutely_loaded = False
+
+	def export_state(self) -> dict:
+		"""State in-memory pipeline untuk snapshot (harus dipanggil di bawah lock buffer device)."""
+		return {
+			"last_processed_dt": self._last_processed_dt.isoformat() if self._last_processed_dt else None,
+			"minute": self._minute_agg.state(),
+			"ignore_previous_energy_reference": self._ignore_previous_energy_reference,
+			"energy_reset_reference": self._energy_reset_reference,
+			"energy_reset_active": self._energy_reset_active,
+			"datetime_reset_requested": self._datetime_reset_requested,
+		}
+
+	def restore_state(self, state: dict, include_position: bool) -> None:
+		"""Pulihkan state dari snapshot.
+
+		Referensi reset energy selalu dipulihkan. Bucket menit dan
+		`_last_processed_dt` hanya jika posisi WAL cocok dengan snapshot;
+		jika tidak, record dari checkpoint di-replay seperti biasa.
+		"""
+		self._ignore_previous_energy_reference = bool(state.get("ignore_previous_energy_reference"))
+		self._energy_reset_reference = state.get("energy_reset_reference")
+		self._energy_reset_active = bool(state.get("energy_reset_active"))
+		self._datetime_reset_requested = bool(state.get("datetime_reset_requested"))
+		if include_position:
+			last_processed_dt = state.get("last_processed_dt")
+			self._last_processed_dt = datetime.fromisoformat(last_processed_dt) if last_processed_dt else None
+			self._minute_agg = MinuteAggregator.from_state(state.get("minute"))
+
+	def _get_last_minutely(self, device_id: int) -> tuple[datetime, float] | None:
+		"""Baseline energy menit sebelumnya; DB hanya dibaca sekali setelah dibuat/reset."""
+		if not self._last_minutely_loaded:
+			last_row = self._repo.get_last_minutely(device_id)
+			self._last_minutely = (last_row["datetime"], float(last_row["energy"])) if last_row else None
+			self._last_minutely_loaded = True
+		return self._last_minutely
 
 	def _normalize_energy_after_reset(self, energy_raw: float) -> float:
 		"""Normalisasi energy agar pembacaan setelah reset dimulai dari 0."""
@@ -168,51 +268,144 @@ class AggregationPipeline:
 
 		return max(0.0, round(energy_raw - self._energy_reset_reference, 3))
 
-	def handle(self, record: dict) -> ProcessDecision:
-		try:
-			payload = record["payload"]
-			dt = parse_datetime(payload["datetime"])
-			device_id = record["device_id"]
-			username = record["username"]
-			device_code = record["device_code"]
-		except Exception:
-			self._logger.exception("record_parse_failed", record=record)
-			return ProcessDecision(success=False)
+	def _normalize_batch_after_reset(self, batch: ReadingBatch) -> ReadingBatch:
+		"""Versi kolom dari _normalize_energy_after_reset untuk energy batch."""
+		if not self._energy_reset_active or not len(batch):
+			return batch
+
+		if self._energy_reset_reference is None:
+			self._energy_reset_reference = float(batch.energy[0])
+
+		energy = np.maximum(np.round(batch.energy - self._energy_reset_reference, 3), 0.0)
+		return dataclasses.replace(batch, energy=energy)
+
+	def _handle_batch(self, batch: ReadingBatch) -> ProcessDecision:
+		"""Backfill dari topic swm-batch: ditulis langsung ke minutely/hourly.
+
+		Trigger prediksi dan auto reset PZEM tidak dijalankan untuk data historis.
+		"""
+		batch = self._normalize_batch_after_reset(batch)
 
 		try:
-			raw_energy = float(payload["energy"])
+			result = self._batch.handle(batch)
 		except Exception:
-			self._logger.exception("energy_parse_failed", record=record)
+			self._logger.exception("batch_process_failed", device_id=batch.device_id, readings=len(batch))
 			return ProcessDecision(success=False)
 
-		normalized_payload = dict(payload)
-		normalized_payload["energy"] = self._normalize_energy_after_reset(raw_energy)
+		last_dt = batch.last_dt
+		if last_dt is not None:
+			# Menit yang sedang dibuka bisa sudah terisi batch; mulai ulang dari pesan live berikutnya
+			self._minute_agg.discard_if_started_before(last_dt)
+			if self._last_processed_dt is None or self._last_processed_dt < last_dt:
+				self._last_processed_dt = last_dt
+		# Jam yang sedang diakumulasi mungkin berubah isinya; fallback SQL untuk jam ini
+		self._hourly_acc.reset()
+		self._last_minutely_loaded = False
+
+		self._logger.info(
+			"batch_processed",
+			device_id=batch.device_id,
+			readings=len(batch),
+			dropped=batch.dropped,
+			minutes_inserted=result.minutes_inserted,
+			minutes_skipped=result.minutes_skipped,
+			hours_inserted=result.hours_inserted,
+			charges=result.charges,
+		)
+		return ProcessDecision(success=True)
+
+	def handle(self, reading: Reading | ReadingBatch) -> ProcessDecision:
+		if self._datetime_reset_requested:
+			self._datetime_reset_requested = False
+			self.reset_datetime_state()
+
+		if isinstance(reading, ReadingBatch):
+			return self._handle_batch(reading)
+
+		dt = reading.dt
+		device_id = reading.device_id
+		username = reading.username
+		device_code = reading.device_code
+		energy = self._normalize_energy_after_reset(reading.energy)
 
 		if self._last_processed_dt and dt <= self._last_processed_dt:
 			return ProcessDecision(success=True)
 
-		if not self._realtime.handle(device_id, normalized_payload, dt):
+		if not self._realtime.handle(reading, energy):
 			return ProcessDecision(success=False)
 
-		aggregate = self._minute_agg.add(normalized_payload, dt)
+		aggregate = self._minute_agg.add(reading, energy)
 		self._last_processed_dt = dt
+		self._device_id = device_id
 
 		if not aggregate:
 			return ProcessDecision(success=True)
 
+		return self._persist_minute(aggregate, device_id, floor_hour(dt), username, device_code, checkpoint_offset=-1)
+
+	def flush(self) -> ProcessDecision:
+		"""Tulis bucket menit yang masih terbuka (sebelum pipeline di-evict karena idle).
+
+		Label menit = awal menit berikutnya, dan baris jam bucket tersebut
+		ikut ditulis karena pipeline ini tidak akan melihat pergantian jamnya.
+		Auto reset PZEM tidak dijalankan. Jika gagal, bucket dikembalikan.
+		"""
+		state = self._minute_agg.state()
+		aggregate = self._minute_agg.flush()
+		if aggregate is None or self._device_id is None:
+			return ProcessDecision(success=True, checkpoint_offset=0)
+
+		decision = self._persist_minute(
+			aggregate, self._device_id, aggregate.bucket_hour + timedelta(hours=1), None, None, checkpoint_offset=0
+		)
+		if not decision.success:
+			self._minute_agg = MinuteAggregator.from_state(state)
+		return decision
+
+	def is_evictable(self) -> bool:
+		# Referensi reset energy hanya ada di memori; pipeline ini tidak boleh dibuang
+		if self._energy_reset_active:
+			return False
+		minute_start = self._minute_agg.minute_start
+		if self._balance_mode == "hour" and minute_start is not None:
+			# flush menulis jam bucket sebagai jam penuh dan memotong saldo dengan kunci
+			# ledger jam tersebut; tunggu jamnya benar-benar tutup (plus toleransi jam
+			# device) agar sisa jam dari pipeline baru tidak dibuang sebagai duplikat
+			hour_closed = floor_hour(minute_start) + timedelta(hours=1, seconds=_DATETIME_MAX_PAST_SECONDS)
+			return datetime.now() >= hour_closed
+		return True
+
+	def memory_bytes(self) -> int:
+		"""Perkiraan memori state pipeline (tanpa objek bersama seperti repo/logger)."""
+		size = sys.getsizeof(self) + self._minute_agg.memory_bytes() + self._hourly_acc.memory_bytes()
+		if self._last_processed_dt is not None:
+			size += sys.getsizeof(self._last_processed_dt)
+		if self._last_minutely is not None:
+			size += sys.getsizeof(self._last_minutely) + sum(sys.getsizeof(value) for value in self._last_minutely)
+		return size
+
+	def _persist_minute(
+		self,
+		aggregate: MinuteAggregate,
+		device_id: int,
+		current_hour: datetime,
+		username: str | None,
+		device_code: str | None,
+		checkpoint_offset: int,
+	) -> ProcessDecision:
 		energy_before = aggregate.energy_first
 		if self._ignore_previous_energy_reference:
 			self._ignore_previous_energy_reference = False
 		else:
 			try:
-				last_row = self._repo.get_last_minutely(device_id)
-				if last_row:
-					last_dt = last_row["datetime"]
+				last_minutely = self._get_last_minutely(device_id)
+				if last_minutely:
+					last_dt, last_energy = last_minutely
 					# Use previous minute's energy as baseline if available
 					# This captures consumption between the last sample of previous minute
 					# and first sample of current minute
 					if last_dt < aggregate.minute_mark:
-						energy_before = float(last_row["energy"])
+						energy_before = last_energy
 			except Exception:
 				self._logger.exception("minutely_energy_before_failed", device_id=device_id)
 
@@ -230,6 +423,7 @@ class AggregationPipeline:
 			)
 			energy_delta = 0.0
 
+		started = time.perf_counter()
 		try:
 			self._repo.upsert_minutely(
 				device_id=device_id,
@@ -238,32 +432,42 @@ class AggregationPipeline:
 				energy_last=aggregate.energy_last,
 				energy_delta=energy_delta,
 			)
+			_MINUTELY_WRITE_SECONDS.observe(time.perf_counter() - started)
 		except Exception:
 			self._logger.exception("minutely_insert_failed", device_id=device_id)
+			# Baris menit ini hilang dari akumulasi jam: jam ini dihitung ulang via SQL
+			self._hourly_acc.reset()
 			return ProcessDecision(success=False)
 
+		self._hourly_acc.add(aggregate)
+
+		if self._last_minutely is None or self._last_minutely[0] <= aggregate.minute_mark:
+			self._last_minutely = (aggregate.minute_mark, aggregate.energy_last)
+
 		if self._balance_mode == "minute":
 			try:
-				self._repo.decrement_token_balance(device_id, energy_delta)
+				self._ledger.charge(device_id, aggregate.minute_mark, energy_delta)
 			except Exception:
 				self._logger.exception("balance_minute_update_failed", device_id=device_id)
 				return ProcessDecision(success=False)
 
-		current_hour = floor_hour(dt)
 		if current_hour != aggregate.bucket_hour:
 			hourly_saved = False
+			started = time.perf_counter()
 			success, energy_delta = self._hourly.handle(
 				device_id,
 				aggregate.bucket_hour,
 				current_hour,
 				aggregate.energy_last,
+				self._hourly_acc.build(aggregate.bucket_hour),
 			)
+			_HOURLY_WRITE_SECONDS.observe(time.perf_counter() - started)
 			if not success:
 				return ProcessDecision(success=False)
 			hourly_saved = energy_delta is not None
 			if self._balance_mode == "hour" and energy_delta is not None:
 				try:
-					self._repo.decrement_token_balance(device_id, energy_delta)
+					self._ledger.charge(device_id, current_hour, energy_delta)
 				except Exception:
 					self._logger.exception("balance_hour_update_failed", device_id=device_id)
 					return ProcessDecision(success=False)
@@ -275,13 +479,13 @@ class AggregationPipeline:
 				if self._prediction_daily_enabled and self._is_trigger_match(current_hour, self._prediction_daily_trigger):
 					self._enqueue_prediction_job(device_id, "daily", current_hour)
 
-			if hourly_saved and self._pzem_overflow_after_hourly_handler:
+			if hourly_saved and username and self._pzem_overflow_after_hourly_handler:
 				try:
 					self._pzem_overflow_after_hourly_handler(username, device_code, aggregate.energy_last)
 				except Exception:
 					self._logger.exception("pzem_overflow_after_hourly_handler_failed", device_code=device_code)
 
-		return ProcessDecision(success=True, checkpoint_offset=-1)
+		return ProcessDecision(success=True, checkpoint_offset=checkpoint_offset)
 
 
 # Batas toleransi datetime dari device
@@ -291,22 +495,96 @@ _DATETIME_MIN_YEAR = 2024              # Tahun minimum yang valid
 _DATETIME_MAX_YEAR = 2027              # Tahun maksimum yang valid
 _SYNC_COMMAND_COOLDOWN = 60            # Cooldown kirim sync-rtc (detik)
 _DATETIME_BACKWARD_TOLERANCE = 5       # Toleransi waktu mundur (detik)
+_STATS_LOG_INTERVAL = 60               # Interval log statistik worker (detik)
+_OFFLINE_TIMEOUT_SECONDS = 20          # Device dianggap offline setelah diam selama ini
+_OFFLINE_RETRY_SECONDS = 5             # Jeda ulang jika update status offline gagal
+# last_online (waktu device) dianggap basi setelah timeout offline + toleransi jam device
+_PRESENCE_STALE_SECONDS = _OFFLINE_TIMEOUT_SECONDS + _DATETIME_MAX_PAST_SECONDS
+_REGISTRY_POLL_INTERVAL = 5            # Interval cek versi registry device (detik)
+_MAIN_LOOP_MAX_SLEEP = 1.0             # Batas tidur loop utama (detik)
+_DEVICE_EVICT_INTERVAL = 30            # Interval sweep state device idle (detik)
+_METRICS_TEXTFILE_INTERVAL = 15        # Interval tulis METRICS_TEXTFILE (detik)
+
+# Child metrik disimpan sekali agar jalur panas hanya inc/observe
+_MESSAGE_OUTCOMES = {
+	outcome: INGEST_MESSAGES.labels(outcome)
+	for outcome in (
+		"accepted",
+		"topic_invalid",
+		"device_mismatch",
+		"payload_invalid",
+		"payload_missing_fields",
+		"device_not_found",
+		"datetime_abnormal",
+		"batch_invalid",
+	)
+}
+_VALIDATE_SECONDS = STAGE_SECONDS.labels("validate")
+_MINUTELY_WRITE_SECONDS = STAGE_SECONDS.labels("minutely_write")
+_HOURLY_WRITE_SECONDS = STAGE_SECONDS.labels("hourly_write")
+_SYNC_RTC_SENT = DEVICE_COMMANDS.labels("sync-rtc")
+_PZEM_RESET_SENT = DEVICE_COMMANDS.labels("pzem-reset")
 
 
 class Worker:
 	def __init__(self):
 		self._logger = get_logger(__name__)
+		self._shard = ShardConfig.from_env()
 		self._repo = Repository()
-		base_dir = os.path.join(os.path.dirname(__file__), "data", "buffer")
-		self._buffer = FileBuffer(base_dir)
-		self._recovery = RecoveryManager(self._buffer)
-		self._realtime = RealtimeProcessor(self._repo)
+		self._registry = DeviceRegistry(
+			self._repo,
+			max_size=_parse_min_int(os.getenv("DEVICE_CACHE_MAX_SIZE", "10000"), 10000, 1),
+			ttl_seconds=_parse_positive_float(os.getenv("DEVICE_CACHE_TTL_SECONDS", "600"), 600.0),
+			negative_ttl_seconds=_parse_positive_float(os.getenv("DEVICE_CACHE_NEGATIVE_TTL_SECONDS", "60"), 60.0),
+		)
+		base_dir = self._shard.data_dir(os.path.join(os.path.dirname(__file__), "data", "buffer"))
+		self._buffer = FileBuffer(
+			base_dir,
+			segment_max_bytes=_parse_min_int(os.getenv("BUFFER_SEGMENT_MAX_BYTES", "4194304"), 4194304, 4096),
+			decoder=decode_reading_line,
+			observe_append=STAGE_SECONDS.labels("buffer_append").observe,
+		)
+		self._snapshot = SnapshotStore(
+			os.path.join(self._shard.data_dir(os.path.join(os.path.dirname(__file__), "data", "snapshot")), "pipelines.snap")
+		)
+		self._snapshot_interval = _parse_min_int(os.getenv("PIPELINE_SNAPSHOT_INTERVAL_SECONDS", "30"), 30, 0)
+		self._snapshot_devices: dict[str, dict] = {}
+		self._drainer = BufferDrainer(
+			self._buffer,
+			max_workers=_parse_min_int(os.getenv("BUFFER_WORKERS", "4"), 4, 1),
+			chunk_records=_parse_min_int(os.getenv("BUFFER_DRAIN_CHUNK_RECORDS", "500"), 500, 1),
+		)
+		self._recovery = RecoveryManager(self._buffer, self._drainer)
+		self._realtime = RealtimeProcessor(
+			self._repo,
+			flush_interval_ms=_parse_min_int(os.getenv("REALTIME_FLUSH_INTERVAL_MS", "1000"), 1000, 50),
+			max_staleness_ms=_parse_min_int(os.getenv("REALTIME_MAX_STALENESS_MS", "5000"), 5000, 50),
+		)
 		self._hourly = HourlyProcessor(self._repo)
-		self._pipelines: dict[str, AggregationPipeline] = {}
-		self._last_seen: dict[int, float] = {}
+		self._ledger = TokenLedger(
+			self._repo,
+			FileBuffer(self._shard.data_dir(os.path.join(os.path.dirname(__file__), "data", "ledger"))),
+			flush_interval_ms=_parse_min_int(os.getenv("TOKEN_LEDGER_FLUSH_INTERVAL_MS", "5000"), 5000, 100),
+			batch_size=_parse_min_int(os.getenv("TOKEN_LEDGER_BATCH_SIZE", "1000"), 1000, 1),
+			retention_days=_parse_min_int(os.getenv("TOKEN_LEDGER_RETENTION_DAYS", "7"), 7, 1),
+		)
+		self._devices = DeviceStateStore(
+			self._create_pipeline,
+			idle_seconds=_parse_positive_float(os.getenv("DEVICE_STATE_IDLE_SECONDS", "900"), 900.0),
+		)
+		self._presence = ExpiryScheduler(_OFFLINE_TIMEOUT_SECONDS)
+		self._presence_hydrated = False
+		# Device hasil hidrasi leader mode shared yang belum terlihat trafiknya di shard ini
+		self._presence_unconfirmed: set[int] = set()
 		self._balance_mode = os.getenv("BALANCE_DECREASE_MODE", "minute").lower()
 		if self._balance_mode not in ("minute", "hour"):
 			self._balance_mode = "minute"
+		self._batch = BatchProcessor(self._repo, self._ledger, self._balance_mode)
+		self._predictions = PredictionScheduler(
+			self._repo,
+			FileBuffer(self._shard.data_dir(os.path.join(os.path.dirname(__file__), "data", "predictions"))),
+			flush_interval_ms=_parse_min_int(os.getenv("PREDICTION_ENQUEUE_FLUSH_INTERVAL_MS", "2000"), 2000, 100),
+		)
 
 		self._prediction_hourly_enabled = _is_enabled(os.getenv("PREDICTION_HOURLY", "disable"))
 		self._prediction_daily_enabled = _is_enabled(os.getenv("PREDICTION_DAILY", "disable"))
@@ -331,29 +609,106 @@ class Worker:
 			1,
 		)
 
+		self._metrics_port = _parse_min_int(os.getenv("METRICS_PORT", "0"), 0, 0)
+		self._metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+		self._metrics_textfile = os.getenv("METRICS_TEXTFILE", "").strip()
+
 		self._mqtt_client: Optional[mqtt.Client] = None
-		self._last_valid_dt: dict[str, datetime] = {}       # device_code → last valid datetime
-		self._last_sync_cmd: dict[str, float] = {}           # device_code → last sync command time
-		self._last_pzem_reset_cmd: dict[str, float] = {}     # device_code → last pzem reset command time
+
+		overflow_policy = os.getenv("INGEST_OVERFLOW_POLICY", "block").strip().lower()
+		if overflow_policy not in OVERFLOW_POLICIES:
+			overflow_policy = "block"
+		spill_dir = self._shard.data_dir(os.path.join(os.path.dirname(__file__), "data", "spill"))
+		self._dispatcher = IngestDispatcher(
+			self._ingest_message,
+			max_workers=_parse_min_int(os.getenv("INGEST_WORKERS", "4"), 4, 1),
+			queue_size=_parse_min_int(os.getenv("INGEST_QUEUE_SIZE", "100"), 100, 1),
+			overflow_policy=overflow_policy,
+			spill_buffer=FileBuffer(spill_dir) if overflow_policy == "spill" else None,
+		)
 
 	@staticmethod
-	def _parse_topic(topic: str) -> Optional[Tuple[str, str]]:
+	def _parse_topic(topic: str) -> Optional[Tuple[str, str, str]]:
+		"""Kembalikan (username, device_code, jenis topic: swm-raw/swm-batch)."""
 		parts = [part for part in topic.split("/") if part]
 		if TOPIC_MODE == "simple":
 			if len(parts) != 3:
 				return None
-			if parts[1] != "swm-raw":
+			if parts[1] not in TOPIC_KINDS:
 				return None
-			return parts[0], parts[2]
+			return parts[0], parts[2], parts[1]
 
 		if len(parts) != 4:
 			return None
-		if parts[0] != "siwatt-mqtt" or parts[2] != "swm-raw":
+		if parts[0] != "siwatt-mqtt" or parts[2] not in TOPIC_KINDS:
 			return None
-		return parts[1], parts[3]
+		return parts[1], parts[3], parts[2]
+
+	def _accepts_topic(self, topic: str) -> bool:
+		"""Filter di thread network: buang pesan device milik shard lain sebelum decode."""
+		if not self._shard.enabled:
+			return True
+		parsed = self._parse_topic(topic)
+		# Topic invalid tetap diteruskan agar tercatat di log oleh _handle_message
+		return parsed is None or self._shard.owns(parsed[1])
+
+	def _hydrate_active_devices(self) -> None:
+		"""Jadwalkan timeout offline untuk device yang masih aktif di DB (sekali saat start).
+
+		Mode hash: tiap shard hanya mengambil device miliknya, sehingga tiap
+		device di-sweep tepat oleh satu shard. Mode shared: pemilik device
+		ditentukan broker, jadi hanya shard leader (index 0) yang melakukannya,
+		dengan deadline saat last_online device menjadi basi dan update offline
+		bersyarat last_online, agar device yang sedang dilayani shard lain
+		tidak ikut ditulis offline.
+		"""
+		shared = self._shard.enabled and self._shard.mode == "shared"
+		if shared and not self._shard.is_leader:
+			self._presence_hydrated = True
+			return
+		now = time.monotonic()
+		wall_now = datetime.now()
+		rows = self._repo.get_active_devices()
+		for row in rows:
+			if not self._shard.owns(row["device_code"]):
+				continue
+			if not shared:
+				self._presence.touch(row["id"], now)
+				continue
+			last_online = row.get("last_online")
+			age = (wall_now - last_online).total_seconds() if last_online else _PRESENCE_STALE_SECONDS
+			self._presence_unconfirmed.add(row["id"])
+			self._presence.touch(row["id"], now, timeout_seconds=max(_PRESENCE_STALE_SECONDS - age, 0.0))
+		self._presence_hydrated = True
+		self._logger.info("presence_hydrated", active_devices=len(self._presence))
+
+	def _touch_presence(self, device_id: int) -> None:
+		self._presence.touch(device_id)
+		if self._presence_unconfirmed:
+			self._presence_unconfirmed.discard(device_id)
+
+	def _expire_offline_devices(self) -> None:
+		offline_ids = self._presence.pop_expired()
+		if not offline_ids:
+			return
+		unconfirmed = [device_id for device_id in offline_ids if device_id in self._presence_unconfirmed]
+		confirmed = [device_id for device_id in offline_ids if device_id not in self._presence_unconfirmed]
+		try:
+			if unconfirmed:
+				# Hanya jika tidak ada shard lain yang memperbarui last_online sejak hidrasi
+				stale_before = datetime.now() - timedelta(seconds=_PRESENCE_STALE_SECONDS)
+				self._repo.update_devices_offline_status(unconfirmed, stale_before=stale_before)
+				self._presence_unconfirmed.difference_update(unconfirmed)
+			self._repo.update_devices_offline_status(confirmed)
+		except Exception:
+			self._logger.exception("offline_status_update_failed", devices=len(offline_ids))
+			now = time.monotonic()
+			for device_id in offline_ids:
+				# Pesan baru dari device akan memperpanjang deadline ini
+				self._presence.touch(device_id, now, timeout_seconds=_OFFLINE_RETRY_SECONDS)
 
 	def _validate_device(self, username: str, device_code: str) -> Optional[dict]:
-		device = self._repo.get_device(username, device_code)
+		device = self._registry.get(username, device_code)
 		if not device:
 			self._logger.warning(
 				"device_not_found",
@@ -364,13 +719,21 @@ class Worker:
 		return device
 
 	def _get_pipeline(self, device_code: str) -> AggregationPipeline:
-		pipeline = self._pipelines.get(device_code)
-		if pipeline:
-			return pipeline
-		pipeline = AggregationPipeline(
+		return self._devices.pipeline(device_code)
+
+	def _pipeline_handler(self, device_code: str) -> Callable[[Reading | ReadingBatch], ProcessDecision]:
+		"""Handler buffer yang mencari pipeline saat dipanggil (di bawah lock device),
+		sehingga tidak pernah memakai pipeline yang sudah di-evict."""
+		return lambda record: self._get_pipeline(device_code).handle(record)
+
+	def _create_pipeline(self, device_code: str) -> AggregationPipeline:
+		return AggregationPipeline(
 			self._repo,
 			self._realtime,
 			self._hourly,
+			self._ledger,
+			self._batch,
+			self._predictions,
 			self._logger,
 			self._balance_mode,
 			self._prediction_hourly_enabled,
@@ -379,8 +742,38 @@ class Worker:
 			self._prediction_daily_trigger,
 			self._handle_pzem_overflow_after_hourly,
 		)
-		self._pipelines[device_code] = pipeline
-		return pipeline
+
+	def _evict_idle_devices(self) -> None:
+		"""Buang state device yang idle; bucket menit terbuka di-flush ke DB dulu.
+
+		Device yang sedang diproses, masih punya backlog buffer, atau gagal
+		flush dicoba lagi pada sweep berikutnya.
+		"""
+		now = time.monotonic()
+		evicted = 0
+		for device_code, state in self._devices.idle(now):
+			pipeline = state.pipeline
+			if pipeline is not None:
+				if not pipeline.is_evictable():
+					continue
+
+				def flush_and_remove(device_code=device_code, state=state, pipeline=pipeline) -> ProcessDecision:
+					decision = pipeline.flush()
+					if decision.success and not self._devices.remove(device_code, state, now):
+						# Device aktif lagi selama flush: pipeline tetap dipakai tanpa commit WAL
+						return ProcessDecision(success=True)
+					return decision
+
+				decision = self._buffer.run_if_caught_up(device_code, flush_and_remove)
+				if decision is None or not decision.success or self._devices.peek(device_code) is state:
+					continue
+			elif not self._devices.remove(device_code, state, now):
+				continue
+			self._snapshot_devices.pop(device_code, None)
+			evicted += 1
+
+		if evicted:
+			self._logger.info("device_state_evicted", devices=evicted)
 
 	@staticmethod
 	def _build_command_topic(username: str, device_code: str) -> str:
@@ -400,7 +793,8 @@ class Worker:
 			return False
 
 		now_ts = time.time()
-		last_cmd_ts = self._last_pzem_reset_cmd.get(device_code, 0)
+		state = self._devices.get(device_code)
+		last_cmd_ts = state.last_pzem_reset_cmd
 		if now_ts - last_cmd_ts < self._auto_pzem_reset_cooldown_seconds:
 			self._logger.warning(
 				"pzem_overflow_detected_in_cooldown",
@@ -415,13 +809,13 @@ class Worker:
 		try:
 			self._mqtt_client.publish(cmd_topic, json.dumps({"cmd": "pzem-reset"}))
 			self._mqtt_client.publish(cmd_topic, json.dumps({"cmd": "reboot"}))
-			self._last_pzem_reset_cmd[device_code] = now_ts
+			state.last_pzem_reset_cmd = now_ts
+			_PZEM_RESET_SENT.inc()
 
-			pipeline = self._pipelines.get(device_code)
-			if pipeline:
-				pipeline.mark_energy_reset_event()
+			if state.pipeline:
+				state.pipeline.mark_energy_reset_event()
 
-			self._last_valid_dt.pop(device_code, None)
+			state.last_valid_dt = None
 
 			self._logger.warning(
 				"pzem_overflow_auto_reset_sent",
@@ -435,14 +829,31 @@ class Worker:
 			self._logger.exception("pzem_overflow_auto_reset_failed", device_code=device_code)
 			return False
 
-	def _handle_message(self, topic: str, payload: dict) -> None:
+	def _handle_message(self, topic: str, payload: dict | list, raw: bytes | None = None) -> None:
+		"""Dipanggil di thread network paho: hanya validasi ringan lalu antre."""
 		parsed = self._parse_topic(topic)
 		if not parsed:
+			_MESSAGE_OUTCOMES["topic_invalid"].inc()
 			self._logger.warning("topic_invalid", topic=topic)
 			return
 
-		username, device_code = parsed
+		username, device_code, kind = parsed
+		if kind == "swm-batch":
+			# Batch boleh berupa list; validasi isi dilakukan parse_batch di thread ingest
+			if isinstance(payload, dict) and payload.get("device_id") and payload.get("device_id") != device_code:
+				_MESSAGE_OUTCOMES["device_mismatch"].inc()
+				self._logger.warning("device_mismatch", topic=topic, device_code=device_code)
+				return
+			# Batch berisi riwayat yang tidak terkirim ulang: jangan dibuang saat antrean penuh
+			self._dispatcher.submit(username, device_code, topic, payload, raw, droppable=False)
+			return
+
+		if not isinstance(payload, dict):
+			_MESSAGE_OUTCOMES["payload_invalid"].inc()
+			self._logger.warning("payload_invalid", topic=topic)
+			return
 		if payload.get("device_id") and payload.get("device_id") != device_code:
+			_MESSAGE_OUTCOMES["device_mismatch"].inc()
 			self._logger.warning(
 				"device_mismatch",
 				topic=topic,
@@ -454,52 +865,193 @@ class Worker:
 		required_fields = ["datetime", "voltage", "current", "power", "energy", "frequency", "pf"]
 		missing = [field for field in required_fields if field not in payload]
 		if missing:
+			_MESSAGE_OUTCOMES["payload_missing_fields"].inc()
 			self._logger.warning("payload_missing_fields", missing=missing, topic=topic)
 			return
 
+		self._dispatcher.submit(username, device_code, topic, payload, raw)
+
+	def _ingest_message(
+		self, username: str, device_code: str, topic: str, payload: dict, raw: bytes | None = None
+	) -> None:
+		received_at = time.time()
+		started = time.perf_counter()
 		device = self._validate_device(username, device_code)
 		if not device:
+			_MESSAGE_OUTCOMES["device_not_found"].inc()
+			return
+
+		parsed = self._parse_topic(topic)
+		if parsed and parsed[2] == "swm-batch":
+			self._ingest_batch(device, username, device_code, topic, payload, raw, received_at)
 			return
 
 		# Validasi datetime dari device
-		if not self._validate_device_datetime(username, device_code, payload):
+		try:
+			device_dt = parse_datetime(payload["datetime"])
+		except Exception:
+			device_dt = None
+		if not self._validate_device_datetime(username, device_code, device_dt, payload.get("datetime")):
+			_MESSAGE_OUTCOMES["datetime_abnormal"].inc()
 			return
 
-		self._last_seen[device["id"]] = time.time()
+		try:
+			reading = Reading.from_payload(
+				device["id"], username, device_code, payload, dt=device_dt, received_at=received_at
+			)
+		except Exception:
+			_MESSAGE_OUTCOMES["payload_invalid"].inc()
+			self._logger.warning("payload_invalid", device_code=device_code, topic=topic)
+			return
+		_VALIDATE_SECONDS.observe(time.perf_counter() - started)
+
+		self._touch_presence(device["id"])
+
+		# Payload asli + header ditulis ke WAL; jika tidak ada backlog, reading
+		# yang sudah di-decode langsung diproses tanpa dibaca ulang dari disk
+		line = encode_reading_line(reading, raw, payload)
+		handler = self._pipeline_handler(device_code)
+		accepted = self._buffer.append_and_process(device_code, line, reading, handler)
+		_MESSAGE_OUTCOMES["accepted"].inc()
+		if not accepted:
+			self._drainer.schedule(device_code, handler, self._on_buffer_processed)
+
+	def _ingest_batch(
+		self,
+		device: dict,
+		username: str,
+		device_code: str,
+		topic: str,
+		payload: dict | list,
+		raw: bytes | None,
+		received_at: float,
+	) -> None:
+		"""Batch backfill melewati validasi datetime realtime; batas umur dicek parse_batch."""
+		try:
+			batch = parse_batch(device["id"], username, device_code, payload, received_at)
+		except ValueError as exc:
+			_MESSAGE_OUTCOMES["batch_invalid"].inc()
+			self._logger.warning("batch_invalid", device_code=device_code, topic=topic, error=str(exc))
+			return
 
-		record = {
-			"username": username,
-			"device_code": device_code,
-			"device_id": device["id"],
-			"payload": payload,
+		if len(batch) == 0:
+			_MESSAGE_OUTCOMES["batch_invalid"].inc()
+			self._logger.warning("batch_empty", device_code=device_code, dropped=batch.dropped)
+			return
+
+		self._touch_presence(device["id"])
+
+		try:
+			line = encode_reading_line(batch, raw, payload)
+		except ValueError:
+			_MESSAGE_OUTCOMES["batch_invalid"].inc()
+			self._logger.warning("batch_invalid", device_code=device_code, topic=topic, error="unsafe header")
+			return
+		handler = self._pipeline_handler(device_code)
+		accepted = self._buffer.append_and_process(device_code, line, batch, handler)
+		_MESSAGE_OUTCOMES["accepted"].inc()
+		if not accepted:
+			self._drainer.schedule(device_code, handler, self._on_buffer_processed)
+
+	def _save_snapshot(self) -> None:
+		"""Snapshot state semua pipeline + posisi baca WAL ke file lokal.
+
+		Device yang sedang diproses dilewati dan entry snapshot sebelumnya
+		dipakai; entry lama tetap aman karena dicek ulang terhadap WAL saat restore.
+		"""
+		started = time.perf_counter()
+		devices = dict(self._snapshot_devices)
+		skipped = 0
+		states = self._devices.items()
+		for device_code, state in states:
+			if state.pipeline is None:
+				continue
+			captured = self._buffer.capture(device_code, state.pipeline.export_state)
+			if captured is None:
+				skipped += 1
+				continue
+			committed, read, state = captured
+			devices[device_code] = {
+				"committed": list(committed) if committed else None,
+				"read": list(read) if read else None,
+				"pipeline": state,
+			}
+		self._snapshot_devices = devices
+
+		last_valid_dt = {
+			device_code: state.last_valid_dt.isoformat() for device_code, state in states if state.last_valid_dt
 		}
+		size = self._snapshot.save({"saved_at": time.time(), "devices": devices, "last_valid_dt": last_valid_dt})
+		self._logger.info(
+			"pipeline_snapshot_saved",
+			devices=len(devices),
+			skipped=skipped,
+			bytes=size,
+			duration_ms=round((time.perf_counter() - started) * 1000, 2),
+		)
+
+	def _restore_snapshot(self) -> None:
+		"""Dipanggil sebelum recovery: pulihkan state lalu lompati record WAL yang sudah tercakup."""
+		snapshot = self._snapshot.load()
+		if not snapshot:
+			return
 
-		self._buffer.append(device_code, record)
-		pipeline = self._get_pipeline(device_code)
-		result = self._buffer.process(device_code, pipeline.handle)
+		restored = 0
+		stale = 0
+		devices = snapshot.get("devices", {})
+		for device_code, entry in devices.items():
+			try:
+				include_position = bool(entry["committed"]) and self._buffer.restore_read_position(
+					device_code, tuple(entry["committed"]), tuple(entry["read"])
+				)
+				self._get_pipeline(device_code).restore_state(entry["pipeline"], include_position)
+			except Exception:
+				self._logger.exception("snapshot_restore_failed", device_code=device_code)
+				continue
+			if include_position:
+				restored += 1
+			else:
+				stale += 1
+
+		for device_code, value in snapshot.get("last_valid_dt", {}).items():
+			try:
+				state = self._devices.get(device_code)
+				if state.last_valid_dt is None:
+					state.last_valid_dt = datetime.fromisoformat(value)
+			except ValueError:
+				continue
+
+		# Entry device yang belum sempat di-capture ulang tetap dibawa ke snapshot berikutnya
+		self._snapshot_devices = dict(devices)
+		self._logger.info(
+			"pipeline_snapshot_restored",
+			restored=restored,
+			stale=stale,
+			saved_at=snapshot.get("saved_at"),
+		)
+
+	def _on_buffer_processed(self, device_code: str, result: BufferResult) -> None:
 		self._logger.info(
 			"buffer_processed",
 			device_code=device_code,
-			mqtt_datetime=payload.get("datetime"),
 			processed=result.processed,
 			remaining=result.remaining,
 		)
 
 	def _validate_device_datetime(
-		self, username: str, device_code: str, payload: dict
+		self, username: str, device_code: str, device_dt: datetime | None, raw_datetime
 	) -> bool:
 		"""Validasi datetime dari device. Return False jika abnormal (data di-drop + kirim sync-rtc)."""
-		try:
-			device_dt = parse_datetime(payload["datetime"])
-		except Exception:
+		if device_dt is None:
 			self._logger.warning(
 				"datetime_parse_failed",
 				device_code=device_code,
-				raw_datetime=payload.get("datetime"),
+				raw_datetime=raw_datetime,
 			)
 			self._send_sync_rtc(username, device_code, "datetime parse failed")
 			return False
 
+		state = self._devices.get(device_code)
 		now = datetime.now()
 		reason = None
 
@@ -518,8 +1070,8 @@ class Worker:
 			reason = f"datetime {diff:.0f}s behind server time"
 
 		# Cek 4: Waktu mundur dari data sebelumnya (RTC loncat ke belakang)
-		elif device_code in self._last_valid_dt:
-			prev_dt = self._last_valid_dt[device_code]
+		elif state.last_valid_dt is not None:
+			prev_dt = state.last_valid_dt
 			if (prev_dt - device_dt).total_seconds() > _DATETIME_BACKWARD_TOLERANCE:
 				diff = (prev_dt - device_dt).total_seconds()
 				reason = f"datetime went backward by {diff:.0f}s (prev: {prev_dt}, now: {device_dt})"
@@ -534,12 +1086,12 @@ class Worker:
 			)
 			# Hapus referensi waktu lama agar setelah sync,
 			# data dengan waktu yang sudah dikoreksi tidak dianggap "mundur"
-			self._last_valid_dt.pop(device_code, None)
+			state.last_valid_dt = None
 			self._send_sync_rtc(username, device_code, reason)
 			return False
 
 		# Datetime valid, simpan sebagai referensi
-		self._last_valid_dt[device_code] = device_dt
+		state.last_valid_dt = device_dt
 		return True
 
 	def _send_sync_rtc(self, username: str, device_code: str, reason: str) -> None:
@@ -548,7 +1100,8 @@ class Worker:
 			return
 
 		now = time.time()
-		last_sent = self._last_sync_cmd.get(device_code, 0)
+		state = self._devices.get(device_code)
+		last_sent = state.last_sync_cmd
 
 		if now - last_sent < _SYNC_COMMAND_COOLDOWN:
 			return  # Masih dalam cooldown, jangan spam device
@@ -559,16 +1112,16 @@ class Worker:
 
 		try:
 			self._mqtt_client.publish(cmd_topic, cmd_payload)
-			self._last_sync_cmd[device_code] = now
+			state.last_sync_cmd = now
+			_SYNC_RTC_SENT.inc()
 
 			# Reset pipeline agar data dengan waktu koreksi tidak di-drop
 			# Scenario: device clock maju 90 detik (masih dalam toleransi)
 			# → pipeline._last_processed_dt = waktu maju
 			# → sync-rtc dikirim → device koreksi waktu mundur 90 detik
 			# → tanpa reset, pipeline akan drop semua data selama 90 detik
-			pipeline = self._pipelines.get(device_code)
-			if pipeline:
-				pipeline.reset_datetime_state()
+			if state.pipeline:
+				state.pipeline.request_datetime_reset()
 				self._logger.info(
 					"pipeline_datetime_reset",
 					device_code=device_code,
@@ -583,18 +1136,96 @@ class Worker:
 		except Exception:
 			self._logger.exception("sync_rtc_command_failed", device_code=device_code)
 
+	def _log_stats(self) -> None:
+		pool = get_pool()
+		pool.prune_idle()
+		self._logger.info("db_pool_stats", **pool.stats())
+		self._logger.info("device_registry_stats", **self._registry.stats())
+		self._logger.info("ingest_queue_stats", **self._dispatcher.stats())
+		self._logger.info("hourly_aggregate_stats", **self._hourly.stats())
+		self._logger.info("token_ledger_stats", **self._ledger.stats())
+		self._logger.info("prediction_scheduler_stats", **self._predictions.stats())
+		self._logger.info("device_state_stats", **self._devices.stats())
+		self._logger.info(
+			"realtime_writer_stats",
+			pending=self._realtime.pending_count(),
+			draining_devices=self._drainer.active_count(),
+			tracked_online_devices=len(self._presence),
+		)
+
+	def _register_metrics(self) -> None:
+		"""Ekspor stats komponen yang sudah ada + backlog WAL dan antrean ingest per device ke registry metrik."""
+		REGISTRY.stats("mqtt_worker_db_pool", lambda: get_pool().stats())
+		REGISTRY.stats("mqtt_worker_device_registry", self._registry.stats)
+		REGISTRY.stats("mqtt_worker_ingest_queue", self._dispatcher.stats)
+		REGISTRY.stats("mqtt_worker_hourly_aggregate", self._hourly.stats)
+		REGISTRY.stats("mqtt_worker_token_ledger", self._ledger.stats)
+		REGISTRY.stats("mqtt_worker_prediction_scheduler", self._predictions.stats)
+		REGISTRY.stats("mqtt_worker_device_state", self._devices.stats)
+		REGISTRY.stats("mqtt_worker_recovery", self._recovery.progress)
+		REGISTRY.stats(
+			"mqtt_worker_realtime",
+			lambda: {
+				"pending": self._realtime.pending_count(),
+				"draining_devices": self._drainer.active_count(),
+				"tracked_online_devices": len(self._presence),
+			},
+		)
+		REGISTRY.gauge_callback(
+			"mqtt_worker_buffer_backlog_records",
+			"Record WAL yang belum di-checkpoint per device",
+			"device_code",
+			self._buffer.backlog,
+		)
+		REGISTRY.gauge_callback(
+			"mqtt_worker_ingest_queue_depth",
+			"Pesan di antrean ingest per device (hanya device yang sedang punya antrean)",
+			"device_code",
+			self._dispatcher.queue_depths,
+		)
+
+	def _start_metrics(self) -> None:
+		if not self._metrics_port and not self._metrics_textfile:
+			return
+		self._register_metrics()
+		if self._metrics_port:
+			try:
+				REGISTRY.start_http_server(self._metrics_port, self._metrics_host)
+				self._logger.info("metrics_server_started", host=self._metrics_host, port=self._metrics_port)
+			except OSError:
+				self._logger.exception("metrics_server_failed", host=self._metrics_host, port=self._metrics_port)
+
 	def run(self) -> None:
 		self._logger.info(
 			"worker_starting",
 			auto_pzem_reset_enabled=self._auto_pzem_reset_enabled,
 			auto_pzem_reset_threshold_kwh=self._auto_pzem_reset_threshold_kwh,
 			auto_pzem_reset_cooldown_seconds=self._auto_pzem_reset_cooldown_seconds,
+			shard_index=self._shard.index,
+			shard_count=self._shard.count,
+			shard_mode=self._shard.mode,
 		)
-		self._recovery.replay_all(lambda device_code: self._get_pipeline(device_code).handle)
-
-		client = create_client()
+		self._realtime.start()
+		self._ledger.start()
+		self._predictions.start()
+		self._start_metrics()
+		if self._snapshot_interval:
+			self._restore_snapshot()
+		# Recovery berjalan di latar belakang; MQTT langsung di-subscribe dan
+		# pesan live device yang masih recovery antre di belakang backlog WAL-nya
+		self._recovery.start(self._pipeline_handler, self._on_buffer_processed)
+		self._dispatcher.start()
+
+		client = create_client(self._shard.client_id(os.getenv("MQTT_CLIENT_ID", "siwatt-worker")))
 		self._mqtt_client = client  # Simpan referensi untuk publish command
-		subscriber = Subscriber(TOPIC_WILDCARD, self._handle_message)
+		topics = [self._shard.subscription_topic(TOPIC_WILDCARD)]
+		if BATCH_TOPIC_WILDCARD:
+			topics.append(self._shard.subscription_topic(BATCH_TOPIC_WILDCARD))
+		subscriber = Subscriber(
+			topics,
+			self._handle_message,
+			accept=self._accepts_topic,
+		)
 		client.on_connect = subscriber.on_connect
 		client.on_message = subscriber.on_message
 
@@ -603,29 +1234,65 @@ class Worker:
 		client.connect(host, port, keepalive=60)
         
 		client.loop_start()
+		last_stats_log = time.time()
+		last_registry_poll = 0.0
+		last_snapshot = time.time()
+		last_device_evict = time.time()
+		last_metrics_write = 0.0
 		try:
 			while True:
-				try:
-					active_ids = self._repo.get_active_device_ids()
-					now = time.time()
-					for device_id in active_ids:
-						if device_id not in self._last_seen:
-							self._last_seen[device_id] = now
-					
-					offline_ids = [
-						device_id
-						for device_id, last_seen in self._last_seen.items()
-						if now - last_seen > 20
-					]
-					if offline_ids:
-						self._repo.update_devices_offline_status(offline_ids)
-						for device_id in offline_ids:
-							self._last_seen.pop(device_id, None)
-				except Exception:
-					self._logger.exception("offline_status_update_failed")
-				time.sleep(5)
+				if time.time() - last_registry_poll >= _REGISTRY_POLL_INTERVAL:
+					last_registry_poll = time.time()
+					self._registry.poll_version()
+					if not self._presence_hydrated:
+						try:
+							self._hydrate_active_devices()
+						except Exception:
+							self._logger.exception("presence_hydrate_failed")
+
+				self._expire_offline_devices()
+
+				if time.time() - last_device_evict >= _DEVICE_EVICT_INTERVAL:
+					last_device_evict = time.time()
+					try:
+						self._evict_idle_devices()
+					except Exception:
+						self._logger.exception("device_state_evict_failed")
+
+				if time.time() - last_stats_log >= _STATS_LOG_INTERVAL:
+					last_stats_log = time.time()
+					self._log_stats()
+
+				if self._snapshot_interval and time.time() - last_snapshot >= self._snapshot_interval:
+					last_snapshot = time.time()
+					try:
+						self._save_snapshot()
+					except Exception:
+						self._logger.exception("pipeline_snapshot_failed")
+
+				if self._metrics_textfile and time.time() - last_metrics_write >= _METRICS_TEXTFILE_INTERVAL:
+					last_metrics_write = time.time()
+					try:
+						REGISTRY.write_textfile(self._metrics_textfile)
+					except OSError:
+						self._logger.exception("metrics_textfile_failed", path=self._metrics_textfile)
+
+				wait = self._presence.seconds_until_next()
+				time.sleep(_MAIN_LOOP_MAX_SLEEP if wait is None else min(max(wait, 0.05), _MAIN_LOOP_MAX_SLEEP))
 		except KeyboardInterrupt:
 			self._logger.info("worker_stopping")
 			client.loop_stop()
+			self._dispatcher.shutdown()
+			self._recovery.close()
+			self._drainer.shutdown()
+			if self._snapshot_interval:
+				try:
+					self._save_snapshot()
+				except Exception:
+					self._logger.exception("pipeline_snapshot_failed")
+			self._realtime.close()
+			self._ledger.close()
+			self._predictions.close()
+			get_pool().close_all()
 if __name__ == "__main__":
 	Worker().run()
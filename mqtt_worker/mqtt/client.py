@@ -3,8 +3,9 @@ import os
 import paho.mqtt.client as mqtt
 
 
-def create_client() -> mqtt.Client:
-    client_id = os.getenv("MQTT_CLIENT_ID", "siwatt-worker")
+def create_client(client_id: str | None = None) -> mqtt.Client:
+    if client_id is None:
+        client_id = os.getenv("MQTT_CLIENT_ID", "siwatt-worker")
     client = mqtt.Client(client_id=client_id, clean_session=True)
     username = os.getenv("MQTT_USERNAME")
     password = os.getenv("MQTT_PASSWORD")
@@ -0,0 +1,199 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+from typing import Callable
+
+from mqtt_worker.storage.file_buffer import FileBuffer, ProcessDecision
+from mqtt_worker.utils.logger import get_logger
+
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "spill")
+
+
+class IngestDispatcher:
+    """Pisahkan thread network paho dari pekerjaan DB.
+
+    Thread network hanya memasukkan pesan ke antrean per device (terbatas
+    `queue_size`), lalu worker pool memproses antrean tiap device secara
+    berurutan. Jika antrean penuh, perilakunya mengikuti `overflow_policy`:
+
+    - `block`: thread network menunggu sampai ada slot.
+    - `drop_oldest`: pesan realtime tertua di antrean dibuang. Pesan yang
+      di-submit dengan `droppable=False` (batch backfill) tidak pernah
+      dibuang; jika antrean hanya berisi pesan seperti itu, thread network
+      menunggu seperti `block`.
+    - `spill`: pesan ditulis ke `spill_buffer` (disk) dan diproses setelah
+      antrean device kosong; selama masih ada spill, pesan baru untuk device
+      itu ikut di-spill agar urutan tetap terjaga.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, str, str, dict, bytes | None], None],
+        max_workers: int,
+        queue_size: int,
+        overflow_policy: str = "block",
+        spill_buffer: FileBuffer | None = None,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow_policy must be one of {', '.join(OVERFLOW_POLICIES)}")
+        if overflow_policy == "spill" and spill_buffer is None:
+            raise ValueError("spill_buffer is required for overflow_policy 'spill'")
+
+        self._handler = handler
+        self._queue_size = queue_size
+        self._overflow_policy = overflow_policy
+        self._spill_buffer = spill_buffer
+        self._logger = get_logger(__name__)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._cond = Condition()
+        self._queues: dict[str, deque] = {}
+        self._active: set[str] = set()
+        self._spilled: set[str] = set()
+        self._spill_inflight: dict[str, int] = {}
+        self._closed = False
+
+        self._submitted = 0
+        self._dropped = 0
+        self._spilled_messages = 0
+        self._blocked = 0
+
+    def start(self) -> None:
+        """Lanjutkan spill yang tersisa dari proses sebelumnya."""
+        if self._spill_buffer is None:
+            return
+        with self._cond:
+            for device_code in self._spill_buffer.list_devices():
+                self._spilled.add(device_code)
+                self._ensure_draining(device_code)
+
+    def submit(
+        self,
+        username: str,
+        device_code: str,
+        topic: str,
+        payload: dict | list,
+        raw: bytes | None = None,
+        droppable: bool = True,
+    ) -> None:
+        item = (username, device_code, topic, payload, raw, droppable)
+        with self._cond:
+            if self._closed:
+                return
+            self._submitted += 1
+
+            blocked = False
+            while device_code not in self._spilled:
+                queue = self._queues.get(device_code)
+                if queue is None:
+                    queue = self._queues[device_code] = deque()
+                if len(queue) < self._queue_size:
+                    queue.append(item)
+                    self._ensure_draining(device_code)
+                    return
+
+                victim = None
+                if self._overflow_policy == "drop_oldest":
+                    victim = next((index for index, queued in enumerate(queue) if queued[5]), None)
+                if self._overflow_policy == "block" or (self._overflow_policy == "drop_oldest" and victim is None):
+                    if not blocked:
+                        blocked = True
+                        self._blocked += 1
+                    self._cond.wait()
+                    if self._closed:
+                        return
+                elif victim is not None:
+                    del queue[victim]
+                    self._dropped += 1
+                else:
+                    self._spilled.add(device_code)
+
+            # Mode spill: tulis ke disk di luar lock, _drain menunggu selama
+            # masih ada spill yang sedang ditulis untuk device ini
+            self._spill_inflight[device_code] = self._spill_inflight.get(device_code, 0) + 1
+            self._spilled_messages += 1
+            self._ensure_draining(device_code)
+
+        try:
+            self._spill().append(
+                device_code,
+                {"username": username, "device_code": device_code, "topic": topic, "payload": payload},
+            )
+        except Exception:
+            self._logger.exception("ingest_spill_failed", device_code=device_code)
+        finally:
+            with self._cond:
+                remaining = self._spill_inflight[device_code] - 1
+                if remaining:
+                    self._spill_inflight[device_code] = remaining
+                else:
+                    del self._spill_inflight[device_code]
+                self._cond.notify_all()
+
+    def _spill(self) -> FileBuffer:
+        # Device hanya masuk _spilled jika spill_buffer ada (dicek di __init__/start)
+        assert self._spill_buffer is not None
+        return self._spill_buffer
+
+    def _ensure_draining(self, device_code: str) -> None:
+        if device_code not in self._active:
+            self._active.add(device_code)
+            self._executor.submit(self._drain, device_code)
+
+    def _handle(self, item: tuple) -> None:
+        try:
+            self._handler(*item[:5])
+        except Exception:
+            self._logger.exception("ingest_handler_failed", device_code=item[1], topic=item[2])
+
+    def _handle_spilled(self, record: dict) -> ProcessDecision:
+        self._handle((record["username"], record["device_code"], record["topic"], record["payload"], None, True))
+        return ProcessDecision(success=True, checkpoint_offset=0)
+
+    def _drain(self, device_code: str) -> None:
+        while True:
+            with self._cond:
+                queue = self._queues.get(device_code)
+                item = queue.popleft() if queue else None
+                if item is not None:
+                    self._cond.notify_all()
+                elif device_code not in self._spilled:
+                    self._queues.pop(device_code, None)
+                    self._active.discard(device_code)
+                    return
+
+            if item is not None:
+                self._handle(item)
+                continue
+
+            spill_buffer = self._spill()
+            spill_buffer.process(device_code, self._handle_spilled, max_records=self._queue_size)
+            with self._cond:
+                if self._spill_inflight.get(device_code):
+                    self._cond.wait(0.05)
+                elif spill_buffer.pending(device_code) == 0:
+                    self._spilled.discard(device_code)
+
+    def stats(self) -> dict:
+        with self._cond:
+            depths = [len(queue) for queue in self._queues.values()]
+            return {
+                "queued": sum(depths),
+                "max_queue_depth": max(depths, default=0),
+                "active_devices": len(self._active),
+                "spilled_devices": len(self._spilled),
+                "submitted": self._submitted,
+                "dropped": self._dropped,
+                "spilled": self._spilled_messages,
+                "blocked": self._blocked,
+            }
+
+    def queue_depths(self) -> dict[str, int]:
+        with self._cond:
+            return {device_code: len(queue) for device_code, queue in self._queues.items()}
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,71 @@
+import os
+import zlib
+from dataclasses import dataclass
+
+
+SHARD_MODES = ("hash", "shared")
+
+
+def shard_for(device_code: str, shard_count: int) -> int:
+    """Shard pemilik device; stabil antar proses (tidak memakai hash() Python)."""
+    return zlib.crc32(device_code.encode("utf-8")) % shard_count
+
+
+@dataclass(frozen=True)
+class ShardConfig:
+    count: int
+    index: int
+    mode: str
+    group: str
+
+    @classmethod
+    def from_env(cls) -> "ShardConfig":
+        try:
+            count = max(1, int(os.getenv("MQTT_SHARD_COUNT", "1")))
+        except ValueError:
+            count = 1
+        try:
+            index = int(os.getenv("MQTT_SHARD_INDEX", "0"))
+        except ValueError:
+            index = 0
+        if not 0 <= index < count:
+            raise ValueError(f"MQTT_SHARD_INDEX must be between 0 and {count - 1}")
+
+        mode = os.getenv("MQTT_SHARD_MODE", "hash").strip().lower()
+        if mode not in SHARD_MODES:
+            mode = "hash"
+        group = os.getenv("MQTT_SHARE_GROUP", "siwatt-worker").strip() or "siwatt-worker"
+        return cls(count=count, index=index, mode=mode, group=group)
+
+    @property
+    def enabled(self) -> bool:
+        return self.count > 1
+
+    @property
+    def is_leader(self) -> bool:
+        return self.index == 0
+
+    def owns(self, device_code: str) -> bool:
+        """Apakah device ini milik shard ini.
+
+        Mode `shared`: pembagian dilakukan broker, jadi semua pesan yang
+        diterima dianggap milik shard ini.
+        """
+        if not self.enabled or self.mode == "shared":
+            return True
+        return shard_for(device_code, self.count) == self.index
+
+    def subscription_topic(self, topic: str) -> str:
+        if self.enabled and self.mode == "shared":
+            return f"$share/{self.group}/{topic}"
+        return topic
+
+    def client_id(self, base_client_id: str) -> str:
+        if not self.enabled:
+            return base_client_id
+        return f"{base_client_id}-{self.index}"
+
+    def data_dir(self, base_dir: str) -> str:
+        if not self.enabled:
+            return base_dir
+        return os.path.join(base_dir, f"shard-{self.index}")
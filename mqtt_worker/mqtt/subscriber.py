@@ -1,30 +1,51 @@
 import json
+import time
 from typing import Callable
 
 from mqtt_worker.utils.logger import get_logger
+from mqtt_worker.utils.metrics import INGEST_MESSAGES, STAGE_SECONDS
+
+
+_DECODE_SECONDS = STAGE_SECONDS.labels("decode")
+_DECODE_FAILED = INGEST_MESSAGES.labels("decode_failed")
 
 
 class Subscriber:
-    def __init__(self, topic: str, handler: Callable[[str, dict], None]):
-        self._topic = topic
+    def __init__(
+        self,
+        topic: str | list[str],
+        handler: Callable[[str, dict | list, bytes], None],
+        accept: Callable[[str], bool] | None = None,
+    ):
+        self._topics = [topic] if isinstance(topic, str) else list(topic)
         self._handler = handler
+        self._accept = accept
         self._logger = get_logger(__name__)
 
     def on_connect(self, client, userdata, flags, rc):
         if rc != 0:
             self._logger.error("mqtt_connect_failed", rc=rc)
             return
-        client.subscribe(self._topic)
-        self._logger.info("mqtt_subscribed", topic=self._topic)
+        for topic in self._topics:
+            client.subscribe(topic)
+            self._logger.info("mqtt_subscribed", topic=topic)
 
     def on_message(self, client, userdata, msg):
+        # Pesan milik shard lain dibuang sebelum decode
+        if self._accept and not self._accept(msg.topic):
+            return
+
+        started = time.perf_counter()
         try:
-            payload = json.loads(msg.payload.decode("utf-8"))
+            payload = json.loads(msg.payload)
         except Exception:
+            _DECODE_FAILED.inc()
             self._logger.exception("mqtt_payload_invalid", topic=msg.topic)
             return
+        _DECODE_SECONDS.observe(time.perf_counter() - started)
 
         try:
-            self._handler(msg.topic, payload)
+            # Byte asli ikut diteruskan agar bisa ditulis ke buffer tanpa encode ulang
+            self._handler(msg.topic, payload, msg.payload)
         except Exception:
             self._logger.exception("mqtt_handler_failed", topic=msg.topic)
\ No newline at end of file
@@ -0,0 +1,175 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from mqtt_worker.db.repository import Repository
+from mqtt_worker.processors.reading import FIELDS
+from mqtt_worker.processors.reading_batch import EPOCH, ReadingBatch, group_starts, to_datetime
+from mqtt_worker.processors.token_ledger import TokenLedger
+from mqtt_worker.utils.logger import get_logger
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    minutes_inserted: int
+    minutes_skipped: int
+    hours_inserted: int
+    charges: int
+
+
+class BatchProcessor:
+    """Agregasi batch pembacaan historis ke data_minutely/data_hourly secara vektor.
+
+    Aturan sama dengan pipeline live: label minutely = awal menit berikutnya,
+    baris hourly berlabel C berisi rata-rata minutely berlabel [C-1h, C) dan
+    delta = energy minutely pertama jam C-1h - energy minutely pertama jam C-2h.
+    Menit/jam yang sudah ada di DB tidak ditimpa. Saldo token hanya dipotong
+    untuk periode yang lebih baru dari data terakhir di DB, karena periode
+    sebelumnya sudah ikut terhitung oleh selisih energy kumulatif pipeline live.
+    """
+
+    def __init__(self, repository: Repository, ledger: TokenLedger, balance_mode: str):
+        self._repo = repository
+        self._ledger = ledger
+        self._balance_mode = balance_mode
+        self._logger = get_logger(__name__)
+
+    def handle(self, batch: ReadingBatch) -> BatchResult:
+        if len(batch) == 0:
+            return BatchResult(0, 0, 0, 0)
+
+        device_id = batch.device_id
+
+        # 1. Bucket per menit
+        minutes = batch.timestamps // 60
+        starts = group_starts(minutes)
+        ends = np.r_[starts[1:], minutes.size]
+        counts = (ends - starts).astype(np.float64)
+        labels = (minutes[starts] + 1) * 60
+        averages = np.add.reduceat(batch.values, starts, axis=0) / counts[:, None]
+        energy_first = batch.energy[starts]
+        energy_last = batch.energy[ends - 1]
+
+        # 2. Gabungkan dengan minutely yang sudah ada di sekitar rentang batch
+        range_start = to_datetime(int(labels[0]) - 2 * 3600)
+        range_end = to_datetime(int(labels[-1]) + 3600)
+        last_row = self._repo.get_last_minutely(device_id)
+        last_existing = int((last_row["datetime"] - EPOCH).total_seconds()) if last_row else None
+        existing_rows = self._repo.get_minutely_range(device_id, range_start, range_end)
+
+        existing_labels = np.array(
+            [int((row["datetime"] - EPOCH).total_seconds()) for row in existing_rows], dtype=np.int64
+        )
+        is_new = ~np.isin(labels, existing_labels)
+
+        merged_labels = np.concatenate([existing_labels, labels[is_new]])
+        merged_values = np.concatenate(
+            [
+                np.array(
+                    [[float(row[field]) for field in FIELDS] for row in existing_rows], dtype=np.float64
+                ).reshape(-1, len(FIELDS)),
+                averages[is_new],
+            ]
+        )
+        merged_energy = np.concatenate(
+            [np.array([float(row["energy"]) for row in existing_rows], dtype=np.float64), energy_last[is_new]]
+        )
+        merged_first = np.concatenate([merged_energy[: existing_labels.size], energy_first[is_new]])
+        merged_new = np.r_[np.zeros(existing_labels.size, dtype=bool), np.ones(int(is_new.sum()), dtype=bool)]
+
+        order = np.argsort(merged_labels, kind="stable")
+        merged_labels = merged_labels[order]
+        merged_values = merged_values[order]
+        merged_energy = merged_energy[order]
+        merged_first = merged_first[order]
+        merged_new = merged_new[order]
+
+        # 3. energy_minute = energy - energy baris sebelumnya. Baris pertama memakai
+        # minutely terakhir di DB jika lebih lama dari rentang yang dibaca (konsumsi
+        # selama celah ikut tercatat), selain itu last - first menit itu sendiri
+        first_baseline = merged_first[:1]
+        if last_row is not None and last_existing is not None and last_existing < int(merged_labels[0]):
+            first_baseline = np.array([float(last_row["energy"])], dtype=np.float64)
+        previous = np.r_[first_baseline, merged_energy[:-1]]
+        deltas = np.maximum(np.round((merged_energy - previous) * 1000) / 1000, 0.0)
+
+        minute_rows = [
+            (to_datetime(int(label)), *row_values, float(energy), float(delta))
+            for label, row_values, energy, delta in zip(
+                merged_labels[merged_new], merged_values[merged_new].tolist(), merged_energy[merged_new], deltas[merged_new]
+            )
+        ]
+        # Baris lama tepat setelah celah yang diisi: delta-nya dihitung ulang
+        # agar konsumsi selama celah tidak tercatat dua kali
+        follows_new = np.r_[False, merged_new[:-1]] & ~merged_new
+        delta_fixes = [
+            (to_datetime(int(label)), float(delta))
+            for label, delta in zip(merged_labels[follows_new], deltas[follows_new])
+        ]
+
+        # 4. Bucket per jam dari label minutely
+        hours = merged_labels // 3600
+        hour_starts = group_starts(hours)
+        hour_ends = np.r_[hour_starts[1:], hours.size]
+        hour_keys = hours[hour_starts]
+        hour_averages = np.add.reduceat(merged_values, hour_starts, axis=0) / (hour_ends - hour_starts)[:, None]
+        hour_first_energy = merged_energy[hour_starts]
+        hour_has_new = np.logical_or.reduceat(merged_new, hour_starts)
+        position = {int(key): index for index, key in enumerate(hour_keys)}
+
+        hour_candidates = []
+        for index, key in enumerate(hour_keys):
+            key = int(key)
+            previous_index = position.get(key - 1)
+            next_index = position.get(key + 1)
+            if previous_index is None or next_index is None:
+                continue
+            if not (hour_has_new[index] or hour_has_new[previous_index]):
+                continue
+            hour_candidates.append(
+                (
+                    to_datetime((key + 1) * 3600),
+                    *hour_averages[index].tolist(),
+                    float(hour_first_energy[next_index]),
+                    round((float(hour_first_energy[index]) - float(hour_first_energy[previous_index])) * 1000) / 1000,
+                )
+            )
+
+        existing_hours = set()
+        if hour_candidates:
+            existing_hours = self._repo.get_hourly_datetimes(
+                device_id, hour_candidates[0][0], hour_candidates[-1][0]
+            )
+        hour_rows = [row for row in hour_candidates if row[0] not in existing_hours]
+
+        # 5. Potong saldo hanya untuk periode setelah data terakhir di DB.
+        # Jurnal ditulis sebelum insert: jika insert gagal lalu diulang, kunci
+        # (device_id, label) yang sama tidak akan dipotong dua kali.
+        charges = 0
+        if self._balance_mode == "minute":
+            for row in minute_rows:
+                if last_existing is None or (row[0] - EPOCH).total_seconds() > last_existing:
+                    self._ledger.charge(device_id, row[0], row[-1])
+                    charges += 1
+        elif hour_rows:
+            last_hour = self._repo.get_last_hourly_datetime(device_id)
+            for row in hour_rows:
+                if last_hour is None or row[0] > last_hour:
+                    self._ledger.charge(device_id, row[0], row[-1])
+                    charges += 1
+
+        # 6. Tulis dalam satu transaksi
+        self._repo.write_backfill(device_id, minute_rows, delta_fixes, hour_rows)
+        if hour_rows:
+            try:
+                self._repo.refresh_rollups(device_id, min(row[0] for row in hour_rows), max(row[0] for row in hour_rows))
+            except Exception:
+                # Rollup bisa dibangun ulang lewat `python -m mqtt_worker.backfill_rollups`
+                self._logger.exception("rollup_refresh_failed", device_id=device_id)
+
+        return BatchResult(
+            minutes_inserted=len(minute_rows),
+            minutes_skipped=int(labels.size - is_new.sum()),
+            hours_inserted=len(hour_rows),
+            charges=charges,
+        )
@@ -1,13 +1,121 @@
-from datetime import datetime
+import sys
+from array import array
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from threading import Lock
 
 from mqtt_worker.db.repository import Repository
+from mqtt_worker.processors.minute import MinuteAggregate
+from mqtt_worker.processors.reading import FIELDS, Averages
+from mqtt_worker.utils.datetime import floor_hour
 from mqtt_worker.utils.logger import get_logger
 
 
+_FIRST_ENERGY_HISTORY = 3
+
+
+@dataclass(slots=True)
+class HourlyAggregate:
+    hour_start: datetime
+    averages: Averages
+    energy_delta: float
+
+
+class HourlyAccumulator:
+    """Akumulasi baris minutely per jam (berdasarkan label datetime minutely).
+
+    Rata-rata sama dengan `Repository.get_hourly_legacy` (rata-rata dari
+    rata-rata per menit). Delta energy = energy minutely pertama jam ini -
+    energy minutely pertama jam sebelumnya; berbeda dari legacy yang lebih
+    dulu memakai data_hourly[jam sebelumnya].energy sebagai baseline jika baris
+    itu ada. Nilainya sama selama baris hourly itu ditulis oleh pipeline live
+    (energy-nya = energy minutely pertama jam sebelumnya). Jam yang tidak
+    terlihat lengkap sejak awal (misal setelah restart/reset) tidak dihitung
+    dari memory sehingga pemanggil harus fallback ke SQL.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self._hour: datetime | None = None
+        self._complete = False
+        self._count = 0
+        self._sums = array("d", [0.0] * len(FIELDS))
+        self._closed: tuple[datetime, Averages] | None = None
+        self._first_energy: dict[datetime, float] = {}
+
+    def add(self, aggregate: MinuteAggregate) -> None:
+        minute_mark = aggregate.minute_mark
+        energy = aggregate.energy_last
+        hour = floor_hour(minute_mark)
+        if self._hour is not None and hour < self._hour:
+            self.reset()
+
+        if hour != self._hour:
+            self._close()
+            # Jam dianggap lengkap jika dibuka dari jam sebelumnya yang dilacak,
+            # atau baris pertamanya tepat di menit 00
+            self._complete = self._hour is not None or minute_mark.minute == 0
+            self._hour = hour
+            self._count = 0
+            for index in range(len(FIELDS)):
+                self._sums[index] = 0.0
+            if self._complete:
+                self._first_energy[hour] = energy
+                for old_hour in sorted(self._first_energy)[:-_FIRST_ENERGY_HISTORY]:
+                    del self._first_energy[old_hour]
+
+        averages = aggregate.averages
+        sums = self._sums
+        sums[0] += averages.voltage
+        sums[1] += averages.current
+        sums[2] += averages.power
+        sums[3] += averages.frequency
+        sums[4] += averages.pf
+        self._count += 1
+
+    def memory_bytes(self) -> int:
+        size = sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sys.getsizeof(self._sums)
+        size += sys.getsizeof(self._first_energy)
+        size += sum(sys.getsizeof(hour) + sys.getsizeof(energy) for hour, energy in self._first_energy.items())
+        if self._closed is not None:
+            size += sys.getsizeof(self._closed) + sys.getsizeof(self._closed[1])
+        return size
+
+    def _close(self) -> None:
+        if self._hour is None or not self._complete or self._count == 0:
+            self._closed = None
+            return
+        count = self._count
+        sums = self._sums
+        self._closed = (
+            self._hour,
+            Averages(sums[0] / count, sums[1] / count, sums[2] / count, sums[3] / count, sums[4] / count),
+        )
+
+    def build(self, hour_start: datetime) -> HourlyAggregate | None:
+        if self._closed is None or self._closed[0] != hour_start:
+            return None
+        energy_after = self._first_energy.get(hour_start)
+        energy_before = self._first_energy.get(hour_start - timedelta(hours=1))
+        if energy_after is None or energy_before is None:
+            return None
+        return HourlyAggregate(
+            hour_start=hour_start,
+            averages=self._closed[1],
+            energy_delta=round((energy_after - energy_before) * 1000) / 1000,
+        )
+
+
 class HourlyProcessor:
     def __init__(self, repository: Repository):
         self._repo = repository
         self._logger = get_logger(__name__)
+        self._stats_lock = Lock()
+        self._memory_hits = 0
+        self._sql_fallbacks = 0
+        self._rollup_failures = 0
 
     def handle(
         self,
@@ -15,29 +123,57 @@ class HourlyProcessor:
         hour_range_start: datetime,
         insert_dt: datetime,
         energy_value: float,
+        aggregate: HourlyAggregate | None = None,
     ) -> tuple[bool, float | None]:
         try:
-            aggregate = self._repo.get_hourly_legacy(device_id, hour_range_start)
-            if not aggregate:
-                self._logger.warning(
-                    "hourly_no_data",
-                    device_id=device_id,
-                    hour_start=hour_range_start.isoformat(),
-                )
-                return True, None
+            if aggregate is not None:
+                averages = aggregate.averages
+                energy_delta = aggregate.energy_delta
+                with self._stats_lock:
+                    self._memory_hits += 1
+            else:
+                with self._stats_lock:
+                    self._sql_fallbacks += 1
+                legacy = self._repo.get_hourly_legacy(device_id, hour_range_start)
+                if not legacy:
+                    self._logger.warning(
+                        "hourly_no_data",
+                        device_id=device_id,
+                        hour_start=hour_range_start.isoformat(),
+                    )
+                    return True, None
+                averages = legacy["averages"]
+                energy_delta = legacy["energy_delta"]
 
             self._repo.upsert_hourly(
                 device_id=device_id,
                 dt=insert_dt,
-                averages=aggregate["averages"],
+                averages=averages,
                 energy_last=energy_value,
-                energy_delta=aggregate["energy_delta"],
+                energy_delta=energy_delta,
             )
-            return True, aggregate["energy_delta"]
         except Exception:
             self._logger.exception(
                 "hourly_insert_failed",
                 device_id=device_id,
                 hour_start=hour_range_start.isoformat(),
             )
-            return False, None
\ No newline at end of file
+            return False, None
+
+        try:
+            self._repo.refresh_rollups(device_id, insert_dt, insert_dt)
+        except Exception:
+            # Jam tetap dianggap tersimpan; rollup bisa dibangun ulang lewat
+            # `python -m mqtt_worker.backfill_rollups`
+            with self._stats_lock:
+                self._rollup_failures += 1
+            self._logger.exception("rollup_refresh_failed", device_id=device_id, hour=insert_dt.isoformat())
+        return True, energy_delta
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "memory_hits": self._memory_hits,
+                "sql_fallbacks": self._sql_fallbacks,
+                "rollup_failures": self._rollup_failures,
+            }
\ No newline at end of file
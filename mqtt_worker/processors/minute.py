@@ -1,56 +1,125 @@
+import sys
+from array import array
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 
+from mqtt_worker.processors.reading import FIELDS, Averages, Reading
 from mqtt_worker.utils.datetime import floor_minute
 
 
-FIELDS = ("voltage", "current", "power", "frequency", "pf")
-
-
-@dataclass
+@dataclass(slots=True)
 class MinuteAggregate:
     minute_mark: datetime
     bucket_hour: datetime
-    averages: dict
+    averages: Averages
     energy_first: float
     energy_last: float
 
 
 class MinuteAggregator:
+    """Rata-rata per menit; jumlah per field disimpan di array('d') yang dipakai ulang."""
+
+    __slots__ = ("_minute_start", "_count", "_sums", "_energy_first", "_energy_last")
+
     def __init__(self):
         self._minute_start: datetime | None = None
         self._count = 0
-        self._sums = {field: 0.0 for field in FIELDS}
+        self._sums = array("d", [0.0] * len(FIELDS))
         self._energy_first: float | None = None
         self._energy_last: float | None = None
 
-    def add(self, payload: dict, dt: datetime) -> MinuteAggregate | None:
-        minute_start = floor_minute(dt)
+    @property
+    def minute_start(self) -> datetime | None:
+        """Awal menit bucket yang sedang terbuka, None jika kosong."""
+        return self._minute_start
+
+    def add(self, reading: Reading, energy: float) -> MinuteAggregate | None:
+        """`energy` dipisah dari reading karena bisa sudah dinormalisasi (reset PZEM)."""
+        minute_start = floor_minute(reading.dt)
         if self._minute_start is None:
-            self._start_bucket(minute_start, payload)
+            self._start_bucket(minute_start, reading, energy)
             return None
 
         if minute_start == self._minute_start:
-            self._accumulate(payload)
+            self._accumulate(reading, energy)
             return None
 
         aggregate = self._finalize(minute_start)
-        self._start_bucket(minute_start, payload)
+        self._start_bucket(minute_start, reading, energy)
         return aggregate
 
-    def _start_bucket(self, minute_start: datetime, payload: dict) -> None:
+    def flush(self) -> MinuteAggregate | None:
+        """Tutup bucket yang terbuka dengan label awal menit berikutnya lalu kosongkan."""
+        if self._minute_start is None:
+            return None
+        aggregate = self._finalize(self._minute_start + timedelta(minutes=1))
+        self._minute_start = None
+        self._count = 0
+        self._energy_first = None
+        self._energy_last = None
+        return aggregate
+
+    def discard_if_started_before(self, dt: datetime) -> bool:
+        """Buang bucket terbuka yang dimulai pada/sebelum `dt`; return True jika dibuang."""
+        if self._minute_start is None or self._minute_start > dt:
+            return False
+        self._minute_start = None
+        self._count = 0
+        self._energy_first = None
+        self._energy_last = None
+        return True
+
+    def memory_bytes(self) -> int:
+        size = sys.getsizeof(self) + sys.getsizeof(self._sums)
+        if self._minute_start is not None:
+            size += sys.getsizeof(self._minute_start)
+        return size
+
+    def state(self) -> dict | None:
+        """State bucket menit yang sedang terbuka (untuk snapshot), None jika kosong."""
+        if self._minute_start is None:
+            return None
+        return {
+            "minute_start": self._minute_start.isoformat(),
+            "count": self._count,
+            "sums": list(self._sums),
+            "energy_first": self._energy_first,
+            "energy_last": self._energy_last,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict | None) -> "MinuteAggregator":
+        aggregator = cls()
+        if state:
+            sums = state["sums"]
+            if len(sums) != len(FIELDS):
+                raise ValueError("minute state sums length mismatch")
+            aggregator._minute_start = datetime.fromisoformat(state["minute_start"])
+            aggregator._count = int(state["count"])
+            aggregator._sums = array("d", sums)
+            aggregator._energy_first = state["energy_first"]
+            aggregator._energy_last = state["energy_last"]
+        return aggregator
+
+    def _start_bucket(self, minute_start: datetime, reading: Reading, energy: float) -> None:
         self._minute_start = minute_start
         self._count = 0
-        self._sums = {field: 0.0 for field in FIELDS}
+        sums = self._sums
+        for index in range(len(FIELDS)):
+            sums[index] = 0.0
         self._energy_first = None
         self._energy_last = None
-        self._accumulate(payload)
+        self._accumulate(reading, energy)
 
-    def _accumulate(self, payload: dict) -> None:
+    def _accumulate(self, reading: Reading, energy_value: float) -> None:
+        # Urutan mengikuti FIELDS
+        sums = self._sums
+        sums[0] += reading.voltage
+        sums[1] += reading.current
+        sums[2] += reading.power
+        sums[3] += reading.frequency
+        sums[4] += reading.pf
         self._count += 1
-        for field in FIELDS:
-            self._sums[field] += float(payload[field])
-        energy_value = float(payload["energy"])
         if self._energy_first is None:
             self._energy_first = energy_value
         self._energy_last = energy_value
@@ -59,11 +128,12 @@ class MinuteAggregator:
         if self._count == 0 or self._minute_start is None or self._energy_first is None or self._energy_last is None:
             return None
 
-        averages = {field: self._sums[field] / self._count for field in FIELDS}
+        count = self._count
+        sums = self._sums
         return MinuteAggregate(
             minute_mark=minute_mark,
             bucket_hour=self._minute_start.replace(minute=0, second=0, microsecond=0),
-            averages=averages,
+            averages=Averages(sums[0] / count, sums[1] / count, sums[2] / count, sums[3] / count, sums[4] / count),
             energy_first=self._energy_first,
             energy_last=self._energy_last,
         )
\ No newline at end of file
@@ -0,0 +1,137 @@
+from datetime import datetime
+from threading import Event, Lock, Thread
+
+from mqtt_worker.db.repository import Repository
+from mqtt_worker.storage.file_buffer import FileBuffer
+from mqtt_worker.utils.logger import get_logger
+
+
+_JOURNAL_STREAM = "jobs"
+_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class PredictionScheduler:
+    """Kumpulkan job prediksi dari semua pipeline lalu enqueue dalam satu INSERT.
+
+    Di jam trigger, setiap device melewati pergantian jam hampir bersamaan.
+    Pipeline hanya menulis (device_id, type, history_end) ke jurnal lokal
+    (FileBuffer), jadi job tetap ada walau proses crash atau DB sedang mati
+    setelah record WAL pemicunya di-commit. Thread latar mem-flush jurnal
+    setiap `flush_interval_ms` lewat `Repository.enqueue_prediction_jobs`.
+    Duplikat (termasuk replay jurnal) ditolak oleh unique key
+    (device_id, type, history_end_key) di tabel predictions.
+    """
+
+    def __init__(
+        self,
+        repository: Repository,
+        journal: FileBuffer,
+        flush_interval_ms: int = 2000,
+        batch_size: int = 1000,
+    ):
+        self._repo = repository
+        self._journal = journal
+        self._logger = get_logger(__name__)
+        self._flush_interval = flush_interval_ms / 1000.0
+        self._batch_size = batch_size
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._enqueued = 0
+        self._failures = 0
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._check_dedupe_key()
+        self._thread = Thread(target=self._run, name="prediction-scheduler", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._flush_interval + 5)
+            self._thread = None
+        self.flush()
+
+    def schedule(self, device_id: int, prediction_type: str, history_end: datetime) -> None:
+        if prediction_type not in ("hourly", "daily"):
+            raise ValueError("prediction_type must be 'hourly' or 'daily'")
+        self._journal.append(
+            _JOURNAL_STREAM,
+            {
+                "device_id": device_id,
+                "type": prediction_type,
+                "history_end": history_end.replace(minute=0, second=0, microsecond=0).strftime(_DATETIME_FORMAT),
+            },
+        )
+
+    def _apply(self, records: list[dict]) -> bool:
+        jobs: set[tuple[int, str, datetime]] = set()
+        for record in records:
+            try:
+                jobs.add((
+                    int(record["device_id"]),
+                    str(record["type"]),
+                    datetime.strptime(record["history_end"], _DATETIME_FORMAT),
+                ))
+            except Exception:
+                self._logger.exception("prediction_job_record_invalid", record=record)
+        if not jobs:
+            return True
+
+        ordered = sorted(jobs)
+        inserted = self._repo.enqueue_prediction_jobs(ordered)
+        with self._lock:
+            self._enqueued += inserted
+        self._logger.info(
+            "prediction_jobs_enqueued",
+            jobs=len(ordered),
+            inserted=inserted,
+            history_end=ordered[-1][2].strftime(_DATETIME_FORMAT),
+        )
+        return True
+
+    def flush(self) -> bool:
+        with self._flush_lock:
+            while True:
+                try:
+                    result = self._journal.process_batch(_JOURNAL_STREAM, self._apply, self._batch_size)
+                except Exception:
+                    self._logger.exception("prediction_jobs_enqueue_failed")
+                    result = None
+
+                if result is None or (result.processed == 0 and result.remaining > 0):
+                    with self._lock:
+                        self._failures += 1
+                    return False
+                if result.remaining == 0:
+                    return True
+
+    def _check_dedupe_key(self) -> None:
+        # Tanpa unique key, replay jurnal/pipeline bisa membuat job ganda
+        try:
+            present = self._repo.has_prediction_schedule_key()
+        except Exception:
+            self._logger.exception("prediction_dedupe_key_check_failed")
+            return
+        if not present:
+            self._logger.warning(
+                "prediction_dedupe_key_missing",
+                detail="apply uq_predictions_schedule from example/mqtt_worker_schema.sql",
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            enqueued = self._enqueued
+            failures = self._failures
+        return {
+            "pending": self._journal.pending(_JOURNAL_STREAM),
+            "enqueued": enqueued,
+            "failures": failures,
+        }
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._flush_interval):
+            self.flush()
@@ -0,0 +1,61 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+from mqtt_worker.utils.datetime import parse_datetime
+
+
+# Urutan field rata-rata (juga urutan slot array di MinuteAggregator)
+FIELDS = ("voltage", "current", "power", "frequency", "pf")
+
+
+@dataclass(slots=True)
+class Reading:
+    """Satu pembacaan telemetry yang sudah di-decode (sekali) dari payload MQTT."""
+
+    device_id: int
+    username: str
+    device_code: str
+    dt: datetime
+    voltage: float
+    current: float
+    power: float
+    energy: float
+    frequency: float
+    pf: float
+    uptime: int = 0
+    received_at: float = 0.0
+
+    @classmethod
+    def from_payload(
+        cls,
+        device_id: int,
+        username: str,
+        device_code: str,
+        payload: dict,
+        dt: datetime | None = None,
+        received_at: float = 0.0,
+    ) -> "Reading":
+        """Raise ValueError/KeyError/TypeError jika payload tidak valid."""
+        return cls(
+            device_id=int(device_id),
+            username=username,
+            device_code=device_code,
+            dt=dt if dt is not None else parse_datetime(payload["datetime"]),
+            voltage=float(payload["voltage"]),
+            current=float(payload["current"]),
+            power=float(payload["power"]),
+            energy=float(payload["energy"]),
+            frequency=float(payload["frequency"]),
+            pf=float(payload["pf"]),
+            uptime=int(payload.get("uptime", 0) or 0),
+            received_at=received_at,
+        )
+
+
+@dataclass(slots=True)
+class Averages:
+    voltage: float
+    current: float
+    power: float
+    frequency: float
+    pf: float
\ No newline at end of file
@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from mqtt_worker.processors.reading import FIELDS
+
+
+BATCH_COLUMNS = ("datetime", "voltage", "current", "power", "energy", "frequency", "pf")
+
+# Batas validasi batch, relatif terhadap waktu batch diterima server
+_BATCH_MAX_AGE_SECONDS = 7 * 24 * 3600
+_BATCH_MAX_FUTURE_SECONDS = 120
+_BATCH_MAX_READINGS = 20000
+
+# "dd-mm-YYYY HH:MM:SS" -> "YYYY-mm-dd HH:MM:SS" (indeks karakter)
+_ISO_CHAR_ORDER = [6, 7, 8, 9, 2, 3, 4, 5, 0, 1, 10, 11, 12, 13, 14, 15, 16, 17, 18]
+EPOCH = datetime(1970, 1, 1)
+
+
+@dataclass(slots=True)
+class ReadingBatch:
+    """Kumpulan pembacaan historis satu device (topic `swm-batch`), dalam bentuk kolom."""
+
+    device_id: int
+    username: str
+    device_code: str
+    received_at: float
+    timestamps: np.ndarray  # int64, detik sejak epoch (waktu lokal device, naive)
+    values: np.ndarray      # float64 [n, len(FIELDS)], urutan FIELDS
+    energy: np.ndarray      # float64 [n]
+    dropped: int = 0
+
+    def __len__(self) -> int:
+        return int(self.timestamps.shape[0])
+
+    @property
+    def last_dt(self) -> datetime | None:
+        if not self.timestamps.size:
+            return None
+        return to_datetime(int(self.timestamps[-1]))
+
+
+def to_datetime(seconds: int) -> datetime:
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def _to_columns(payload) -> dict:
+    """Terima format baris (`readings: [...]` / array) atau kolom (`datetime: [...]`)."""
+    if isinstance(payload, dict) and isinstance(payload.get("datetime"), list):
+        return {name: payload.get(name) for name in BATCH_COLUMNS}
+
+    rows = payload.get("readings") if isinstance(payload, dict) else payload
+    if not isinstance(rows, list):
+        raise ValueError("batch payload must contain readings or columnar arrays")
+    try:
+        return {name: [row[name] for row in rows] for name in BATCH_COLUMNS}
+    except (KeyError, TypeError) as exc:
+        raise ValueError(f"batch reading missing field: {exc}") from exc
+
+
+def _parse_timestamps(values: list) -> np.ndarray:
+    text = np.asarray(values, dtype=str)
+    if text.ndim != 1 or (text.size and not np.all(np.char.str_len(text) == 19)):
+        raise ValueError("batch datetime must use format dd-mm-YYYY HH:MM:SS")
+    if text.size == 0:
+        return np.empty(0, dtype=np.int64)
+    chars = text.astype("U19").view("U1").reshape(-1, 19)[:, _ISO_CHAR_ORDER]
+    iso = np.ascontiguousarray(chars).view("U19").ravel()
+    try:
+        return iso.astype("datetime64[s]").astype(np.int64)
+    except ValueError as exc:
+        raise ValueError(f"batch datetime invalid: {exc}") from exc
+
+
+def parse_batch(device_id: int, username: str, device_code: str, payload, received_at: float) -> ReadingBatch:
+    """Validasi + ubah payload batch menjadi kolom NumPy terurut waktu.
+
+    Baris dengan nilai non-finite, datetime di luar batas, atau datetime
+    duplikat dibuang (dihitung di `dropped`). Raise ValueError jika struktur
+    payload tidak valid.
+    """
+    columns = _to_columns(payload)
+    lengths = {len(column) if isinstance(column, list) else -1 for column in columns.values()}
+    if len(lengths) != 1 or -1 in lengths:
+        raise ValueError("batch columns must be arrays of equal length")
+    total = lengths.pop()
+    if total > _BATCH_MAX_READINGS:
+        raise ValueError(f"batch too large: {total} > {_BATCH_MAX_READINGS}")
+
+    timestamps = _parse_timestamps(columns["datetime"])
+    try:
+        values = np.empty((total, len(FIELDS)), dtype=np.float64)
+        for index, field in enumerate(FIELDS):
+            values[:, index] = np.asarray(columns[field], dtype=np.float64)
+        energy = np.asarray(columns["energy"], dtype=np.float64)
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f"batch value invalid: {exc}") from exc
+
+    reference = int((datetime.fromtimestamp(received_at).replace(microsecond=0) - EPOCH).total_seconds())
+    valid = (
+        np.isfinite(values).all(axis=1)
+        & np.isfinite(energy)
+        & (energy >= 0)
+        & (timestamps >= reference - _BATCH_MAX_AGE_SECONDS)
+        & (timestamps <= reference + _BATCH_MAX_FUTURE_SECONDS)
+    )
+    timestamps, values, energy = timestamps[valid], values[valid], energy[valid]
+
+    order = np.argsort(timestamps, kind="stable")
+    timestamps, values, energy = timestamps[order], values[order], energy[order]
+    if timestamps.size:
+        unique = np.r_[True, timestamps[1:] != timestamps[:-1]]
+        timestamps, values, energy = timestamps[unique], values[unique], energy[unique]
+
+    return ReadingBatch(
+        device_id=int(device_id),
+        username=username,
+        device_code=device_code,
+        received_at=received_at,
+        timestamps=timestamps,
+        values=values,
+        energy=energy,
+        dropped=total - int(timestamps.size),
+    )
+
+
+def group_starts(keys: np.ndarray) -> np.ndarray:
+    """Indeks awal tiap grup dari array terurut."""
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
@@ -1,20 +1,132 @@
-from datetime import datetime
+import time
+from threading import Event, Lock, Thread
 
 from mqtt_worker.db.repository import Repository
+from mqtt_worker.processors.reading import Reading
 from mqtt_worker.utils.logger import get_logger
+from mqtt_worker.utils.metrics import STAGE_SECONDS
+
+
+_WRITE_SECONDS = STAGE_SECONDS.labels("realtime_write")
+_MAX_RETRY_BACKOFF_SECONDS = 30.0
 
 
 class RealtimeProcessor:
-    def __init__(self, repository: Repository):
+    """Write-behind untuk `data_realtime` dan status online device.
+
+    Hanya nilai terakhir per device yang disimpan di memori (latest-wins),
+    lalu di-flush setiap `flush_interval_ms` sebagai satu batch. Jika flush
+    tertinggal lebih dari `max_staleness_ms`, pemanggil `handle` ikut flush
+    secara sinkron sehingga data di DB tidak pernah lebih basi dari batas itu
+    (selama DB bisa ditulis). Setelah flush gagal, percobaan berikutnya
+    menunggu backoff eksponensial dan `handle` tidak pernah menunggu flush
+    yang sedang berjalan.
+    """
+
+    def __init__(
+        self,
+        repository: Repository,
+        flush_interval_ms: int = 1000,
+        max_staleness_ms: int = 5000,
+    ):
         self._repo = repository
         self._logger = get_logger(__name__)
+        self._flush_interval = flush_interval_ms / 1000.0
+        self._max_staleness = max(max_staleness_ms, flush_interval_ms) / 1000.0
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pending: dict[int, tuple] = {}
+        self._oldest_pending: float | None = None
+        self._retry_backoff = 0.0
+        self._retry_at = 0.0
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, name="realtime-writer", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._max_staleness)
+            self._thread = None
+        self.flush()
 
-    def handle(self, device_id: int, payload: dict, dt: datetime) -> bool:
+    def handle(self, reading: Reading, energy: float) -> bool:
+        """`energy` dipisah dari reading karena bisa sudah dinormalisasi (reset PZEM)."""
+        device_id = reading.device_id
+        dt = reading.dt
+        row = (
+            reading.voltage,
+            reading.current,
+            reading.power,
+            energy,
+            reading.frequency,
+            reading.pf,
+            dt,
+            reading.uptime,
+        )
+
+        with self._lock:
+            current = self._pending.get(device_id)
+            if current is None or current[6] <= dt:
+                self._pending[device_id] = row
+            now = time.monotonic()
+            if self._oldest_pending is None:
+                self._oldest_pending = now
+            stale = now - self._oldest_pending > self._max_staleness and now >= self._retry_at
+
+        if stale:
+            # Flush yang sedang berjalan (thread writer/ingest lain) sudah cukup
+            self.flush(blocking=False)
+        return True
+
+    def flush(self, blocking: bool = True) -> bool:
+        if not self._flush_lock.acquire(blocking=blocking):
+            return False
         try:
-            self._repo.upsert_realtime(device_id, payload, dt)
-            uptime = int(payload.get("uptime", 0))
-            self._repo.update_device_online(device_id, dt, uptime)
-            return True
-        except Exception:
-            self._logger.exception("realtime_update_failed", device_id=device_id)
-            return False
\ No newline at end of file
+            with self._lock:
+                if not self._pending:
+                    return True
+                batch = self._pending
+                oldest = self._oldest_pending
+                self._pending = {}
+                self._oldest_pending = None
+
+            started = time.perf_counter()
+            try:
+                self._repo.write_realtime_batch(batch)
+                _WRITE_SECONDS.observe(time.perf_counter() - started)
+                with self._lock:
+                    self._retry_backoff = 0.0
+                    self._retry_at = 0.0
+                return True
+            except Exception:
+                self._logger.exception("realtime_flush_failed", devices=len(batch))
+                with self._lock:
+                    self._retry_backoff = min(max(self._retry_backoff * 2, self._flush_interval), _MAX_RETRY_BACKOFF_SECONDS)
+                    self._retry_at = time.monotonic() + self._retry_backoff
+                    # Data yang lebih baru (masuk saat flush) tetap menang
+                    for device_id, row in batch.items():
+                        current = self._pending.get(device_id)
+                        if current is None or current[6] < row[6]:
+                            self._pending[device_id] = row
+                    if oldest is not None and (self._oldest_pending is None or oldest < self._oldest_pending):
+                        self._oldest_pending = oldest
+                return False
+        finally:
+            self._flush_lock.release()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._flush_interval):
+            with self._lock:
+                waiting = time.monotonic() < self._retry_at
+            if not waiting:
+                self.flush()
@@ -0,0 +1,148 @@
+import time
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+
+from mqtt_worker.db.repository import Repository
+from mqtt_worker.storage.file_buffer import FileBuffer
+from mqtt_worker.utils.logger import get_logger
+
+
+_JOURNAL_STREAM = "charges"
+_PRUNE_INTERVAL_SECONDS = 3600
+_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class TokenLedger:
+    """Write-behind potongan saldo token.
+
+    `charge` hanya menulis ke jurnal lokal (FileBuffer) sehingga aman begitu
+    fungsi kembali. Thread flusher membaca jurnal per batch lalu menerapkannya
+    ke DB dalam satu transaksi (`Repository.apply_token_charges`). Kunci
+    `(device_id, minute_mark)` membuat charge yang sama hanya dipotong sekali,
+    termasuk saat buffer di-replay setelah crash.
+    """
+
+    def __init__(
+        self,
+        repository: Repository,
+        journal: FileBuffer,
+        flush_interval_ms: int = 5000,
+        batch_size: int = 1000,
+        retention_days: int = 7,
+    ):
+        self._repo = repository
+        self._journal = journal
+        self._logger = get_logger(__name__)
+        self._flush_interval = flush_interval_ms / 1000.0
+        self._batch_size = batch_size
+        self._retention = timedelta(days=retention_days)
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._oldest_pending: float | None = None
+        self._last_prune = 0.0
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+        self._flushed = 0
+        self._duplicates = 0
+        self._failures = 0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        if self._journal.pending(_JOURNAL_STREAM):
+            # Sisa jurnal dari proses sebelumnya
+            self._oldest_pending = time.monotonic()
+        self._thread = Thread(target=self._run, name="token-ledger", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._flush_interval * 2)
+            self._thread = None
+        self.flush()
+
+    def charge(self, device_id: int, minute_mark: datetime, amount: float) -> None:
+        if amount <= 0:
+            return
+        self._journal.append(
+            _JOURNAL_STREAM,
+            {
+                "device_id": device_id,
+                "minute_mark": minute_mark.strftime(_DATETIME_FORMAT),
+                "amount": amount,
+            },
+        )
+        with self._lock:
+            if self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+
+    def _apply(self, records: list[dict]) -> bool:
+        charges: dict[tuple[int, datetime], float] = {}
+        for record in records:
+            try:
+                key = (int(record["device_id"]), datetime.strptime(record["minute_mark"], _DATETIME_FORMAT))
+                amount = float(record["amount"])
+            except Exception:
+                self._logger.exception("token_ledger_record_invalid", record=record)
+                continue
+            # Duplikat di batch yang sama (replay pipeline): ambil yang pertama
+            charges.setdefault(key, amount)
+
+        applied = self._repo.apply_token_charges(
+            [(device_id, minute_mark, amount) for (device_id, minute_mark), amount in charges.items()]
+        )
+        with self._lock:
+            self._flushed += applied
+            self._duplicates += len(records) - applied
+        return True
+
+    def flush(self) -> bool:
+        with self._flush_lock:
+            while True:
+                try:
+                    result = self._journal.process_batch(_JOURNAL_STREAM, self._apply, self._batch_size)
+                except Exception:
+                    self._logger.exception("token_ledger_flush_failed")
+                    result = None
+
+                if result is None or (result.processed == 0 and result.remaining > 0):
+                    with self._lock:
+                        self._failures += 1
+                    return False
+                if result.remaining == 0:
+                    with self._lock:
+                        # Cek ulang: charge baru bisa masuk setelah batch terakhir
+                        if self._journal.pending(_JOURNAL_STREAM) == 0:
+                            self._oldest_pending = None
+                    return True
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        if now - self._last_prune < _PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        try:
+            deleted = self._repo.prune_token_ledger(datetime.now() - self._retention)
+            if deleted:
+                self._logger.info("token_ledger_pruned", deleted=deleted)
+        except Exception:
+            self._logger.exception("token_ledger_prune_failed")
+
+    def stats(self) -> dict:
+        with self._lock:
+            oldest = self._oldest_pending
+            lag = round(time.monotonic() - oldest, 3) if oldest is not None else 0.0
+            return {
+                "pending": self._journal.pending(_JOURNAL_STREAM),
+                "flush_lag_seconds": lag,
+                "flushed": self._flushed,
+                "duplicates": self._duplicates,
+                "failures": self._failures,
+            }
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._flush_interval):
+            self.flush()
+            self._prune()
\ No newline at end of file
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable
+
+from mqtt_worker.storage.file_buffer import BufferResult, FileBuffer, ProcessDecision
+from mqtt_worker.utils.logger import get_logger
+
+
+class BufferDrainer:
+    """Proses buffer banyak device secara paralel di thread pool.
+
+    Per device hanya ada satu task aktif. Jika `schedule` dipanggil saat
+    device tersebut sedang diproses, task yang berjalan akan mengulang
+    `process` sekali lagi setelah selesai, sehingga urutan per device tetap
+    serial dan tidak ada record yang tertinggal.
+
+    Backlog diproses per potongan `chunk_records` record; lock device dilepas
+    di antara potongan sehingga pesan live untuk device yang sedang dikuras
+    tetap bisa di-append (antre di belakang backlog) tanpa menahan thread
+    ingest, dan banyak device yang backlog maju bergiliran.
+    """
+
+    def __init__(self, buffer: FileBuffer, max_workers: int, chunk_records: int = 500):
+        self._buffer = buffer
+        self._chunk_records = chunk_records
+        self._logger = get_logger(__name__)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="buffer-drain")
+        self._lock = Lock()
+        self._rerun: dict[str, bool] = {}
+
+    def schedule(
+        self,
+        device_code: str,
+        handler: Callable[[dict], ProcessDecision],
+        on_done: Callable[[str, BufferResult], None] | None = None,
+    ) -> bool:
+        """Return False jika device sudah dikuras task lain (hanya ditandai untuk diulang)."""
+        with self._lock:
+            if device_code in self._rerun:
+                self._rerun[device_code] = True
+                return False
+            self._rerun[device_code] = False
+        self._executor.submit(self._drain, device_code, handler, on_done)
+        return True
+
+    def _drain(
+        self,
+        device_code: str,
+        handler: Callable[[dict], ProcessDecision],
+        on_done: Callable[[str, BufferResult], None] | None,
+        processed: int = 0,
+    ) -> None:
+        result = BufferResult(0, 0)
+        try:
+            result = self._buffer.process(device_code, handler, max_records=self._chunk_records)
+            processed += result.processed
+        except Exception:
+            self._logger.exception("buffer_drain_failed", device_code=device_code)
+
+        with self._lock:
+            # Potongan berikutnya diantrekan ulang (bukan loop) agar device lain
+            # di pool ikut maju dan append live sempat mengambil lock device
+            more = result.processed > 0 and self._buffer.unread(device_code) > 0
+            if not more and self._rerun.get(device_code):
+                self._rerun[device_code] = False
+                more = True
+            if not more:
+                self._rerun.pop(device_code, None)
+
+        if more:
+            try:
+                self._executor.submit(self._drain, device_code, handler, on_done, processed)
+                return
+            except RuntimeError:
+                # Executor sudah shutdown: sisa backlog tetap di WAL untuk start berikutnya
+                with self._lock:
+                    self._rerun.pop(device_code, None)
+
+        if on_done:
+            try:
+                on_done(device_code, BufferResult(processed, result.remaining))
+            except Exception:
+                self._logger.exception("buffer_drain_failed", device_code=device_code)
+
+    def is_active(self, device_code: str) -> bool:
+        with self._lock:
+            return device_code in self._rerun
+
+    def active_count(self) -> int:
+        with self._lock:
+            return len(self._rerun)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
@@ -1,12 +1,19 @@
 import json
 import os
+import shutil
+import time
 from dataclasses import dataclass
 from threading import Lock
-from typing import Callable
+from typing import Any, Callable
 
 from mqtt_worker.utils.logger import get_logger
 
 
+_SEGMENT_SUFFIX = ".log"
+_CHECKPOINT_NAME = "checkpoint"
+_LEGACY_SUFFIX = ".jsonl"
+
+
 @dataclass(frozen=True)
 class BufferResult:
     processed: int
@@ -19,92 +26,492 @@ class ProcessDecision:
     checkpoint_offset: int | None = None
 
 
+@dataclass
+class _DeviceLog:
+    directory: str
+    segments: list[int]
+    committed: tuple[int, int]
+    read: tuple[int, int]
+    pending: int
+    read_since_commit: int = 0
+    active_size: int = 0
+    active_checked: bool = False
+
+    @property
+    def active_seq(self) -> int:
+        return self.segments[-1] if self.segments else self.committed[0]
+
+
 class FileBuffer:
-    def __init__(self, base_dir: str):
+    """Write-ahead log append-only per device, dipecah per segment.
+
+    Struktur: `<base_dir>/wal/<device_code>/<seq>.log` + file `checkpoint`
+    berisi posisi (segmen, offset) yang sudah aman tersimpan di DB. Append
+    dan proses hanya menyentuh ekor log sehingga biayanya O(1) per pesan,
+    berapapun besar backlog. Segmen yang sudah lewat checkpoint dihapus.
+    """
+
+    def __init__(
+        self,
+        base_dir: str,
+        segment_max_bytes: int = 4 * 1024 * 1024,
+        decoder: Callable[[bytes], Any] = json.loads,
+        observe_append: Callable[[float], None] | None = None,
+    ):
         self._base_dir = base_dir
+        self._segment_max_bytes = segment_max_bytes
+        self._decoder = decoder
+        # Callback metrik latensi tulis ke segmen (detik), opsional
+        self._observe_append = observe_append
         self._logger = get_logger(__name__)
-        self._lock = Lock()
+        self._locks_guard = Lock()
+        self._locks: dict[str, Lock] = {}
+        self._logs: dict[str, _DeviceLog] = {}
         os.makedirs(self._base_dir, exist_ok=True)
         self._bad_dir = os.path.join(self._base_dir, "bad")
         os.makedirs(self._bad_dir, exist_ok=True)
+        self._wal_dir = os.path.join(self._base_dir, "wal")
+        os.makedirs(self._wal_dir, exist_ok=True)
+        self._migrate_legacy_files()
+
+    def _device_lock(self, device_code: str) -> Lock:
+        lock = self._locks.get(device_code)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(device_code, Lock())
+        return lock
 
-    def _file_path(self, device_code: str) -> str:
-        return os.path.join(self._base_dir, f"{device_code}.jsonl")
+    def _device_dir(self, device_code: str) -> str:
+        return os.path.join(self._wal_dir, device_code)
 
     def _bad_path(self, device_code: str) -> str:
         return os.path.join(self._bad_dir, f"{device_code}.jsonl")
 
-    def append(self, device_code: str, record: dict) -> None:
-        line = json.dumps(record, ensure_ascii=False)
-        path = self._file_path(device_code)
-        with self._lock:
-            with open(path, "a", encoding="utf-8") as handle:
-                handle.write(line + "\n")
+    @staticmethod
+    def _segment_path(directory: str, seq: int) -> str:
+        return os.path.join(directory, f"{seq:012d}{_SEGMENT_SUFFIX}")
 
-    def list_devices(self) -> list[str]:
-        files = []
+    def _migrate_legacy_files(self) -> None:
+        """Pindahkan buffer lama `<device>.jsonl` menjadi segmen pertama WAL."""
         for name in os.listdir(self._base_dir):
-            if not name.endswith(".jsonl"):
+            legacy_path = os.path.join(self._base_dir, name)
+            if not name.endswith(_LEGACY_SUFFIX) or not os.path.isfile(legacy_path):
                 continue
-            if name == "bad":
+
+            device_code = name[: -len(_LEGACY_SUFFIX)]
+            directory = self._device_dir(device_code)
+            if os.path.exists(directory):
+                target = os.path.join(self._bad_dir, f"{device_code}.legacy-{int(time.time())}.jsonl")
+                os.replace(legacy_path, target)
+                self._logger.error("buffer_legacy_conflict", device_code=device_code, moved_to=target)
                 continue
-            files.append(name[:-6])
-        return files
 
-    def process(self, device_code: str, handler: Callable[[dict], ProcessDecision]) -> BufferResult:
-        path = self._file_path(device_code)
-        if not os.path.exists(path):
-            return BufferResult(0, 0)
+            os.makedirs(directory)
+            os.replace(legacy_path, self._segment_path(directory, 0))
+            self._logger.info("buffer_legacy_migrated", device_code=device_code)
 
-        with self._lock:
-            with open(path, "r", encoding="utf-8") as handle:
-                lines = handle.readlines()
+    def _load(self, device_code: str) -> _DeviceLog:
+        log = self._logs.get(device_code)
+        if log is not None:
+            return log
 
-            processed = 0
-            safe_index = -1
+        directory = self._device_dir(device_code)
+        os.makedirs(directory, exist_ok=True)
+        segments = sorted(
+            int(name[: -len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(_SEGMENT_SUFFIX) and name[: -len(_SEGMENT_SUFFIX)].isdigit()
+        )
+
+        committed = (segments[0], 0) if segments else (0, 0)
+        checkpoint_path = os.path.join(directory, _CHECKPOINT_NAME)
+        if os.path.exists(checkpoint_path):
+            try:
+                with open(checkpoint_path, "r", encoding="utf-8") as handle:
+                    seq_text, offset_text = handle.read().split()
+                committed = (int(seq_text), int(offset_text))
+            except Exception:
+                self._logger.exception("buffer_checkpoint_invalid", device_code=device_code)
+
+        # Segmen sebelum checkpoint sudah aman di DB (sisa crash saat hapus)
+        for seq in [seq for seq in segments if seq < committed[0]]:
+            os.remove(self._segment_path(directory, seq))
+            segments.remove(seq)
+        if segments and committed[0] not in segments:
+            committed = (segments[0], 0)
+        if not segments:
+            committed = (committed[0], 0)
+
+        pending = 0
+        for seq in segments:
+            start = committed[1] if seq == committed[0] else 0
+            with open(self._segment_path(directory, seq), "rb") as handle:
+                handle.seek(start)
+                for line in handle:
+                    if line.endswith(b"\n"):
+                        pending += 1
+
+        active_size = 0
+        if segments:
+            active_size = os.path.getsize(self._segment_path(directory, segments[-1]))
+
+        log = _DeviceLog(
+            directory=directory,
+            segments=segments,
+            committed=committed,
+            read=committed,
+            pending=pending,
+            active_size=active_size,
+        )
+        self._logs[device_code] = log
+        return log
+
+    def append(self, device_code: str, record: dict) -> None:
+        self.append_line(device_code, (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def append_line(self, device_code: str, line: bytes) -> None:
+        """Tambah satu baris yang sudah di-encode (harus diakhiri newline)."""
+        with self._device_lock(device_code):
+            self._append_locked(self._load(device_code), line)
+
+    def _append_locked(self, log: _DeviceLog, line: bytes) -> tuple[tuple[int, int], tuple[int, int], int]:
+        """Return (posisi awal, posisi akhir, jumlah baris belum dibaca sebelum baris ini)."""
+        if not log.segments:
+            log.segments.append(log.committed[0])
+            log.active_size = 0
+            log.active_checked = True
+        elif log.active_size >= self._segment_max_bytes:
+            log.segments.append(log.active_seq + 1)
+            log.active_size = 0
+            log.active_checked = True
+
+        started = time.perf_counter() if self._observe_append else 0.0
+        path = self._segment_path(log.directory, log.active_seq)
+        with open(path, "ab") as handle:
+            if not log.active_checked:
+                log.active_checked = True
+                # Baris terakhir terpotong (crash saat menulis): tutup dulu
+                # supaya record baru tidak tersambung ke baris rusak
+                if log.active_size > 0:
+                    with open(path, "rb") as reader:
+                        reader.seek(-1, os.SEEK_END)
+                        if reader.read(1) != b"\n":
+                            handle.write(b"\n")
+                            log.active_size += 1
+                            log.pending += 1
+            handle.write(line)
+        if self._observe_append:
+            self._observe_append(time.perf_counter() - started)
+
+        unread = log.pending - log.read_since_commit
+        start = (log.active_seq, log.active_size)
+        log.active_size += len(line)
+        log.pending += 1
+        return start, (log.active_seq, log.active_size), unread
+
+    def append_and_process(
+        self,
+        device_code: str,
+        line: bytes,
+        record: Any,
+        handler: Callable[[Any], ProcessDecision],
+    ) -> bool:
+        """Append lalu langsung proses `record` jika tidak ada backlog.
+
+        Jalur cepat untuk kondisi normal: record yang sudah di-decode diberikan
+        ke handler tanpa dibaca ulang dari disk. Return False jika ada backlog
+        atau handler gagal; record tetap di log dan harus diproses lewat
+        `process`.
+        """
+        with self._device_lock(device_code):
+            log = self._load(device_code)
+            start, end, unread = self._append_locked(log, line)
+            if unread:
+                return False
+
+            try:
+                decision = handler(record)
+            except Exception:
+                self._logger.exception("buffer_handler_failed", device_code=device_code)
+                return False
+            if not decision.success:
+                return False
+
+            log.read = end
+            log.read_since_commit += 1
+            if decision.checkpoint_offset is not None:
+                self._checkpoint_batch(device_code, log, [start], decision.checkpoint_offset + 1)
+            return True
+
+    def _checkpoint_batch(
+        self,
+        device_code: str,
+        log: _DeviceLog,
+        starts: list[tuple[int, int]],
+        commit_index: int,
+    ) -> None:
+        """Commit sampai record ke-`commit_index` dari batch yang baru dibaca.
+
+        `starts` berisi posisi awal tiap record di batch; index == len(starts)
+        berarti seluruh batch (sampai posisi baca saat ini).
+        """
+        if commit_index < 0:
+            return
+        positions = starts + [log.read]
+        consumed_before_batch = log.read_since_commit - len(starts)
+        self._commit(device_code, log, positions[commit_index], consumed_before_batch + commit_index)
+
+    def list_devices(self) -> list[str]:
+        return [
+            name
+            for name in os.listdir(self._wal_dir)
+            if os.path.isdir(os.path.join(self._wal_dir, name))
+        ]
 
-            for index, line in enumerate(lines):
+    def _iter_lines(self, log: _DeviceLog):
+        """Yield (start, end, raw) mulai dari posisi baca, hanya baris lengkap."""
+        seq, offset = log.read
+        for segment in log.segments:
+            if segment < seq:
+                continue
+            start_offset = offset if segment == seq else 0
+            with open(self._segment_path(log.directory, segment), "rb") as handle:
+                handle.seek(start_offset)
+                position = start_offset
+                for line in handle:
+                    if not line.endswith(b"\n"):
+                        return
+                    end = position + len(line)
+                    yield (segment, position), (segment, end), line
+                    position = end
+
+    def _write_checkpoint(self, log: _DeviceLog) -> None:
+        checkpoint_path = os.path.join(log.directory, _CHECKPOINT_NAME)
+        temp_path = checkpoint_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            handle.write(f"{log.committed[0]} {log.committed[1]}")
+        os.replace(temp_path, checkpoint_path)
+
+    def _commit(self, device_code: str, log: _DeviceLog, position: tuple[int, int], consumed: int) -> None:
+        log.committed = position
+        log.pending -= consumed
+        log.read_since_commit -= consumed
+
+        if log.pending == 0 and log.read == log.committed:
+            # Semua data sudah aman: hapus seluruh log device
+            shutil.rmtree(log.directory, ignore_errors=True)
+            self._logs.pop(device_code, None)
+            return
+
+        self._write_checkpoint(log)
+        for seq in [seq for seq in log.segments if seq < position[0]]:
+            os.remove(self._segment_path(log.directory, seq))
+            log.segments.remove(seq)
+
+    def capture(self, device_code: str, capture: Callable[[], Any]) -> tuple[tuple | None, tuple | None, Any] | None:
+        """Panggil `capture` di bawah lock device bersama posisi (committed, read).
+
+        Dipakai untuk snapshot state handler yang konsisten dengan posisi baca
+        WAL. Posisi None jika device tidak punya log yang terbuka. Return None
+        jika device sedang diproses (lock dipegang).
+        """
+        lock = self._device_lock(device_code)
+        if not lock.acquire(blocking=False):
+            return None
+        try:
+            log = self._logs.get(device_code)
+            if log is None:
+                return None, None, capture()
+            return log.committed, log.read, capture()
+        finally:
+            lock.release()
+
+    def run_if_caught_up(self, device_code: str, handler: Callable[[], ProcessDecision]) -> ProcessDecision | None:
+        """Jalankan `handler` (tanpa record) di bawah lock device jika tidak ada backlog.
+
+        Dipakai untuk flush state handler, misal sebelum pipeline idle dibuang.
+        Jika handler berhasil dengan `checkpoint_offset` tidak None, semua
+        record yang sudah dibaca di-commit. Return None jika device sedang
+        diproses atau masih punya record yang belum dibaca.
+        """
+        lock = self._device_lock(device_code)
+        if not lock.acquire(blocking=False):
+            return None
+        try:
+            log = self._logs.get(device_code)
+            if log is None and os.path.isdir(self._device_dir(device_code)):
+                log = self._load(device_code)
+            if log is not None and log.pending - log.read_since_commit > 0:
+                return None
+
+            try:
+                decision = handler()
+            except Exception:
+                self._logger.exception("buffer_handler_failed", device_code=device_code)
+                return ProcessDecision(success=False)
+            if decision.success and decision.checkpoint_offset is not None and log is not None:
+                self._commit(device_code, log, log.read, log.read_since_commit)
+            return decision
+        finally:
+            lock.release()
+
+    def restore_read_position(self, device_code: str, committed: tuple[int, int], read: tuple[int, int]) -> bool:
+        """Lompati record yang sudah diproses sebelum restart (sesuai snapshot).
+
+        Hanya berlaku jika checkpoint WAL belum bergeser sejak snapshot dan
+        `read` jatuh tepat di batas baris; record yang dilompati tetap
+        dihitung pending sampai checkpoint berikutnya. Return False jika
+        snapshot tidak cocok dengan isi WAL.
+        """
+        with self._device_lock(device_code):
+            if device_code not in self._logs and not os.path.isdir(self._device_dir(device_code)):
+                return False
+            log = self._load(device_code)
+            if log.committed != committed or log.read != log.committed or read < committed:
+                return False
+            if read == committed:
+                return True
+
+            skipped = 0
+            for _, end, _ in self._iter_lines(log):
+                if end > read:
+                    break
+                skipped += 1
+                if end == read:
+                    log.read = read
+                    log.read_since_commit = skipped
+                    return True
+            return False
+
+    def backlog(self) -> dict[str, int]:
+        """Record belum di-checkpoint per device yang sudah dimuat (hanya yang > 0).
+
+        Dibaca tanpa lock device; angka bisa tertinggal satu-dua record.
+        """
+        return {device_code: log.pending for device_code, log in list(self._logs.items()) if log.pending > 0}
+
+    def unread(self, device_code: str) -> int:
+        """Record yang belum dibaca handler (0 jika log device belum dimuat); tanpa lock device."""
+        log = self._logs.get(device_code)
+        return log.pending - log.read_since_commit if log is not None else 0
+
+    def pending(self, device_code: str) -> int:
+        """Jumlah record yang belum di-checkpoint."""
+        with self._device_lock(device_code):
+            if device_code not in self._logs and not os.path.isdir(self._device_dir(device_code)):
+                return 0
+            return self._load(device_code).pending
+
+    def process_batch(
+        self,
+        device_code: str,
+        handler: Callable[[list[Any]], bool],
+        max_records: int,
+    ) -> BufferResult:
+        """Panggil `handler` sekali untuk maksimal `max_records` record.
+
+        Checkpoint hanya maju jika `handler` mengembalikan True; jika gagal,
+        batch yang sama akan dibaca lagi pada pemanggilan berikutnya.
+        `handler` dijalankan di luar lock device sehingga append ke log yang
+        sama tidak menunggu handler (misal flush ke DB); pemanggil wajib
+        memastikan hanya ada satu `process_batch` per log pada satu waktu.
+        """
+        lock = self._device_lock(device_code)
+        with lock:
+            if device_code not in self._logs and not os.path.isdir(self._device_dir(device_code)):
+                return BufferResult(0, 0)
+            log = self._load(device_code)
+
+            records: list[Any] = []
+            lines = 0
+            end_position = log.read
+            for _, end, line in self._iter_lines(log):
+                if len(records) >= max_records:
+                    break
+                lines += 1
+                end_position = end
                 raw = line.strip()
                 if not raw:
                     continue
                 try:
-                    record = json.loads(raw)
-                except json.JSONDecodeError:
-                    with open(self._bad_path(device_code), "a", encoding="utf-8") as bad_handle:
-                        bad_handle.write(raw + "\n")
+                    records.append(self._decoder(raw))
+                except ValueError:
+                    with open(self._bad_path(device_code), "ab") as bad_handle:
+                        bad_handle.write(raw + b"\n")
                     self._logger.error("buffer_decode_failed", device_code=device_code)
-                    continue
 
-                try:
-                    decision = handler(record)
-                except Exception:
-                    self._logger.exception("buffer_handler_failed", device_code=device_code)
-                    decision = ProcessDecision(success=False)
+            if lines == 0:
+                return BufferResult(0, log.pending)
+
+        if records:
+            try:
+                success = handler(records)
+            except Exception:
+                self._logger.exception("buffer_handler_failed", device_code=device_code)
+                success = False
+            if not success:
+                return BufferResult(0, self.pending(device_code))
+
+        with lock:
+            if self._logs.get(device_code) is not log:
+                # Log sudah di-commit/dibuka ulang oleh pemanggil lain; jangan timpa posisinya
+                return BufferResult(len(records), self.pending(device_code))
+            log.read = end_position
+            log.read_since_commit += lines
+            self._commit(device_code, log, log.read, log.read_since_commit)
+            return BufferResult(len(records), log.pending)
+
+    def process(
+        self,
+        device_code: str,
+        handler: Callable[[Any], ProcessDecision],
+        max_records: int | None = None,
+    ) -> BufferResult:
+        with self._device_lock(device_code):
+            if device_code not in self._logs and not os.path.isdir(self._device_dir(device_code)):
+                return BufferResult(0, 0)
+            log = self._load(device_code)
 
-                if not decision.success:
+            processed = 0
+            starts: list[tuple[int, int]] = []
+            commit_index = -1
+
+            for start, end, line in self._iter_lines(log):
+                if max_records is not None and len(starts) >= max_records:
                     break
+                index = len(starts)
+                starts.append(start)
+                raw = line.strip()
+                if raw:
+                    try:
+                        record = self._decoder(raw)
+                    except ValueError:
+                        with open(self._bad_path(device_code), "ab") as bad_handle:
+                            bad_handle.write(raw + b"\n")
+                        self._logger.error("buffer_decode_failed", device_code=device_code)
+                        record = None
 
-                processed += 1
-                if decision.checkpoint_offset is not None:
-                    checkpoint_index = index + decision.checkpoint_offset
-                    if checkpoint_index >= safe_index:
-                        safe_index = checkpoint_index
+                    if record is not None:
+                        try:
+                            decision = handler(record)
+                        except Exception:
+                            self._logger.exception("buffer_handler_failed", device_code=device_code)
+                            decision = ProcessDecision(success=False)
 
-            remaining_lines = []
-            start_index = max(safe_index + 1, 0)
-            for tail in lines[start_index:]:
-                remaining_lines.append(tail if tail.endswith("\n") else tail + "\n")
+                        if not decision.success:
+                            starts.pop()
+                            break
 
-            if safe_index < 0:
-                return BufferResult(processed, len(remaining_lines))
+                        processed += 1
+                        if decision.checkpoint_offset is not None:
+                            # Semua record sebelum (index + offset + 1) sudah aman
+                            checkpoint_index = index + decision.checkpoint_offset + 1
+                            if checkpoint_index >= 0 and checkpoint_index > commit_index:
+                                commit_index = checkpoint_index
 
-            if not remaining_lines:
-                os.remove(path)
-                return BufferResult(processed, 0)
+                log.read = end
+                log.read_since_commit += 1
 
-            temp_path = path + ".tmp"
-            with open(temp_path, "w", encoding="utf-8") as temp_handle:
-                temp_handle.writelines(remaining_lines)
-            os.replace(temp_path, path)
+            self._checkpoint_batch(device_code, log, starts, commit_index)
 
-            return BufferResult(processed, len(remaining_lines))
\ No newline at end of file
+            return BufferResult(processed, log.pending)
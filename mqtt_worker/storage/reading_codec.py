@@ -0,0 +1,80 @@
+import json
+
+from mqtt_worker.processors.reading import Reading
+from mqtt_worker.processors.reading_batch import ReadingBatch, parse_batch
+
+
+# Format baris WAL: R1<TAB>device_id<TAB>receive_ts<TAB>username<TAB>device_code<TAB><payload MQTT asli>
+# Batch (topic swm-batch) memakai prefix B1 dengan header yang sama.
+_LINE_PREFIX = b"R1\t"
+_BATCH_LINE_PREFIX = b"B1\t"
+_UNSAFE_HEADER_BYTES = (b"\t", b"\n", b"\r")
+
+
+def encode_reading_line(reading: Reading | ReadingBatch, raw_payload: bytes | None, payload) -> bytes:
+    """Header kecil + byte payload MQTT apa adanya (tanpa json.dumps ulang).
+
+    Payload yang mengandung newline (atau tidak punya byte asli, misal dari
+    spill) di-serialisasi ulang dalam bentuk compact agar tetap satu baris.
+    """
+    username = reading.username.encode("utf-8")
+    device_code = reading.device_code.encode("utf-8")
+    is_batch = isinstance(reading, ReadingBatch)
+    if any(char in username or char in device_code for char in _UNSAFE_HEADER_BYTES):
+        if is_batch:
+            raise ValueError("username/device_code not allowed in batch header")
+        # Format lama (JSON penuh) untuk nama yang tidak aman di header
+        record = {
+            "username": reading.username,
+            "device_code": reading.device_code,
+            "device_id": reading.device_id,
+            "payload": payload,
+        }
+        return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+    body = raw_payload.strip() if raw_payload is not None else b""
+    if not body or b"\n" in body or b"\r" in body:
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    prefix = _BATCH_LINE_PREFIX if is_batch else _LINE_PREFIX
+    header = b"%s%d\t%.3f\t%s\t%s\t" % (prefix, reading.device_id, reading.received_at, username, device_code)
+    return header + body + b"\n"
+
+
+def decode_reading_line(line: bytes) -> Reading | ReadingBatch:
+    """Decode baris WAL (format header maupun JSON lama) menjadi Reading/ReadingBatch.
+
+    Raise ValueError jika baris rusak.
+    """
+    try:
+        if line.startswith(_LINE_PREFIX):
+            device_id, received_at, username, device_code, body = line[len(_LINE_PREFIX):].split(b"\t", 4)
+            return Reading.from_payload(
+                int(device_id),
+                username.decode("utf-8"),
+                device_code.decode("utf-8"),
+                json.loads(body),
+                received_at=float(received_at),
+            )
+
+        if line.startswith(_BATCH_LINE_PREFIX):
+            device_id, received_at, username, device_code, body = line[len(_BATCH_LINE_PREFIX):].split(b"\t", 4)
+            return parse_batch(
+                int(device_id),
+                username.decode("utf-8"),
+                device_code.decode("utf-8"),
+                json.loads(body),
+                float(received_at),
+            )
+
+        record = json.loads(line)
+        return Reading.from_payload(
+            record["device_id"],
+            record["username"],
+            record["device_code"],
+            record["payload"],
+        )
+    except ValueError:
+        raise
+    except Exception as exc:
+        raise ValueError(f"invalid buffer record: {exc}") from exc
\ No newline at end of file
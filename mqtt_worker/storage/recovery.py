@@ -1,21 +1,138 @@
+import time
+from threading import Event, Lock, Thread
 from typing import Callable
 
-from mqtt_worker.storage.file_buffer import FileBuffer, ProcessDecision
+from mqtt_worker.storage.drain import BufferDrainer
+from mqtt_worker.storage.file_buffer import BufferResult, FileBuffer, ProcessDecision
 from mqtt_worker.utils.logger import get_logger
 
 
 class RecoveryManager:
-    def __init__(self, buffer: FileBuffer):
+    """Replay backlog WAL semua device saat startup di latar belakang.
+
+    Device dijadwalkan ke `BufferDrainer` (pool terbatas) sehingga worker bisa
+    langsung subscribe MQTT. Pesan live untuk device yang masih recovery tetap
+    di-append ke WAL dan otomatis antre di belakang backlog-nya. Progress
+    (device selesai, record tersisa, ETA) di-log setiap `report_interval`.
+    """
+
+    def __init__(self, buffer: FileBuffer, drainer: BufferDrainer, report_interval: float = 5.0):
         self._buffer = buffer
+        self._drainer = drainer
+        self._report_interval = report_interval
         self._logger = get_logger(__name__)
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread: Thread | None = None
+        self._started_at = 0.0
+        self._finished_at: float | None = None
+        self._devices_total = 0
+        self._scheduled: list[str] = []
+        self._records_total = 0
+        self._done: set[str] = set()
+        # Device yang gagal dijadwalkan; dihitung macet agar recovery tetap bisa selesai
+        self._failed: set[str] = set()
+
+    def start(
+        self,
+        handler_factory: Callable[[str], Callable[[dict], ProcessDecision]],
+        on_done: Callable[[str, BufferResult], None] | None = None,
+    ) -> None:
+        if self._thread is not None:
+            return
+        self._started_at = time.monotonic()
+        self._thread = Thread(target=self._run, args=(handler_factory, on_done), name="recovery", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._report_interval + 5)
+            self._thread = None
+
+    def _run(
+        self,
+        handler_factory: Callable[[str], Callable[[dict], ProcessDecision]],
+        on_done: Callable[[str, BufferResult], None] | None,
+    ) -> None:
+        device_codes = self._buffer.list_devices()
+        with self._lock:
+            self._devices_total = len(device_codes)
+        self._logger.info("recovery_started", devices=len(device_codes))
+
+        last_report = time.monotonic()
+        for device_code in device_codes:
+            if self._stop.is_set():
+                return
+            try:
+                # Memuat log (hitung record) sebelum dijadwalkan agar total untuk ETA diketahui
+                self._buffer.pending(device_code)
+                unread = self._buffer.unread(device_code)
+                self._drainer.schedule(device_code, handler_factory(device_code), on_done)
+            except Exception:
+                self._logger.exception("recovery_schedule_failed", device_code=device_code)
+                with self._lock:
+                    self._failed.add(device_code)
+                continue
+            with self._lock:
+                self._scheduled.append(device_code)
+                self._records_total += unread
+            if time.monotonic() - last_report >= self._report_interval:
+                last_report = time.monotonic()
+                self._log_progress()
+
+        while not self._stop.wait(self._report_interval):
+            if self._log_progress()["devices_pending"] == 0:
+                break
+
+        progress = self.progress()
+        with self._lock:
+            self._finished_at = time.monotonic()
+        self._logger.info(
+            "recovery_completed",
+            devices=progress["devices_total"],
+            records=progress["records_total"],
+            stalled_devices=progress["devices_stalled"],
+            duration_seconds=round(self._finished_at - self._started_at, 3),
+        )
+
+    def _log_progress(self) -> dict:
+        progress = self.progress()
+        self._logger.info("recovery_progress", **progress)
+        return progress
+
+    def progress(self) -> dict:
+        with self._lock:
+            # Device selesai jika tidak lagi dikuras drainer; jika masih ada record
+            # belum dibaca berarti handler gagal (DB) dan device dianggap macet
+            remaining = 0
+            stalled = len(self._failed)
+            for device_code in self._scheduled:
+                if device_code in self._done:
+                    continue
+                unread = self._buffer.unread(device_code)
+                if self._drainer.is_active(device_code):
+                    remaining += unread
+                elif unread:
+                    stalled += 1
+                    remaining += unread
+                else:
+                    self._done.add(device_code)
 
-    def replay_all(self, handler_factory: Callable[[str], Callable[[dict], ProcessDecision]]) -> None:
-        for device_code in self._buffer.list_devices():
-            handler = handler_factory(device_code)
-            result = self._buffer.process(device_code, handler)
-            self._logger.info(
-                "recovery_processed",
-                device_code=device_code,
-                processed=result.processed,
-                remaining=result.remaining,
-            )
\ No newline at end of file
+            end = self._finished_at if self._finished_at is not None else time.monotonic()
+            elapsed = end - self._started_at
+            processed = max(self._records_total - remaining, 0)
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            devices_pending = self._devices_total - len(self._done) - stalled
+            return {
+                "devices_total": self._devices_total,
+                "devices_scheduled": len(self._scheduled),
+                "devices_done": len(self._done),
+                "devices_stalled": stalled,
+                "devices_pending": devices_pending,
+                "records_total": self._records_total,
+                "records_remaining": remaining,
+                "records_per_second": round(rate, 1),
+                "elapsed_seconds": round(elapsed, 1),
+                "eta_seconds": round(remaining / rate, 1) if rate > 0 and devices_pending else None,
+            }
@@ -0,0 +1,69 @@
+import json
+import os
+import struct
+import zlib
+
+from mqtt_worker.utils.logger import get_logger
+
+
+# Header: magic, versi format, panjang body, crc32 body (little-endian)
+_MAGIC = b"SWPS"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHxxII")
+
+
+class SnapshotStore:
+    """Simpan/muat snapshot state worker dalam satu file biner.
+
+    Format: header tetap (`_HEADER`) lalu body JSON compact. File ditulis ke
+    `.tmp`, di-fsync, lalu `os.replace` sehingga pembaca hanya pernah melihat
+    snapshot lama atau baru yang utuh. Snapshot dengan magic/versi/crc yang
+    tidak cocok diabaikan (worker start dingin seperti sebelumnya).
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._logger = get_logger(__name__)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def save(self, state: dict) -> int:
+        body = json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        header = _HEADER.pack(_MAGIC, _VERSION, len(body), zlib.crc32(body))
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "wb") as handle:
+            handle.write(header)
+            handle.write(body)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, self._path)
+        return len(header) + len(body)
+
+    def load(self) -> dict | None:
+        try:
+            with open(self._path, "rb") as handle:
+                data = handle.read()
+        except FileNotFoundError:
+            return None
+
+        if len(data) < _HEADER.size:
+            self._logger.warning("snapshot_invalid", path=self._path, reason="truncated header")
+            return None
+        magic, version, length, checksum = _HEADER.unpack_from(data)
+        body = data[_HEADER.size:]
+        if magic != _MAGIC:
+            reason = "bad magic"
+        elif version != _VERSION:
+            reason = f"unsupported version {version}"
+        elif len(body) != length or zlib.crc32(body) != checksum:
+            reason = "checksum mismatch"
+        else:
+            try:
+                return json.loads(body)
+            except ValueError:
+                reason = "invalid body"
+        self._logger.warning("snapshot_invalid", path=self._path, reason=reason)
+        return None
@@ -0,0 +1,70 @@
+import heapq
+import time
+from threading import Lock
+from typing import Hashable
+
+
+class ExpiryScheduler:
+    """Penjadwal kedaluwarsa berbasis heap.
+
+    `touch` hanya memperbarui deadline di dict (O(1)); heap menyimpan paling
+    banyak satu entri per key. Saat entri di puncak heap ternyata sudah
+    diperpanjang, entri itu dijadwalkan ulang ke deadline terbarunya, jadi
+    biaya `pop_expired` sebanding dengan jumlah key yang jatuh tempo, bukan
+    jumlah seluruh key.
+    """
+
+    def __init__(self, timeout_seconds: float):
+        self._timeout = timeout_seconds
+        self._lock = Lock()
+        self._deadlines: dict[Hashable, float] = {}
+        self._heap: list[tuple[float, Hashable]] = []
+
+    def touch(self, key: Hashable, now: float | None = None, timeout_seconds: float | None = None) -> None:
+        if now is None:
+            now = time.monotonic()
+        deadline = now + (self._timeout if timeout_seconds is None else timeout_seconds)
+        with self._lock:
+            current = self._deadlines.get(key)
+            self._deadlines[key] = deadline
+            if current is None or deadline < current:
+                heapq.heappush(self._heap, (deadline, key))
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._deadlines.pop(key, None)
+
+    def pop_expired(self, now: float | None = None) -> list:
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, key = heapq.heappop(self._heap)
+                current = self._deadlines.get(key)
+                if current is None or current < deadline:
+                    continue  # entri usang (sudah expired/discard lalu ditambah lagi)
+                if current > deadline:
+                    heapq.heappush(self._heap, (current, key))
+                    continue
+                del self._deadlines[key]
+                expired.append(key)
+        return expired
+
+    def seconds_until_next(self, now: float | None = None) -> float | None:
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            while self._heap:
+                deadline, key = self._heap[0]
+                current = self._deadlines.get(key)
+                if current is None or current < deadline:
+                    heapq.heappop(self._heap)
+                    continue
+                # Deadline yang sudah diperpanjang cukup membuat pemanggil bangun lebih awal
+                return max(0.0, deadline - now)
+            return None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._deadlines)
\ No newline at end of file
@@ -0,0 +1,289 @@
+import math
+import os
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Callable, Generic, Iterable, TypeVar
+
+
+# Batas bucket default (detik) untuk latensi per tahap ingest
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _CounterChild:
+    __slots__ = ("_lock", "_value")
+
+    def __init__(self):
+        self._lock = Lock()
+        self._value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def get(self) -> float:
+        return self._value
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_bounds", "_counts", "_sum", "_count")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self._lock = Lock()
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> tuple[list[int], float, int]:
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+
+_ChildT = TypeVar("_ChildT")
+_ScalarChildT = TypeVar("_ScalarChildT", bound=_CounterChild)
+
+
+class _Metric(Generic[_ChildT]):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], _ChildT] = {}
+        self._lock = Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self) -> _ChildT:
+        raise NotImplementedError
+
+    def labels(self, *values: str) -> _ChildT:
+        """Child untuk kombinasi label; simpan hasilnya agar jalur panas tidak lookup ulang."""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self) -> list[tuple[tuple[str, ...], _ChildT]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class _ScalarMetric(_Metric[_ScalarChildT]):
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}")
+        return lines
+
+
+class Counter(_ScalarMetric[_CounterChild]):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._children[()].inc(amount)
+
+
+class Gauge(_ScalarMetric[_GaugeChild]):
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._children[()].set(value)
+
+
+class Histogram(_Metric[_HistogramChild]):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        self._bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self._bounds)
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._items():
+            counts, total, count = child.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self._bounds + (math.inf,), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _CallbackGauge:
+    """Gauge yang nilainya diambil saat render dari `fn` -> {label_value: nilai}."""
+
+    def __init__(self, name: str, documentation: str, labelname: str, fn: Callable[[], dict]):
+        self.name = name
+        self.documentation = documentation
+        self._labelname = labelname
+        self._fn = fn
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for label_value, value in self._fn().items():
+            lines.append(f'{self.name}{{{self._labelname}="{_escape_label(label_value)}"}} {_format_value(value)}')
+        return lines
+
+
+class _StatsCollector:
+    """Ekspor dict `stats()` yang sudah ada sebagai gauge `<prefix>_<key>` (nilai non-angka dilewati)."""
+
+    def __init__(self, prefix: str, fn: Callable[[], dict]):
+        self._prefix = prefix
+        self._fn = fn
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, value in self._fn().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{self._prefix}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = Lock()
+        self._collectors: list = []
+
+    def register(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name: str, documentation: str, labelname: str, fn: Callable[[], dict]) -> None:
+        self.register(_CallbackGauge(name, documentation, labelname, fn))
+
+    def stats(self, prefix: str, fn: Callable[[], dict]) -> None:
+        self.register(_StatsCollector(prefix, fn))
+
+    def render(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors)
+        lines: list[str] = []
+        for collector in collectors:
+            try:
+                lines.extend(collector.render())
+            except Exception:
+                # Satu sumber stats yang error tidak boleh menggagalkan seluruh scrape
+                continue
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """Tulis atomik untuk textfile collector node_exporter."""
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            handle.write(self.render())
+        os.replace(temp_path, path)
+
+    def start_http_server(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                return
+
+        server = ThreadingHTTPServer((host, port), _Handler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+
+REGISTRY = MetricsRegistry()
+
+# Metrik ingest bersama (dipakai subscriber, worker, buffer, dan processor)
+INGEST_MESSAGES = REGISTRY.counter(
+    "mqtt_worker_messages_total", "Pesan MQTT per hasil pemrosesan", ("outcome",)
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "mqtt_worker_stage_seconds", "Latensi per tahap ingest", ("stage",)
+)
+DB_STATEMENTS = REGISTRY.counter(
+    "mqtt_worker_db_statements_total", "Jumlah statement SQL yang dikirim ke DB"
+)
+DEVICE_COMMANDS = REGISTRY.counter(
+    "mqtt_worker_device_commands_total", "Command MQTT yang dikirim ke device", ("command",)
+)